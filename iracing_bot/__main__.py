@@ -0,0 +1,161 @@
+import argparse
+import json
+
+from .answer_cache import AnswerCache
+from .fake_reddit import FakeReddit, generate_comments
+from .replay import run_replay
+from .responder import ResponseGenerator
+from .sporting_code import SportingCode
+from .store import SportingCodeLibrary
+
+
+def build_model(options):
+    """Trains the classifier and stores it so the bot can skip training when it starts"""
+    print(f"⌚️Training Response Generator from file {options.training}...")
+    ResponseGenerator(
+        training_file=options.training, model_path=options.model, engine=options.classifier
+    )
+    print(f"🎉Stored the trained model in {options.model}")
+
+
+def generate(options):
+    """Writes synthetic comments to a JSONL file for the replay command"""
+    with open(options.output, 'w') as f:
+        for record in generate_comments(
+            options.count, request_ratio=options.request_ratio,
+            duplicate_ratio=options.duplicate_ratio, seed=options.seed
+        ):
+            f.write(json.dumps(record) + '\n')
+
+
+def replay(options):
+    """Runs the bot against recorded or synthetic comments without touching Reddit"""
+    reddit = FakeReddit.from_jsonl(
+        options.comments, reply_latency=options.reply_latency,
+        latency_jitter=options.latency_jitter, error_rate=options.error_rate, seed=options.seed
+    )
+    sporting_code = None
+    if options.sporting_code:
+        sporting_code = SportingCode(options.sporting_code, snapshot_path=options.snapshot)
+        sporting_code.parse_pdf()
+    response_generator = ResponseGenerator(
+        training_file=options.training, model_path=options.model, engine=options.classifier,
+        sporting_code=sporting_code, prefilter_min_keywords=options.prefilter_min_keywords,
+        answer_cache=AnswerCache(
+            max_entries=options.answer_cache_size, common_share=options.answer_cache_common_share
+        ) if options.answer_cache_size else None
+    )
+    report = run_replay(
+        reddit, response_generator, sporting_code=sporting_code,
+        async_pipeline=options.async_pipeline, reply_workers=options.reply_workers
+    )
+    print(json.dumps(report, indent=2))
+
+
+def store_sporting_code(options):
+    """Parses a sporting code PDF into the library of memory mapped versions"""
+    sporting_code = SportingCode(options.sporting_code, snapshot_path=options.snapshot)
+    sporting_code.parse_pdf()
+    mapped = SportingCodeLibrary(options.store_dir).add(sporting_code)
+    print(f"🎉Stored version {mapped.version} ({len(mapped)} sections) in {mapped.path}")
+
+
+def diff_sporting_code(options):
+    """Prints what changed between two stored sporting code versions"""
+    library = SportingCodeLibrary(options.store_dir)
+    print(library.describe_changes(options.old, options.new, options.section, limit=options.limit))
+
+
+def parse_arguments():
+    p = argparse.ArgumentParser(
+        prog='python -m iracing_bot',
+        description='Maintenance commands for the iRacing Reddit bot, meant to run before deploys'
+    )
+    commands = p.add_subparsers(dest='command', required=True)
+
+    model = commands.add_parser('build-model', help='train and store the response classifier')
+    model.add_argument(
+        '-d', '--training', default='training.yaml', help='Training YAML file to load from'
+    )
+    model.add_argument(
+        '--model', default='.iracing_bot_model.pickle', help='File to store the trained model in'
+    )
+    model.add_argument(
+        '--classifier', choices=ResponseGenerator.ENGINES, default='textblob',
+        help='Naive Bayes implementation to train'
+    )
+    model.set_defaults(func=build_model)
+
+    comments = commands.add_parser(
+        'generate-comments', help='write synthetic comments as JSONL for the replay command'
+    )
+    comments.add_argument('output', help='JSONL file to write')
+    comments.add_argument('-n', '--count', type=int, default=10000)
+    comments.add_argument(
+        '--request-ratio', type=float, default=0.2, help='share of comments that summon the bot'
+    )
+    comments.add_argument(
+        '--duplicate-ratio', type=float, default=0.05, help='share of comments streamed twice'
+    )
+    comments.add_argument('--seed', type=int, default=None)
+    comments.set_defaults(func=generate)
+
+    store = commands.add_parser(
+        'store-sporting-code', help='add a sporting code version to the memory mapped store'
+    )
+    store.add_argument('sporting_code', help='URL or path of the sporting code PDF')
+    store.add_argument('--store-dir', default='.sporting_code_store')
+    store.add_argument('--snapshot', default=None, help='snapshot of the parsed sporting code')
+    store.set_defaults(func=store_sporting_code)
+
+    diff = commands.add_parser(
+        'diff-sporting-code', help='show the sections that changed between two stored versions'
+    )
+    diff.add_argument('old', help='version to compare from, like 2018.09')
+    diff.add_argument('new', help='version to compare to')
+    diff.add_argument('--section', default=None, help='only this section and those under it')
+    diff.add_argument('--limit', type=int, default=50, help='most changes to list')
+    diff.add_argument('--store-dir', default='.sporting_code_store')
+    diff.set_defaults(func=diff_sporting_code)
+
+    load = commands.add_parser(
+        'replay', help='load test the bot against a JSONL file of comments with a fake Reddit'
+    )
+    load.add_argument('comments', help='JSONL file of comments (id, body, author, created_utc)')
+    load.add_argument('-d', '--training', default='training.yaml')
+    load.add_argument('--model', default=None, help='stored model to load, if any')
+    load.add_argument('--classifier', choices=ResponseGenerator.ENGINES, default='numpy')
+    load.add_argument('--sporting-code', default=None, help='sporting code PDF to quote from')
+    load.add_argument('--snapshot', default=None, help='snapshot of the parsed sporting code')
+    load.add_argument(
+        '--answer-cache-size', type=int, default=0,
+        help='replies remembered for rephrased requests, 0 to answer every one afresh'
+    )
+    load.add_argument('--answer-cache-common-share', type=float, default=0.2)
+    load.add_argument(
+        '--prefilter-min-keywords', type=int, default=None,
+        help='only classify texts mentioning at least this many words of the training data'
+    )
+    load.add_argument('--async-pipeline', action='store_true')
+    load.add_argument('--reply-workers', type=int, default=4)
+    load.add_argument(
+        '--reply-latency', type=float, default=0.0, help='seconds every fake reply takes'
+    )
+    load.add_argument(
+        '--latency-jitter', type=float, default=0.0, help='extra random seconds per reply'
+    )
+    load.add_argument(
+        '--error-rate', type=float, default=0.0, help='share of replies that fail'
+    )
+    load.add_argument('--seed', type=int, default=None)
+    load.set_defaults(func=replay)
+    return p.parse_args()
+
+
+def main():
+    options = parse_arguments()
+    options.func(options)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+from collections import OrderedDict
+from threading import Lock
+import time
+
+from .metrics import METRICS
+from .search import SearchIndex
+
+
+class AnswerCache:
+    """
+    Remembers the replies made to recent requests, so that a rephrasing of an earlier request
+    gets the same reply without searching and rendering the sporting code again.
+
+    Replies are keyed on the search terms of the request (the stemmed words that aren't stop
+    words) that pick the reply. Numbers always do, as "rule 3.5" and "rule 3.6" need different
+    replies. Other terms only do if the sporting code has them in fewer than `common_share` of
+    its sections: terms it doesn't have at all are ignored by BM25, and ones most sections
+    have hardly move the ranking. So "how do incident points work" gets the reply made to
+    "what's the rule on incident points", but "black flags" doesn't get the one to "blue flags".
+
+    At most `max_entries` replies are kept, for `ttl` seconds at most, dropping the oldest
+    first.
+    """
+
+    def __init__(self, max_entries=1000, ttl=6 * 60 * 60, common_share=0.2):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.common_share = common_share
+        self.tokenizer = SearchIndex()     # only for its tokenizer
+        # key -> (answer, expiry time), in the order they were added
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, text, term_share=None):
+        """
+        The reply made to a rephrasing of the text, or None if there is none. `term_share`
+        gives the share of the sporting code sections a search term appears in, without it
+        every search term picks the reply.
+        """
+        key = self.key(text, term_share)
+        answer = None
+        with self.lock:
+            self.expire(time.monotonic())
+            if key:
+                entry = self.entries.get(key)
+                if entry is not None:
+                    answer = entry[0]
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        METRICS.increment(
+            'iracing_bot_answer_cache_total', outcome='miss' if answer is None else 'hit'
+        )
+        return answer
+
+    def put(self, text, answer, term_share=None):
+        key = self.key(text, term_share)
+        if not key:
+            return
+        with self.lock:
+            self.expire(time.monotonic())
+            self.entries.pop(key, None)
+            while len(self.entries) >= self.max_entries:
+                self.entries.popitem(last=False)
+            self.entries[key] = (answer, time.monotonic() + self.ttl)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def key(self, text, term_share=None):
+        """The search terms of the text that pick its reply
+        """
+        return frozenset(
+            term for term in self.tokenizer.tokenize(text)
+            if term_share is None or term[0].isdigit()
+            or 0 < term_share(term) < self.common_share
+        )
+
+    def expire(self, now):
+        """Drops the entries that outlived the ttl, which are always the oldest ones
+        """
+        while self.entries:
+            key, (_, expires_at) = next(iter(self.entries.items()))
+            if expires_at > now:
+                return
+            del self.entries[key]
+
+    def report(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None,
+            }
@@ -0,0 +1,157 @@
+from collections import deque
+from threading import Event, Thread
+import time
+
+from .cache import cache_key
+from .metrics import METRICS
+from .replay import percentile
+
+
+def micro_batches(items, batch_size=16, max_wait=1.0, clock=time.monotonic):
+    """
+    Groups the items of a praw stream into lists of at most `batch_size`, yielding each with
+    the seconds its first item waited. A batch that isn't full is handed over once its first
+    item has waited `max_wait` seconds, which is checked whenever the stream yields, so the
+    stream should be made with `pause_after` to yield None when it has nothing new. While
+    the stream is quiet praw polls every few seconds, which bounds how late a batch can be.
+    """
+    batch, started = [], None
+    for item in items:
+        if item is not None:
+            if not batch:
+                started = clock()
+            batch.append(item)
+        if batch and (len(batch) >= batch_size or clock() - started >= max_wait):
+            yield batch, clock() - started
+            batch = []
+    if batch:
+        yield batch, clock() - started
+
+
+class SubmissionAutoReplier:
+    """
+    Answers new submissions without being summoned, when the classifier is at least
+    `threshold` sure of their topic and the sporting code has something to quote on it.
+
+    Submissions are classified in micro-batches (see `micro_batches`) with a single call to
+    the response generator, which is where its relevance prefilter drops the obviously
+    off topic ones. Replies go through the bot, so they share its cache claims, reply
+    scheduler and footer. How long each batch waited and took is reported.
+    """
+
+    def __init__(self, bot, threshold=0.8, batch_size=16, max_wait=1.0, base_delay=5,
+                 max_delay=300):
+        self.bot = bot
+        self.threshold = threshold
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.base_delay = base_delay    # seconds before the stream is restarted after an error,
+        self.max_delay = max_delay      # doubling with every error in a row up to max_delay
+        self.batches = 0
+        self.submissions = 0
+        self.replied = 0
+        self.restarts = 0
+        self.failures = 0               # errors since a batch was last handled
+        self.latencies = deque(maxlen=1000)     # seconds from a batch's first item to handled
+        self.stopped = Event()
+
+    def begin_blocking_loop(self):
+        """
+        Auto-replies until stopped. The comment loop carries on regardless of this one, so a
+        network or Reddit error doesn't end it: the stream is made again after a backoff.
+        """
+        print(
+            f'Auto-replying to submissions on r/{self.bot.subreddit} with a probability of at '
+            f'least {self.threshold}'
+        )
+        while not self.stopped.is_set():
+            try:
+                self.stream_submissions()
+                return
+            except Exception as e:
+                delay = min(self.max_delay, self.base_delay * 2 ** self.failures)
+                self.failures += 1
+                self.restarts += 1
+                METRICS.increment('iracing_bot_auto_reply_restarts_total')
+                print(f'submission stream failed ({e!r}), restarting it in {delay:.0f}s')
+                self.stopped.wait(delay)
+
+    def stream_submissions(self):
+        subreddit = self.bot.reddit.subreddit(self.bot.subreddit)
+        stream = subreddit.stream.submissions(pause_after=0)
+        for batch, waited in micro_batches(stream, self.batch_size, self.max_wait):
+            self.handle_batch(batch, waited)
+            self.failures = 0
+            if self.stopped.is_set():
+                return
+
+    def stop(self):
+        self.stopped.set()
+
+    def start(self):
+        """Runs the loop on a background thread, next to the bot's comment loop
+        """
+        Thread(target=self.begin_blocking_loop, daemon=True).start()
+
+    def handle_batch(self, submissions, waited=0.0):
+        """Classifies the batch in one go and replies to the submissions it is sure about
+        """
+        started = time.perf_counter()
+        METRICS.increment('iracing_bot_submissions_received_total', len(submissions))
+        submissions = [
+            submission for submission in submissions
+            if submission.author is not None
+            and submission.author.name != self.bot.reddit.config.username
+        ]
+        with METRICS.timer('cache_check'):
+            cached = self.bot.response_cache.exists_many(
+                cache_key(submission) for submission in submissions
+            )
+        submissions = [
+            submission for submission in submissions if cache_key(submission) not in cached
+        ]
+        texts = [self.text(submission) for submission in submissions]
+        results = self.bot.response_generator.classify_batch(texts) if texts else []
+
+        replied = 0
+        for submission, text, (label, probability) in zip(submissions, texts, results):
+            if label is None or probability < self.threshold:
+                METRICS.increment('iracing_bot_submissions_skipped_total', reason='low_confidence')
+                continue
+            with METRICS.timer('respond'):
+                response = self.bot.response_generator.answer(text)
+            if response is None:
+                METRICS.increment('iracing_bot_submissions_skipped_total', reason='no_answer')
+                continue
+            print(f'auto-replying to submission {submission.id} ({label}, {probability:.2f})')
+            replied += self.bot.send_reply(submission, self.bot.amend_legalese(response))
+
+        elapsed = time.perf_counter() - started
+        METRICS.observe(METRICS.STAGE_METRIC, elapsed, stage='submission_batch')
+        self.batches += 1
+        self.submissions += len(results)
+        self.replied += replied
+        self.latencies.append(waited + elapsed)
+        print(
+            f'batch {self.batches}: {len(results)} submissions classified, {replied} replied, '
+            f'waited {waited * 1000:.0f}ms, handled in {elapsed * 1000:.0f}ms'
+        )
+        return replied
+
+    @staticmethod
+    def text(submission):
+        return f'{submission.title}\n{submission.selftext}'.strip()
+
+    def report(self):
+        latencies = sorted(self.latencies)
+        return {
+            'batches': self.batches,
+            'submissions': self.submissions,
+            'replied': self.replied,
+            'batch_latency_seconds': {
+                'p50': percentile(latencies, 0.5),
+                'p99': percentile(latencies, 0.99),
+                'max': latencies[-1] if latencies else None,
+            },
+            'restarts': self.restarts,
+        }
@@ -1,4 +1,10 @@
-from praw.exceptions import PRAWException
+import asyncio
+import time
+
+from .cache import cache_key
+from .matcher import TriggerMatcher
+from .metrics import METRICS
+from .pipeline import CommentPipeline
 
 
 DEFAULT_REPLY_FOOTER = """
@@ -13,17 +19,23 @@ DEFAULT_REPLY_FOOTER = """
 class IRacingBot:
     """Contains all of the functionality for the iRacing subreddit bot
     """
-    BOT_PREFIXES = ['!irbot']
+    BOT_PREFIXES = ['!irbot']      # and any aliases, all matched by a single regex
     REPLY_FOOTER = DEFAULT_REPLY_FOOTER
 
     def __init__(self, subreddit, sporting_code, reddit, response_generator,
-                 response_cache, verbose=True):
-        self.subreddit = subreddit
+                 response_cache, verbose=True, reply_scheduler=None, checkpoint=None,
+                 profiler=None):
+        # A list of subreddits is streamed as a single multireddit ("iracing+simracing")
+        self.subreddit = subreddit if isinstance(subreddit, str) else '+'.join(subreddit)
         self.sporting_code = sporting_code
         self.reddit = reddit
         self.response_generator = response_generator
         self.response_cache = response_cache
-        if not self.sporting_code.parsed:
+        self.reply_scheduler = reply_scheduler  # paces and retries replies if given
+        self.checkpoint = checkpoint            # skips comments processed before a restart
+        self.profiler = profiler                # samples the loop while it runs if given
+        self.trigger_matcher = TriggerMatcher(triggers=self.BOT_PREFIXES)
+        if self.sporting_code is not None and not self.sporting_code.parsed:
             self.sporting_code.parse_pdf()
 
     def begin_blocking_loop(self):
@@ -31,37 +43,156 @@ class IRacingBot:
         """
         print(f'Starting to listen on r/{self.subreddit}')
         subreddit = self.reddit.subreddit(self.subreddit)
-        # Constantly stream in new comments from the selected SubReddit
-        for comment in subreddit.stream.comments():
-            text = str(comment.body).strip()
-            # Skip if empty message or if its been replied to already
-            if not text or comment.author.name == self.reddit.config.username:
-                continue
-
-            if self.response_cache.comment_response_exists(comment.id):
-                print(f'comment {comment.id} by {comment.author.name} already is cached, skipping')
-                continue
-
-            # ignore comments if they aren't asking for the bot and strip it from the text
-            cur_prefix = ''
-            for prefix in self.BOT_PREFIXES:
-                if text.startswith(prefix):
-                    cur_prefix = prefix
-                    text = text.replace(cur_prefix, '', 1).strip()
-            if not cur_prefix:
-                continue
-
-            print(f'found comment {comment.id} by {comment.author.name}')
-            # we can now generate our message from the text
+        self.start_profiler()
+        try:
+            # Constantly stream in new comments from the selected SubReddit
+            for comment in self.stream_comments(subreddit):
+                self.handle_comment(comment)
+        finally:
+            self.shutdown()
+
+    def handle_comment(self, comment):
+        """Replies to the comment if it is asking for the bot and hasn't been answered yet
+        """
+        if not self.is_unprocessed(comment):
+            return
+        self.process_comment(comment)
+        # only once it's been dealt with, so a comment that raised is replayed after a restart
+        self.mark_processed(comment)
+
+    def process_comment(self, comment):
+        """Everything `handle_comment` does to a comment that isn't behind the checkpoint
+        """
+        # ignore comments if they aren't asking for the bot, before bothering the cache
+        text = self.extract_request(comment) if self.is_candidate(comment) else None
+        if text is None:
+            METRICS.increment('iracing_bot_comments_skipped_total', reason='not_a_request')
+            return
+
+        if self.is_cached(comment):
+            return
+
+        print(f'found comment {comment.id} by {comment.author.name}')
+        # we can now generate our message from the text
+        with METRICS.timer('respond'):
             response = self.response_generator.respond_to_request(text)
 
-            try:
-                comment.reply(self.amend_legalese(response))
-                self.response_cache.cache_comment_id(comment.id)
-            except PRAWException as e:
-                print(str(e))
+        if self.send_reply(comment, self.amend_legalese(response)):
             print(f'replied to comment {comment.id} by {comment.author.name}')
 
+    def begin_async_loop(self, reply_workers=4, queue_size=100):
+        """
+        Same as `begin_blocking_loop`, but the stream, cache lookups, classification and replies
+        run as separate stages so that one slow reply doesn't hold up everything behind it
+        """
+        print(f'Starting to listen on r/{self.subreddit} with {reply_workers} reply workers')
+        subreddit = self.reddit.subreddit(self.subreddit)
+        pipeline = CommentPipeline(self, reply_workers=reply_workers, queue_size=queue_size)
+        self.start_profiler()
+        try:
+            asyncio.run(pipeline.run(self.stream_comments(subreddit)))
+        finally:
+            self.shutdown()
+
+    def stream_comments(self, subreddit):
+        """Yields the comments streamed from the subreddit, timing how long each took to arrive
+        """
+        comments = iter(subreddit.stream.comments())
+        while True:
+            started = time.perf_counter()
+            try:
+                comment = next(comments)
+            except StopIteration:
+                return
+            METRICS.observe(
+                METRICS.STAGE_METRIC, time.perf_counter() - started, stage='stream_receive'
+            )
+            METRICS.increment('iracing_bot_comments_received_total')
+            yield comment
+
+    def start_profiler(self):
+        if self.profiler is not None:
+            self.profiler.start()
+
+    def shutdown(self):
+        """Stores where the stream got to and stops the profiler once a loop ends
+        """
+        if self.checkpoint is not None:
+            self.checkpoint.save()
+        if self.profiler is not None:
+            self.profiler.stop()
+
+    def is_unprocessed(self, comment):
+        """
+        Checks the comment against the stream checkpoint, noting it as being processed.
+        Comments the stream replays after a restart are dropped here without a cache lookup.
+        """
+        if self.checkpoint is None:
+            return True
+        if not self.checkpoint.is_new(comment):
+            METRICS.increment('iracing_bot_comments_skipped_total', reason='checkpoint')
+            return False
+        self.checkpoint.begin(comment)
+        return True
+
+    def mark_processed(self, comment):
+        """Lets the stream checkpoint move past the comment, once it has been dealt with
+        """
+        if self.checkpoint is not None:
+            self.checkpoint.complete(comment.id)
+
+    def is_candidate(self, comment):
+        """Skip if empty message or if it is one of our own
+        """
+        return bool(str(comment.body).strip()) and \
+            comment.author.name != self.reddit.config.username
+
+    def extract_request(self, comment):
+        """
+        Returns the text of the comment with the bot prefix stripped from it, or None if
+        the comment isn't asking for the bot
+        """
+        return self.trigger_matcher.extract_request(str(comment.body).strip())
+
+    def is_cached(self, comment):
+        """Checks the response cache for a reply we already made to the comment
+        """
+        with METRICS.timer('cache_check'):
+            cached = self.response_cache.comment_response_exists(cache_key(comment))
+        if cached:
+            METRICS.increment('iracing_bot_comments_skipped_total', reason='cached')
+            print(f'comment {comment.id} by {comment.author.name} already is cached, skipping')
+        return cached
+
+    def send_reply(self, comment, body):
+        """
+        Replies to the comment and caches it as responded to, returning whether it worked.
+        With a reply scheduler, failed replies are queued to be retried later.
+        """
+        # Claimed first, so that no other bot process sharing the cache replies to it as well
+        if not self.response_cache.claim(cache_key(comment)):
+            METRICS.increment('iracing_bot_comments_skipped_total', reason='claimed')
+            print(f'comment {comment.id} by {comment.author.name} was claimed by another bot')
+            return False
+        with METRICS.timer('reply'):
+            sent = self.post_reply(comment, body)
+        METRICS.increment('iracing_bot_replies_total', outcome='sent' if sent else 'failed')
+        return sent
+
+    def post_reply(self, comment, body):
+        if self.reply_scheduler is not None:
+            return self.reply_scheduler.reply(comment, body)
+        from praw.exceptions import PRAWException  # praw is slow to import, see connect_reddit
+
+        try:
+            comment.reply(body)
+            self.response_cache.cache_comment_id(cache_key(comment))
+        except PRAWException as e:
+            print(str(e))
+            self.response_cache.release(cache_key(comment))
+            return False
+        return True
+
     def amend_legalese(self, msg):
         """
         Slaps the legalese content onto whatever message is generated,
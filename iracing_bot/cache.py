@@ -1,11 +1,25 @@
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+import json
+import os
+from threading import Lock
+import time
 
-from diskcache import Cache as DiskCache
-import redis
+
+def cache_key(thing):
+    """
+    What a comment or submission is cached under. Comments use their id, as they always
+    have; submissions use their fullname ("t3_abc"), as their ids can clash with comment ids.
+    """
+    fullname = getattr(thing, 'fullname', '')
+    return fullname if fullname.startswith('t3_') else thing.id
 
 
 class Cache(ABC):
 
+    # Where the stream checkpoint is stored, next to the comment ids
+    CHECKPOINT_KEY = 'iracing_bot:stream_checkpoint'
+
     @abstractmethod
     def cache_comment_id(self, comment_id):
         pass
@@ -14,33 +28,297 @@ class Cache(ABC):
     def comment_response_exists(self, comment_id):
         pass
 
+    def exists_many(self, comment_ids):
+        """Returns the set of the given comment ids that have been responded to
+        """
+        return {
+            comment_id for comment_id in comment_ids if self.comment_response_exists(comment_id)
+        }
+
+    def add_many(self, comment_ids):
+        """Marks all of the given comment ids as responded to
+        """
+        for comment_id in comment_ids:
+            self.cache_comment_id(comment_id)
+
+    def claim(self, comment_id):
+        """
+        Marks the comment as responded to ahead of replying, returning False if it already
+        was. Caches that are shared between processes do this atomically, so that only one
+        bot process can ever reply to a comment.
+        """
+        if self.comment_response_exists(comment_id):
+            return False
+        self.cache_comment_id(comment_id)
+        return True
+
+    def release(self, comment_id):
+        """Gives up a claim after the reply failed, so the comment can be answered later
+        """
+
+    def load_checkpoint(self):
+        """Returns the last stored stream checkpoint, or None if the cache can't store one
+        """
+        return None
+
+    def save_checkpoint(self, checkpoint):
+        """Stores the stream checkpoint, a dict of JSON serialisable values
+        """
+
+    def flush(self):
+        """Writes out anything that is being held back, for caches that batch their writes
+        """
+
+    def close(self):
+        self.flush()
+
+
+class MemoryCache(Cache):
+    """
+    Keeps everything in a set in memory, which is only useful for tests and load testing
+    as it is forgotten as soon as the process stops
+    """
+
+    def __init__(self):
+        self.comment_ids = set()
+        self.checkpoint = None
+        self.lock = Lock()
+
+    def cache_comment_id(self, comment_id):
+        self.comment_ids.add(comment_id)
+
+    def comment_response_exists(self, comment_id):
+        return comment_id in self.comment_ids
+
+    def claim(self, comment_id):
+        with self.lock:
+            return super().claim(comment_id)
+
+    def release(self, comment_id):
+        self.comment_ids.discard(comment_id)
+
+    def load_checkpoint(self):
+        return self.checkpoint
+
+    def save_checkpoint(self, checkpoint):
+        self.checkpoint = dict(checkpoint)
+
 
 class FilesystemCache(Cache):
     """
     Maintains a cache on the local filestem
     This is not suitable for deployed applications as resources may turn and clear cache
+
+    The underlying diskcache connection stays open for the life of the cache and is safe to
+    share between threads. Once the cache grows past `size_limit` bytes the oldest stored
+    comments are evicted, and with a `ttl` every comment expires after that many seconds.
+    The stream checkpoint is kept apart, in a cache under `checkpoint/` that never evicts,
+    so that a busy stretch can't push it out and make the bot replay everything.
     """
 
-    def __init__(self, cache_directory):
-        self.cache = DiskCache(cache_directory)
+    def __init__(self, cache_directory, size_limit=64 * 1024 * 1024, ttl=None,
+                 eviction_policy='least-recently-stored'):
+        from diskcache import Cache as DiskCache  # only imported when the disk cache is used
+
+        self.ttl = ttl
+        self.cache = DiskCache(
+            cache_directory, size_limit=size_limit, eviction_policy=eviction_policy
+        )
+        self.checkpoints = DiskCache(
+            os.path.join(cache_directory, 'checkpoint'), eviction_policy='none'
+        )
 
     def cache_comment_id(self, comment_id):
-        with self.cache as cache:
-            cache.add(comment_id, True)
+        self.cache.add(comment_id, True, expire=self.ttl)
 
     def comment_response_exists(self, comment_id):
-        with self.cache as cache:
-            return cache.get(comment_id, default=False)
+        return self.cache.get(comment_id, default=False)
+
+    def claim(self, comment_id):
+        # add only stores the key if it isn't there, atomically across processes
+        return self.cache.add(comment_id, True, expire=self.ttl)
+
+    def release(self, comment_id):
+        self.cache.delete(comment_id)
+
+    def exists_many(self, comment_ids):
+        # A single transaction instead of one per lookup
+        with self.cache.transact():
+            return super().exists_many(comment_ids)
+
+    def add_many(self, comment_ids):
+        with self.cache.transact():
+            super().add_many(comment_ids)
+
+    def load_checkpoint(self):
+        checkpoint = self.checkpoints.get(self.CHECKPOINT_KEY)
+        if checkpoint is None:
+            # stored next to the comment ids before it got a cache of its own
+            checkpoint = self.cache.get(self.CHECKPOINT_KEY)
+        return checkpoint
+
+    def save_checkpoint(self, checkpoint):
+        self.checkpoints.set(self.CHECKPOINT_KEY, checkpoint)
+
+    def close(self):
+        self.cache.close()
+        self.checkpoints.close()
 
 
 class RedisCache(Cache):
 
-    def __init__(self, redis_url):
+    def __init__(self, redis_url, ttl=None):
         self.url = redis_url
+        self.ttl = ttl  # seconds before a cached comment id expires, None keeps them forever
+        import redis  # only imported when the redis cache is used
+
         self.conn = redis.from_url(self.url)
 
     def cache_comment_id(self, comment_id):
-        self.conn.set(comment_id, 1)
+        self.conn.set(comment_id, 1, ex=self.ttl)
 
     def comment_response_exists(self, comment_id):
         return self.conn.get(comment_id) is not None
+
+    def claim(self, comment_id):
+        # SET NX only succeeds for the first bot to get there
+        return bool(self.conn.set(comment_id, 1, nx=True, ex=self.ttl))
+
+    def release(self, comment_id):
+        self.conn.delete(comment_id)
+
+    def exists_many(self, comment_ids):
+        comment_ids = list(comment_ids)
+        if not comment_ids:
+            return set()
+        values = self.conn.mget(comment_ids)
+        return {comment_id for comment_id, value in zip(comment_ids, values) if value is not None}
+
+    def add_many(self, comment_ids):
+        # One round trip for the whole batch instead of one per comment
+        pipeline = self.conn.pipeline(transaction=False)
+        for comment_id in comment_ids:
+            pipeline.set(comment_id, 1, ex=self.ttl)
+        pipeline.execute()
+
+    def load_checkpoint(self):
+        value = self.conn.get(self.CHECKPOINT_KEY)
+        return json.loads(value) if value is not None else None
+
+    def save_checkpoint(self, checkpoint):
+        self.conn.set(self.CHECKPOINT_KEY, json.dumps(checkpoint))
+
+
+class TieredCache(Cache):
+    """
+    A small in-process LRU in front of another (slower, shared) cache such as Redis.
+
+    Comments we replied to are remembered locally, and so are comments the backend said it
+    hasn't seen, for `negative_ttl` seconds, so that the stream replaying the same comments
+    doesn't cost a round trip each. Writes are collected and sent to the backend in batches
+    of `write_batch_size`, or once `flush_interval` seconds have passed since the last one.
+    """
+
+    def __init__(self, backend, max_entries=10000, negative_ttl=60, write_batch_size=10,
+                 flush_interval=1.0):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.negative_ttl = negative_ttl
+        self.write_batch_size = write_batch_size
+        self.flush_interval = flush_interval
+        self.entries = OrderedDict()    # Comment id -> expiry time (None if it has a response)
+        self.pending = []               # Comment ids waiting to be written to the backend
+        self.last_flush = time.monotonic()
+        self.local_hits = 0
+        self.backend_lookups = 0
+        self.lock = Lock()
+
+    def cache_comment_id(self, comment_id):
+        self.add_many([comment_id])
+
+    def comment_response_exists(self, comment_id):
+        return comment_id in self.exists_many([comment_id])
+
+    def exists_many(self, comment_ids):
+        # Lookups happen constantly while streaming, so they also push out overdue writes
+        self.flush_if_due()
+        found = set()
+        missing = []
+        now = time.monotonic()
+        with self.lock:
+            for comment_id in comment_ids:
+                if comment_id not in self.entries:
+                    missing.append(comment_id)
+                    continue
+                expires_at = self.entries[comment_id]
+                if expires_at is not None and expires_at <= now:
+                    del self.entries[comment_id]
+                    missing.append(comment_id)
+                    continue
+                self.entries.move_to_end(comment_id)
+                self.local_hits += 1
+                if expires_at is None:
+                    found.add(comment_id)
+        if not missing:
+            return found
+
+        self.backend_lookups += len(missing)
+        existing = self.backend.exists_many(missing)
+        with self.lock:
+            for comment_id in missing:
+                expires_at = None if comment_id in existing else now + self.negative_ttl
+                self.remember(comment_id, expires_at)
+        return found | existing
+
+    def add_many(self, comment_ids):
+        with self.lock:
+            for comment_id in comment_ids:
+                self.remember(comment_id, None)
+                self.pending.append(comment_id)
+        self.flush_if_due()
+
+    def claim(self, comment_id):
+        # Always goes to the backend, the local entries can't tell what other processes did
+        claimed = self.backend.claim(comment_id)
+        with self.lock:
+            self.remember(comment_id, None)
+        return claimed
+
+    def release(self, comment_id):
+        with self.lock:
+            self.entries.pop(comment_id, None)
+            self.pending = [pending for pending in self.pending if pending != comment_id]
+        self.backend.release(comment_id)
+
+    def flush_if_due(self):
+        with self.lock:
+            due = len(self.pending) >= self.write_batch_size or (
+                self.pending and time.monotonic() - self.last_flush >= self.flush_interval
+            )
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+            self.last_flush = time.monotonic()
+        if pending:
+            self.backend.add_many(pending)
+
+    def load_checkpoint(self):
+        return self.backend.load_checkpoint()
+
+    def save_checkpoint(self, checkpoint):
+        self.backend.save_checkpoint(checkpoint)
+
+    def close(self):
+        self.flush()
+        self.backend.close()
+
+    def remember(self, comment_id, expires_at):
+        """Stores the entry in the LRU, evicting the least recently used one if it's full
+        """
+        self.entries[comment_id] = expires_at
+        self.entries.move_to_end(comment_id)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
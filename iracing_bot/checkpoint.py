@@ -0,0 +1,106 @@
+from collections import OrderedDict
+import time
+
+
+class StreamCheckpoint:
+    """
+    Remembers the newest comment the bot has processed, so that after a restart the ~100
+    comments PRAW replays at the start of a stream can be skipped without asking the cache.
+
+    Reddit ids are base 36 counters, so together with the creation time they order comments.
+    Comments are `begin`-ed as they come off the stream and `complete`-d once they have been
+    handled, and the checkpoint only moves up to a comment once it and every comment streamed
+    before it are complete, so a comment still waiting in a queue, or whose handling failed,
+    is replayed after a restart rather than skipped. Skipping only happens during that replay:
+    once the stream gets past the checkpoint, a comment that arrives late is handled like any
+    other and left to the response cache.
+
+    The checkpoint is written to the response cache every `save_every` comments, or once
+    `save_interval` seconds have passed since it was last written.
+    """
+
+    def __init__(self, cache, save_every=25, save_interval=10, max_pending=1000,
+                 clock=time.monotonic):
+        self.cache = cache
+        self.save_every = save_every
+        self.save_interval = save_interval
+        # PRAW only replays the last ~100 comments, so holding the checkpoint back behind a
+        # comment that never completes gains nothing after this many more have gone by
+        self.max_pending = max_pending
+        self.clock = clock
+        self.checkpoint = cache.load_checkpoint()  # {'fullname': ..., 'created_utc': ...}
+        self.replaying = self.checkpoint is not None
+        # comment id -> [checkpoint of the comment, whether it is complete], in stream order
+        self.pending = OrderedDict()
+        self.unsaved = 0
+        self.last_saved = clock()
+        self.skipped = 0    # comments skipped for being behind the checkpoint
+
+    def is_newer(self, comment):
+        """Whether the comment comes after the checkpoint
+        """
+        if self.checkpoint is None:
+            return True
+        return (comment.created_utc, int(comment.id, 36)) > self.order(self.checkpoint)
+
+    @staticmethod
+    def order(checkpoint):
+        return checkpoint['created_utc'], int(checkpoint['fullname'].split('_', 1)[-1], 36)
+
+    def is_new(self, comment):
+        """
+        Whether the comment still has to be handled, which after the replay at the start of
+        the stream is all of them. Counts the skips.
+        """
+        if not self.replaying:
+            return True
+        if self.is_newer(comment):
+            self.replaying = False
+            return True
+        self.skipped += 1
+        return False
+
+    def begin(self, comment):
+        """Notes that the comment is being handled, in stream order
+        """
+        self.pending[comment.id] = [
+            {'fullname': comment.fullname, 'created_utc': comment.created_utc}, False
+        ]
+        while len(self.pending) > self.max_pending:
+            self.pending[next(iter(self.pending))][1] = True
+            self.move_up()
+
+    def complete(self, comment_id):
+        """Notes that the comment has been handled, moving the checkpoint up if it can
+        """
+        entry = self.pending.get(comment_id)
+        if entry is None:
+            return
+        entry[1] = True
+        self.move_up()
+
+    def move_up(self):
+        """Advances past the complete comments at the front of the pending ones
+        """
+        while self.pending:
+            comment_id, (checkpoint, complete) = next(iter(self.pending.items()))
+            if not complete:
+                return
+            del self.pending[comment_id]
+            self.advance(checkpoint)
+
+    def advance(self, checkpoint):
+        """Moves the checkpoint up to the given one, if it is newer
+        """
+        if self.checkpoint is not None and self.order(checkpoint) <= self.order(self.checkpoint):
+            return
+        self.checkpoint = checkpoint
+        self.unsaved += 1
+        if self.unsaved >= self.save_every or self.clock() - self.last_saved >= self.save_interval:
+            self.save()
+
+    def save(self):
+        if self.checkpoint is not None and self.unsaved:
+            self.cache.save_checkpoint(self.checkpoint)
+        self.unsaved = 0
+        self.last_saved = self.clock()
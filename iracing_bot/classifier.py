@@ -0,0 +1,208 @@
+import string
+
+from nltk.tokenize.destructive import NLTKWordTokenizer
+import numpy as np
+
+
+class VectorizedNaiveBayes:
+    """
+    A drop-in for textblob's NaiveBayesClassifier (with its default `basic_extractor`) that
+    keeps the training data as NumPy count tables instead of one feature dict per document.
+
+    It follows the same model as textblob/nltk so both engines hand out the same labels: every
+    word seen in training is a "contains(word)" feature that is either True or False, each
+    feature value is smoothed with the expected likelihood estimate (add 0.5), and ties go to
+    the label that sorts last.
+
+    The tables only hold counts, so entries can be added or removed with `updated` at a cost
+    proportional to the change rather than retraining on everything.
+    """
+
+    _word_tokenizer = NLTKWordTokenizer()
+
+    def __init__(self, training_data):
+        self.labels = []            # Sorted labels, the rows of the tables below
+        self.vocabulary = {}        # Word -> column of the tables below
+        self.label_docs = None      # Number of training documents per label
+        self.word_docs = None       # Number of training documents per (label, word) with the word
+        self.vocabulary_docs = None  # Number of training documents each word was tokenized from
+        self.train(training_data)
+
+    @classmethod
+    def tokenize(cls, text):
+        """
+        The words textblob's `word_tokenize(text, include_punc=False)` returns. Sentences don't
+        need splitting first as that only ever changes how a trailing period is split off.
+        """
+        words = []
+        for word in cls._word_tokenizer.tokenize(text):
+            stripped = word.strip().strip(string.punctuation)
+            if stripped:
+                words.append(word if word.startswith("'") else stripped)
+        return words
+
+    @classmethod
+    def document_words(cls, text):
+        """The set of words used to decide which "contains(word)" features are True
+        """
+        return {word.strip().strip(string.punctuation) for word in cls.tokenize(text)}
+
+    def train(self, training_data):
+        """Builds the count tables from a list of (text, label) tuples
+        """
+        self.labels = sorted({label for _, label in training_data})
+        label_rows = {label: row for row, label in enumerate(self.labels)}
+
+        self.vocabulary = {}
+        vocabulary_columns = []
+        for text, _ in training_data:
+            for word in dict.fromkeys(self.tokenize(text)):  # unique words, in order
+                vocabulary_columns.append(self.vocabulary.setdefault(word, len(self.vocabulary)))
+
+        doc_labels = np.array([label_rows[label] for _, label in training_data], dtype=np.intp)
+        indptr, indices = self.vectorize(text for text, _ in training_data)
+        entry_labels = np.repeat(doc_labels, np.diff(indptr))
+
+        self.label_docs = np.bincount(doc_labels, minlength=len(self.labels))
+        self.word_docs = np.bincount(
+            entry_labels * len(self.vocabulary) + indices,
+            minlength=len(self.labels) * len(self.vocabulary)
+        ).reshape(len(self.labels), len(self.vocabulary))
+        self.vocabulary_docs = np.bincount(vocabulary_columns, minlength=len(self.vocabulary))
+        self.compute_log_probabilities()
+
+    def updated(self, added=(), removed=()):
+        """
+        Returns a copy of the model with the (text, label) tuples in `added` trained in and
+        the ones in `removed` taken back out, leaving this one untouched so it can keep being
+        used until the copy is swapped in. Only the changed texts are tokenized.
+        """
+        model = object.__new__(type(self))
+        model.labels = list(self.labels)
+        model.vocabulary = dict(self.vocabulary)
+        model.label_docs = self.label_docs.copy()
+        model.word_docs = self.word_docs.copy()
+        model.vocabulary_docs = self.vocabulary_docs.copy()
+        model.count(removed, -1)
+        model.count(added, 1)
+        model.sort_labels()
+        model.compute_log_probabilities()
+        return model
+
+    def count(self, training_data, sign):
+        """Adds (sign=1) or subtracts (sign=-1) the training documents from the count tables
+        """
+        training_data = list(training_data)
+        new_labels = sorted({label for _, label in training_data} - set(self.labels))
+        if new_labels:
+            self.labels.extend(new_labels)
+            self.label_docs = np.concatenate((self.label_docs, np.zeros(len(new_labels), int)))
+            self.word_docs = np.vstack(
+                (self.word_docs, np.zeros((len(new_labels), len(self.vocabulary)), int))
+            )
+        documents = [
+            (list(dict.fromkeys(self.tokenize(text))), text, label) for text, label in training_data
+        ]
+        known_words = len(self.vocabulary)
+        for words, _, _ in documents:
+            for word in words:
+                self.vocabulary.setdefault(word, len(self.vocabulary))
+        new_words = len(self.vocabulary) - known_words
+        if new_words:
+            zeros = np.zeros((len(self.labels), new_words), int)
+            self.word_docs = np.hstack((self.word_docs, zeros))
+            self.vocabulary_docs = np.concatenate((self.vocabulary_docs, np.zeros(new_words, int)))
+
+        label_rows = {label: row for row, label in enumerate(self.labels)}
+        for words, text, label in documents:
+            row = label_rows[label]
+            self.label_docs[row] += sign
+            # neither has repeated words, so no column is touched twice
+            self.word_docs[row, [self.vocabulary[word] for word in self.document_words(text)
+                                 if word in self.vocabulary]] += sign
+            self.vocabulary_docs[[self.vocabulary[word] for word in words]] += sign
+
+    def sort_labels(self):
+        """Drops the labels that no longer have any documents and puts the rest back in order
+        """
+        rows = sorted(
+            (row for row, docs in enumerate(self.label_docs) if docs > 0),
+            key=lambda row: self.labels[row]
+        )
+        self.labels = [self.labels[row] for row in rows]
+        self.label_docs = self.label_docs[rows]
+        self.word_docs = self.word_docs[rows]
+
+    def vectorize(self, texts):
+        """
+        Turns the texts into a sparse (CSR style) document-word matrix, returned as the row
+        pointers and the column indices of the words each document contains
+        """
+        indptr = [0]
+        indices = []
+        for text in texts:
+            columns = [self.vocabulary[word] for word in self.document_words(text)
+                       if word in self.vocabulary]
+            indices.extend(columns)
+            indptr.append(len(indices))
+        return np.array(indptr, dtype=np.intp), np.array(indices, dtype=np.intp)
+
+    def compute_log_probabilities(self):
+        """Derives the smoothed log probability tables from the counts
+        """
+        label_docs = self.label_docs[:, None]
+        total_docs = self.label_docs.sum()
+
+        # nltk only smooths over the values a feature actually took on during training
+        word_totals = self.word_docs.sum(axis=0)
+        bins = (word_totals > 0).astype(np.float64) + (word_totals < total_docs)
+        denominator = label_docs + 0.5 * bins
+        log_true = np.log((self.word_docs + 0.5) / denominator)
+        log_false = np.log((label_docs - self.word_docs + 0.5) / denominator)
+
+        log_prior = np.log(
+            (self.label_docs + 0.5) / (total_docs + 0.5 * len(self.labels))
+        )
+        # Score everything as if no word was present, then correct for the words that are
+        self.base_scores = log_prior + log_false.sum(axis=1)
+        self.present_deltas = log_true - log_false
+        # Words only left over from removed documents aren't features any more
+        self.present_deltas[:, self.vocabulary_docs == 0] = 0
+
+    def scores(self, texts):
+        """Unnormalised log probability of every label (columns) for every text (rows)
+        """
+        indptr, indices = self.vectorize(texts)
+        deltas = self.present_deltas[:, indices]
+        cumulative = np.concatenate(
+            (np.zeros((len(self.labels), 1)), np.cumsum(deltas, axis=1)), axis=1
+        )
+        per_document = cumulative[:, indptr[1:]] - cumulative[:, indptr[:-1]]
+        return (self.base_scores[:, None] + per_document).T
+
+    def classify_batch(self, texts):
+        """Returns a (label, probability) tuple for each of the texts
+        """
+        scores = self.scores(texts)
+        if not len(scores):
+            return []
+        probabilities = np.exp(scores - scores.max(axis=1, keepdims=True))
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        # Reversed argmax so that a tie goes to the label that sorts last, like nltk. Ties are
+        # matched with a tolerance, so that the rounding of an updated model can't break them
+        tied = probabilities >= probabilities.max(axis=1, keepdims=True) * (1 - 1e-9)
+        best = len(self.labels) - 1 - np.argmax(tied[:, ::-1], axis=1)
+        return [
+            (self.labels[row], float(probabilities[doc, row])) for doc, row in enumerate(best)
+        ]
+
+    def classify(self, text):
+        return self.classify_batch([text])[0][0]
+
+    def prob_classify(self, text):
+        """Returns a {label: probability} dict for the text
+        """
+        scores = self.scores([text])[0]
+        probabilities = np.exp(scores - scores.max())
+        probabilities /= probabilities.sum()
+        return dict(zip(self.labels, probabilities.tolist()))
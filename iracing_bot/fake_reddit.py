@@ -0,0 +1,148 @@
+import json
+import random
+from threading import Lock
+import time
+
+from praw.exceptions import RedditAPIException
+
+
+class FakeAuthor:
+
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeComment:
+    """Stands in for a praw Comment, replies are recorded by the FakeReddit it came from
+    """
+
+    def __init__(self, reddit, comment_id, body, author, created_utc, fail=False):
+        self.reddit = reddit
+        self.id = comment_id
+        self.fullname = f't1_{comment_id}'
+        self.body = body
+        self.author = FakeAuthor(author)
+        self.created_utc = created_utc
+        self.fail = fail            # always fail to reply to this comment
+        self.streamed_at = None     # when the stream handed the comment to the bot
+
+    def reply(self, body):
+        return self.reddit.reply(self, body)
+
+
+class FakeStream:
+
+    def __init__(self, reddit):
+        self.reddit = reddit
+
+    def comments(self):
+        for record in self.reddit.records:
+            comment = self.reddit.comment(record['id'])
+            comment.streamed_at = time.perf_counter()
+            yield comment
+
+
+class FakeSubreddit:
+
+    def __init__(self, reddit, display_name):
+        self.reddit = reddit
+        self.display_name = display_name
+        self.stream = FakeStream(reddit)
+
+
+class FakeConfig:
+
+    def __init__(self, username):
+        self.username = username
+
+
+class FakeAuth:
+
+    def __init__(self):
+        self.limits = {'remaining': None, 'reset_timestamp': None, 'used': None}
+
+
+class FakeReddit:
+    """
+    An offline stand-in for the parts of `praw.Reddit` the bot uses, driven by a list of comment
+    records (dicts with id, body, author, created_utc and optionally fail) such as the ones
+    stored in a JSONL file. Replies take `reply_latency` seconds (plus up to `latency_jitter`)
+    and fail with a RATELIMIT error `error_rate` of the time, or always for records with
+    "fail": true. Every reply is recorded so the results can be checked afterwards.
+    """
+
+    def __init__(self, records, username='irbot', reply_latency=0.0, latency_jitter=0.0,
+                 error_rate=0.0, seed=None):
+        self.records = list(records)
+        self.records_by_id = {record['id']: record for record in self.records}
+        self.config = FakeConfig(username)
+        self.auth = FakeAuth()
+        self.reply_latency = reply_latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = Lock()
+        self.comments = {}
+        self.replies = []       # (comment id, reply body, seconds since the comment was streamed)
+        self.errors = 0
+
+    @classmethod
+    def from_jsonl(cls, path, **kwargs):
+        with open(path, 'r') as f:
+            return cls((json.loads(line) for line in f if line.strip()), **kwargs)
+
+    def subreddit(self, display_name):
+        return FakeSubreddit(self, display_name)
+
+    def comment(self, comment_id):
+        with self.lock:
+            if comment_id not in self.comments:
+                record = self.records_by_id[comment_id]
+                self.comments[comment_id] = FakeComment(
+                    self, comment_id, record['body'], record.get('author', 'someone'),
+                    record.get('created_utc', 0), fail=record.get('fail', False)
+                )
+            return self.comments[comment_id]
+
+    def reply(self, comment, body):
+        with self.lock:
+            latency = self.reply_latency + self.random.uniform(0, self.latency_jitter)
+            fail = comment.fail or self.random.random() < self.error_rate
+        time.sleep(latency)
+        if fail:
+            with self.lock:
+                self.errors += 1
+            raise RedditAPIException([
+                ['RATELIMIT', 'you are doing that too much. try again in 1 second.', 'ratelimit']
+            ])
+        finished = time.perf_counter()
+        with self.lock:
+            started = comment.streamed_at if comment.streamed_at is not None else finished
+            self.replies.append((comment.id, body, finished - started))
+
+
+def generate_comments(count, request_ratio=0.2, duplicate_ratio=0.05, seed=None):
+    """
+    Generates synthetic comment records, `request_ratio` of which summon the bot and
+    `duplicate_ratio` of which repeat an earlier comment (like a stream restart would)
+    """
+    rng = random.Random(seed)
+    questions = [
+        'what is my safety rating', 'how do incident points work', 'where is the sporting code',
+        'how do I get my license promoted', 'what is 3.5 of the sporting code',
+    ]
+    records = []
+    for number in range(count):
+        if records and rng.random() < duplicate_ratio:
+            records.append(rng.choice(records))
+            continue
+        body = rng.choice(questions)
+        if rng.random() < request_ratio:
+            body = f'!irbot {body}'
+        records.append({
+            'id': f'{number + 1:x}',
+            'body': body,
+            'author': f'user{rng.randrange(1000)}',
+            'created_utc': 1600000000 + number,
+        })
+    return records
@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+from tempfile import NamedTemporaryFile
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlparse
+from urllib.request import Request, url2pathname, urlopen
+
+
+class FetchedDocument:
+    """A document that is available on the local filesystem along with its content hash
+    """
+
+    def __init__(self, path, sha256, from_cache=False):
+        self.path = path
+        self.sha256 = sha256
+        self.from_cache = from_cache    # True if the remote copy was not downloaded again
+
+
+class DocumentFetcher:
+    """
+    Keeps a local copy of remote documents (like the sporting code PDF) and only downloads
+    them again when the server says they changed, using ETag / Last-Modified revalidation.
+    Local paths and file:// URLs are used in place, which keeps everything working offline.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+    METADATA_SUFFIX = '.json'
+
+    def __init__(self, cache_directory='.sporting_code_cache', timeout=30):
+        self.cache_directory = cache_directory
+        self.timeout = timeout
+
+    def fetch(self, url):
+        """Returns a FetchedDocument for the given URL or local path
+        """
+        parsed_url = urlparse(url)
+        if parsed_url.scheme in ('', 'file'):
+            path = url2pathname(parsed_url.path) if parsed_url.scheme else url
+            return FetchedDocument(path, self.__hash_file(path), from_cache=True)
+        return self.__fetch_remote(url)
+
+    def cache_path(self, url):
+        """Location of the local copy for the given URL
+        """
+        name = hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.cache_directory, f'{name}.pdf')
+
+    def __fetch_remote(self, url):
+        path = self.cache_path(url)
+        metadata = self.__load_metadata(path)
+        if metadata.get('url') != url or not os.path.exists(path):
+            metadata = {}
+
+        request = Request(url)
+        if metadata.get('etag'):
+            request.add_header('If-None-Match', metadata['etag'])
+        if metadata.get('last_modified'):
+            request.add_header('If-Modified-Since', metadata['last_modified'])
+
+        try:
+            response = urlopen(request, timeout=self.timeout)
+        except HTTPError as e:
+            if e.code == 304:
+                return FetchedDocument(path, metadata['sha256'], from_cache=True)
+            if e.code < 500 or not metadata:
+                raise
+            # The server is having trouble, which says nothing about our copy being stale
+            print(f'Could not download {url} (HTTP {e.code}), using the cached copy')
+            return FetchedDocument(path, metadata['sha256'], from_cache=True)
+        except URLError as e:
+            if not metadata:
+                raise
+            # Better to run on a possibly stale copy than to not run at all
+            print(f'Could not reach {url} ({e.reason}), using the cached copy')
+            return FetchedDocument(path, metadata['sha256'], from_cache=True)
+
+        with response:
+            sha256 = self.__download(response, path)
+            metadata = {
+                'url': url,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'sha256': sha256,
+            }
+        self.__save_metadata(path, metadata)
+        return FetchedDocument(path, sha256)
+
+    def __download(self, response, path):
+        """Streams the response body to disk in chunks, returning the hash of the contents
+        """
+        os.makedirs(self.cache_directory, exist_ok=True)
+        digest = hashlib.sha256()
+        with NamedTemporaryFile('wb', dir=self.cache_directory, delete=False) as f:
+            try:
+                for chunk in iter(lambda: response.read(self.CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    f.write(chunk)
+            except BaseException:
+                f.close()
+                os.unlink(f.name)
+                raise
+        # The old metadata goes first, so a crash before the new one is written leaves no
+        # metadata rather than metadata describing the previous download
+        try:
+            os.unlink(path + self.METADATA_SUFFIX)
+        except FileNotFoundError:
+            pass
+        os.replace(f.name, path)
+        return digest.hexdigest()
+
+    def __save_metadata(self, path, metadata):
+        """Writes the metadata next to the document through a temporary file, like the body
+        """
+        with NamedTemporaryFile('w', dir=self.cache_directory, delete=False) as f:
+            try:
+                json.dump(metadata, f)
+            except BaseException:
+                f.close()
+                os.unlink(f.name)
+                raise
+        os.replace(f.name, path + self.METADATA_SUFFIX)
+
+    def __load_metadata(self, path):
+        try:
+            with open(path + self.METADATA_SUFFIX, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def __hash_file(self, path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
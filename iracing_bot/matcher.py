@@ -0,0 +1,147 @@
+import re
+from threading import Lock
+import time
+
+from .metrics import METRICS
+from .search import SearchIndex
+
+
+def alternation(phrases):
+    """
+    Regex matching any of the phrases, built from a trie of them so that phrases sharing a
+    prefix share a branch. Python's re tries alternatives one after the other, so this is
+    many times faster than a flat "a|b|c" once there are a few hundred phrases. Every optional
+    branch is greedy, so the longest phrase wins at any position.
+    """
+    trie = {}
+    for phrase in phrases:
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+        node[''] = {}   # a phrase ends here
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        if len(branches) == 1 and '' not in node:
+            return branches[0]
+        return '(?:' + '|'.join(branches) + ')' + ('?' if '' in node else '')
+
+    return build(trie)
+
+
+class TriggerMatcher:
+    """
+    One compiled regex for everything the bot looks for in a comment: the triggers (and
+    their aliases) that summon it, which have to start the comment, and keywords, which
+    can appear anywhere as whole words, in any case. A single scan of the text finds both,
+    however many there are.
+    """
+
+    def __init__(self, triggers=(), keywords=()):
+        self.triggers = sorted(set(triggers))
+        self.keywords = sorted({keyword.lower() for keyword in keywords})
+        parts = []
+        if self.triggers:
+            parts.append(rf'\A(?P<trigger>{alternation(self.triggers)})')
+        if self.keywords:
+            parts.append(rf'(?<!\w)(?i:(?P<keyword>{alternation(self.keywords)}))(?!\w)')
+        self.pattern = re.compile('|'.join(parts)) if parts else None
+
+    def extract_request(self, text):
+        """The text after the trigger it starts with, or None if it doesn't start with one
+        """
+        if not self.triggers:
+            return None
+        match = self.pattern.match(text)
+        if match is None or match.group('trigger') is None:
+            return None
+        return text[match.end():].strip()
+
+    def find_keywords(self, text, limit=None):
+        """The distinct keywords in the text in the order they appear, stopping at `limit`
+        """
+        found = []
+        if not self.keywords:
+            return found
+        for match in self.pattern.finditer(text):
+            keyword = match.group('keyword')
+            if keyword is None:
+                continue
+            keyword = keyword.lower()
+            if keyword not in found:
+                found.append(keyword)
+                if limit is not None and len(found) >= limit:
+                    break
+        return found
+
+
+class RelevancePrefilter:
+    """
+    Cheap check in front of the classifier: a text is only worth classifying if it mentions
+    at least `min_keywords` of the keywords, which are the meaningful words of the training
+    phrases. Everything else (most of a subreddit's comments) is rejected without being
+    classified. Counts of what was rejected and how long checking took are kept, along with
+    an estimate of the classifier time the rejections saved.
+    """
+
+    def __init__(self, keywords, min_keywords=1):
+        self.matcher = TriggerMatcher(keywords=keywords)
+        self.min_keywords = min_keywords
+        self.lock = Lock()
+        self.checked = 0
+        self.rejected = 0
+        self.seconds = 0.0              # spent in the prefilter
+        self.classified = 0
+        self.classify_seconds = 0.0     # spent classifying the texts that got through
+
+    @staticmethod
+    def training_keywords(training_data):
+        """Every word of the training phrases that isn't a stop word
+        """
+        return {
+            word
+            for text, _ in training_data
+            for word in SearchIndex.TOKEN_PATTERN.findall(text.lower().replace("'", ''))
+            if word not in SearchIndex.STOP_WORDS
+        }
+
+    def update_keywords(self, keywords):
+        """Swaps in a matcher for the new keywords, keeping the counts so far
+        """
+        self.matcher = TriggerMatcher(keywords=keywords)
+
+    def is_relevant(self, text):
+        started = time.perf_counter()
+        found = self.matcher.find_keywords(text, limit=self.min_keywords)
+        relevant = len(found) >= self.min_keywords
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.checked += 1
+            self.rejected += not relevant
+            self.seconds += elapsed
+        METRICS.observe(METRICS.STAGE_METRIC, elapsed, stage='prefilter')
+        METRICS.increment(
+            'iracing_bot_prefilter_total', outcome='passed' if relevant else 'rejected'
+        )
+        return relevant
+
+    def record_classification(self, count, seconds):
+        """Keeps track of what classifying the texts that got through cost
+        """
+        with self.lock:
+            self.classified += count
+            self.classify_seconds += seconds
+
+    def report(self):
+        with self.lock:
+            per_text = self.classify_seconds / self.classified if self.classified else None
+            return {
+                'checked': self.checked,
+                'rejected': self.rejected,
+                'prefilter_seconds': self.seconds,
+                'prefilter_seconds_per_text': self.seconds / self.checked if self.checked else None,
+                # what the rejected texts would have cost to classify, going by the others
+                'estimated_seconds_saved': self.rejected * per_text if per_text else None,
+            }
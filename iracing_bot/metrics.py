@@ -0,0 +1,195 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+import time
+
+
+class Histogram:
+    """Counts observations into fixed buckets, like a Prometheus histogram
+    """
+
+    # Upper bounds in seconds, from sub-millisecond cache hits up to a slow PDF download
+    BUCKETS = (
+        0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60,
+        float('inf'),
+    )
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)    # per bucket, made cumulative when rendered
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+
+class Metrics:
+    """
+    Counters and latency histograms for every stage of the bot, rendered in the Prometheus
+    text format. Each metric is identified by its name and labels, e.g.
+
+        metrics.increment('iracing_bot_replies_total', outcome='sent')
+        with metrics.timer('classify'):
+            ...
+    """
+
+    STAGE_METRIC = 'iracing_bot_stage_duration_seconds'
+    DESCRIPTIONS = {
+        STAGE_METRIC: 'Seconds spent in each stage of starting up and handling comments',
+        'iracing_bot_comments_received_total': 'Comments received from the stream',
+        'iracing_bot_comments_skipped_total': 'Comments that were not replied to, by reason',
+        'iracing_bot_replies_total': 'Reply attempts, by outcome',
+        'iracing_bot_submissions_received_total': 'Submissions received for auto-replies',
+        'iracing_bot_submissions_skipped_total':
+            'Submissions that were classified but not auto-replied to, by reason',
+        'iracing_bot_prefilter_total': 'Texts checked by the relevance prefilter, by outcome',
+        'iracing_bot_answer_cache_total': 'Requests looked up in the answer cache, by outcome',
+        'iracing_bot_answer_cache_entries': 'Replies remembered by the answer cache',
+        'iracing_bot_reply_retry_queue_depth': 'Failed replies waiting to be retried',
+    }
+
+    def __init__(self):
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}      # (name, labels) -> value
+            self.histograms = {}    # (name, labels) -> Histogram
+            self.gauges = {}        # (name, labels) -> function returning the current value
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def gauge(self, name, function, **labels):
+        """Registers a function that is called for the current value whenever it is rendered
+        """
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = function
+
+    @contextmanager
+    def timer(self, stage):
+        """Times the body of the `with` block as a stage of the bot
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(self.STAGE_METRIC, time.perf_counter() - started, stage=stage)
+
+    def count(self, name, **labels):
+        """The value of a counter, 0 if it was never incremented
+        """
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def histogram(self, stage):
+        """The histogram of a stage, None if it was never timed
+        """
+        return self.histograms.get((self.STAGE_METRIC, (('stage', stage),)))
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format
+        """
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = [
+                (key, list(histogram.cumulative_counts()), histogram.sum, histogram.count)
+                for key, histogram in sorted(self.histograms.items(), key=lambda item: item[0])
+            ]
+            gauges = sorted(self.gauges.items(), key=lambda item: item[0])
+
+        lines = []
+        described = set()
+
+        def describe(name, kind):
+            if name in described:
+                return
+            described.add(name)
+            if name in self.DESCRIPTIONS:
+                lines.append(f'# HELP {name} {self.DESCRIPTIONS[name]}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        for (name, labels), value in counters:
+            describe(name, 'counter')
+            lines.append(f'{name}{format_labels(labels)} {value}')
+        for (name, labels), function in gauges:
+            describe(name, 'gauge')
+            lines.append(f'{name}{format_labels(labels)} {function()}')
+        for (name, labels), buckets, total, count in histograms:
+            describe(name, 'histogram')
+            for bound, cumulative in buckets:
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", le),))} {cumulative}')
+            lines.append(f'{name}_sum{format_labels(labels)} {total}')
+            lines.append(f'{name}_count{format_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class MetricsServer:
+    """Serves the metrics at /metrics over HTTP on a background thread
+    """
+
+    def __init__(self, metrics, host='127.0.0.1', port=9108):
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass    # scrapes every few seconds would drown out the bot's own output
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# Shared by every part of the bot, the same way Prometheus client libraries use one registry
+METRICS = Metrics()
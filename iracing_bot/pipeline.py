@@ -0,0 +1,133 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread
+
+from .metrics import METRICS
+
+
+# Passed down the queues once the comment stream ends, telling each stage to stop
+STOP = object()
+
+
+class CommentPipeline:
+    """
+    Runs the bot as a set of asyncio stages joined by bounded queues:
+
+        stream -> filter (prefix + cache) -> classify -> N reply workers
+
+    PRAW is blocking, so the stream is read on its own thread and every other blocking call
+    (cache, classification, replying) is pushed onto a thread pool. The bounded queues apply
+    back pressure so a backlog of slow replies can't pile up in memory.
+
+    A comment id is claimed before anything else happens to it, which means it is never
+    replied to more than once, even if the stream hands it to us again. The stream
+    checkpoint is only told a comment is done once it leaves the pipeline, so the comments
+    still in the queues are replayed if the bot stops.
+    """
+
+    def __init__(self, bot, reply_workers=4, queue_size=100):
+        self.bot = bot
+        self.reply_workers = reply_workers
+        self.queue_size = queue_size
+        # Ids of the comments between the filter stage and the end of their reply. Once the
+        # reply is done the response cache has the comment, so the id can be let go of
+        self.claimed = set()
+        self.replied = 0
+        self.failed = 0
+
+    async def run(self, comments):
+        """Processes every comment from the (blocking) iterable until it is exhausted
+        """
+        loop = asyncio.get_running_loop()
+        # the filter and classify stages each need a thread next to the reply workers
+        with ThreadPoolExecutor(max_workers=self.reply_workers + 2) as executor:
+            loop.set_default_executor(executor)
+            incoming = asyncio.Queue(self.queue_size)
+            requests = asyncio.Queue(self.queue_size)
+            replies = asyncio.Queue(self.queue_size)
+
+            Thread(target=self.ingest, args=(comments, incoming, loop), daemon=True).start()
+            await asyncio.gather(
+                self.filter(incoming, requests),
+                self.classify(requests, replies),
+                *(self.reply(replies) for _ in range(self.reply_workers)),
+            )
+
+    def ingest(self, comments, incoming, loop):
+        """Feeds the blocking comment stream into the pipeline, runs on its own thread
+        """
+        try:
+            for comment in comments:
+                asyncio.run_coroutine_threadsafe(incoming.put(comment), loop).result()
+        finally:
+            asyncio.run_coroutine_threadsafe(incoming.put(STOP), loop).result()
+
+    async def filter(self, incoming, requests):
+        """Drops comments that aren't for the bot or that have been replied to already
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            comment = await incoming.get()
+            if comment is STOP:
+                await requests.put(STOP)
+                return
+
+            # A copy of a comment that is still in flight is dropped before the checkpoint
+            # hears of it, or finishing the copy would count the first one as done
+            if comment.id in self.claimed:
+                METRICS.increment('iracing_bot_comments_skipped_total', reason='claimed')
+                continue
+            if not self.bot.is_unprocessed(comment):
+                continue
+            text = self.bot.extract_request(comment) if self.bot.is_candidate(comment) else None
+            if text is None:
+                METRICS.increment('iracing_bot_comments_skipped_total', reason='not_a_request')
+                self.bot.mark_processed(comment)
+                continue
+            # Claimed before the cache lookup yields to the loop, so only one can get past
+            self.claimed.add(comment.id)
+            if await loop.run_in_executor(None, self.bot.is_cached, comment):
+                self.claimed.discard(comment.id)
+                self.bot.mark_processed(comment)
+                continue
+
+            print(f'found comment {comment.id} by {comment.author.name}')
+            await requests.put((comment, text))
+
+    async def classify(self, requests, replies):
+        """Generates the response for every request
+        """
+        loop = asyncio.get_running_loop()
+        generator = self.bot.response_generator
+        while True:
+            request = await requests.get()
+            if request is STOP:
+                for _ in range(self.reply_workers):
+                    await replies.put(STOP)
+                return
+            comment, text = request
+            response = await loop.run_in_executor(None, self.respond, generator, text)
+            await replies.put((comment, self.bot.amend_legalese(response)))
+
+    @staticmethod
+    def respond(generator, text):
+        with METRICS.timer('respond'):
+            return generator.respond_to_request(text)
+
+    async def reply(self, replies):
+        """Posts the responses, one of these runs per reply worker
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            reply = await replies.get()
+            if reply is STOP:
+                return
+            comment, response = reply
+            sent = await loop.run_in_executor(None, self.bot.send_reply, comment, response)
+            self.claimed.discard(comment.id)
+            self.bot.mark_processed(comment)
+            if not sent:
+                self.failed += 1
+                continue
+            self.replied += 1
+            print(f'replied to comment {comment.id} by {comment.author.name}')
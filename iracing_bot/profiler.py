@@ -0,0 +1,84 @@
+from collections import Counter
+import os
+import sys
+from threading import Event, Thread, get_ident
+import time
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of every running thread each `interval` seconds while the bot loop runs.
+    Unlike cProfile it doesn't hook every function call, so it costs little enough to be
+    switched on in production. The samples are written in the collapsed stack format that
+    flame graph tools (flamegraph.pl, speedscope, ...) read:
+
+        main.py:main;bot.py:begin_blocking_loop;bot.py:handle_comment;... 42
+
+    The bot loop normally runs until the process is killed, so the output is rewritten every
+    `write_interval` seconds while sampling, as well as when it stops.
+    """
+
+    def __init__(self, output_path=None, interval=0.01, write_interval=60, clock=time.monotonic):
+        self.output_path = output_path
+        self.interval = interval
+        self.write_interval = write_interval
+        self.clock = clock
+        self.samples = Counter()    # collapsed stack -> times it was seen
+        self.stopped = Event()
+        self.thread = None
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stops sampling and writes the samples to the output path, if there is one
+        """
+        if self.thread is None:
+            return
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
+        if self.output_path:
+            self.write(self.output_path)
+
+    def run(self):
+        own_thread = get_ident()
+        last_written = self.clock()
+        while not self.stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_thread:
+                    self.samples[self.collapse(frame)] += 1
+            if self.output_path and self.clock() - last_written >= self.write_interval:
+                self.write(self.output_path)
+                last_written = self.clock()
+
+    def report(self):
+        return {
+            'samples': sum(self.samples.values()),
+            'stacks': len(self.samples),
+            'output_path': self.output_path,
+        }
+
+    @staticmethod
+    def collapse(frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+    def collapsed(self):
+        """The samples as collapsed stack lines, most common first
+        """
+        return [f'{stack} {count}' for stack, count in self.samples.most_common()]
+
+    def write(self, path):
+        """Atomically writes the samples, so a kill part way through leaves the last copy
+        """
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(self.collapsed()) + '\n')
+        os.replace(tmp_path, path)
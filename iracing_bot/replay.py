@@ -0,0 +1,55 @@
+from collections import Counter
+import time
+
+from .bot import IRacingBot
+from .cache import MemoryCache
+
+
+def percentile(values, fraction):
+    """Nearest rank percentile of the already sorted values
+    """
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run_replay(reddit, response_generator, sporting_code=None, response_cache=None,
+               async_pipeline=False, reply_workers=4, **bot_kwargs):
+    """
+    Runs the bot over every comment of a FakeReddit and reports how it went: throughput,
+    how long replies took from the moment a comment was streamed, and whether any comment
+    was replied to more than once
+    """
+    bot = IRacingBot(
+        subreddit='replay',
+        sporting_code=sporting_code,
+        reddit=reddit,
+        response_generator=response_generator,
+        response_cache=response_cache if response_cache is not None else MemoryCache(),
+        **bot_kwargs
+    )
+    started = time.perf_counter()
+    if async_pipeline:
+        bot.begin_async_loop(reply_workers=reply_workers)
+    else:
+        bot.begin_blocking_loop()
+    elapsed = time.perf_counter() - started
+
+    replies_per_comment = Counter(comment_id for comment_id, _, _ in reddit.replies)
+    latencies = sorted(latency for _, _, latency in reddit.replies)
+    answer_cache = getattr(response_generator, 'answer_cache', None)
+    return {
+        'comments': len(reddit.records),
+        'elapsed_seconds': elapsed,
+        'comments_per_second': len(reddit.records) / elapsed if elapsed else None,
+        'replies': len(reddit.replies),
+        'reply_errors': reddit.errors,
+        'duplicate_replies': sum(count - 1 for count in replies_per_comment.values()),
+        'reply_latency_seconds': {
+            'p50': percentile(latencies, 0.5),
+            'p90': percentile(latencies, 0.9),
+            'p99': percentile(latencies, 0.99),
+            'max': latencies[-1] if latencies else None,
+        },
+        'answer_cache': answer_cache.report() if answer_cache is not None else None,
+    }
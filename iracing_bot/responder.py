@@ -1,6 +1,16 @@
-from textblob.classifiers import NaiveBayesClassifier
+from collections import Counter
+import hashlib
+import os
+import pickle
+import re
+from threading import Event, Thread
+import time
+
 import yaml
 
+from .matcher import RelevancePrefilter
+from .metrics import METRICS
+
 
 class ResponseGenerator:
     """
@@ -8,20 +18,296 @@ class ResponseGenerator:
     break down Reddit comments and generate (hopefully) inteligent responses
     """
 
-    def __init__(self, training_file=None, training_data=None):
+    # Bump this whenever the pickled model would no longer be compatible
+    MODEL_FORMAT_VERSION = 2
+    ENGINES = ('textblob', 'numpy')
+    # "what changed in 3.5 since 2018.09?"
+    CHANGE_PATTERN = re.compile(r'\b(?:chang(?:e|ed|es)|differen(?:t|ce|ces)|diff)\b', re.I)
+    # Without a stored version named, only these make it a question about versions, so
+    # "can I change tires" or "the difference between blue and black flags" aren't
+    VERSION_CHANGE_PATTERN = re.compile(
+        r'\b(?:chang(?:ed|es)|differen(?:t|ces?))\s+(?:between|since)\s+(?:the\s+)?versions?\b'
+        r'|\bchanged\s+since\b'
+        r'|\b(?:new|newest|latest|last|previous|old|current)\s+(?:version|sporting\s+code)\b',
+        re.I
+    )
+    VERSION_PATTERN = re.compile(r'\b\d{4}\.\d{2}\b')
+    # "rule 3.5.1", "section 4", "3.5." or "3.5"; versions like 2018.09 don't match
+    SECTION_REFERENCE_PATTERN = re.compile(
+        r'\b(?:section|rule|article)s?\s+(?P<named>\d{1,2}(?:\.\d+)*)'
+        r'|\b(?P<dotted>\d{1,2}(?:\.\d+)+)\b(?!\.\d)(?P<trailing>\.)?',
+        re.I
+    )
+
+    def __init__(self, training_file=None, training_data=None, sporting_code=None,
+                 model_path=None, engine='textblob', prefilter_min_keywords=None,
+                 answer_cache=None, library=None):
         if not training_file and not training_data:
             raise AssertionError('training_file or training_data must be passed to constructor')
+        if engine not in self.ENGINES:
+            raise AssertionError(f'engine must be one of {", ".join(self.ENGINES)}')
         self.training_file = training_file
+        self.engine = engine                # which Naive Bayes implementation to train
+        self.sporting_code = sporting_code  # used to quote rules from the sporting code
+        self.model_path = model_path        # trained classifier is stored here between starts
+        self.training_data = []             # (phrase, label) tuples the classifier was trained on
+        self.training_modified = None       # mtime of the training file when it was loaded
+        self.stopped = Event()
+        self.watcher = None                 # thread reloading the training file, if watched
+        self.prefilter = None               # skips classifying texts that can't be relevant
+        self.answer_cache = answer_cache    # reuses replies to rephrased requests if given
+        self.library = library              # other sporting code versions, to compare against
+
+        if training_data:
+            self.training_data = list(training_data)
+            self.classifier = self.train(self.training_data)
+        else:
+            self.load_training_file()
+        if prefilter_min_keywords:
+            self.prefilter = RelevancePrefilter(
+                RelevancePrefilter.training_keywords(self.training_data),
+                min_keywords=prefilter_min_keywords
+            )
+
+    def load_training_file(self):
+        """Loads the stored model, only retraining if the training file has changed since
+        """
+        self.training_modified = os.stat(self.training_file).st_mtime_ns
+        model_key = self.model_key()
+        self.training_data = self.__parse_yaml_data()
+        self.classifier = self.load_model(model_key)
+        if self.classifier is None:
+            self.classifier = self.train(self.training_data)
+            self.save_model(model_key)
+
+    def train(self, training_data):
+        """
+        Trains the classifier on a list of tuples of (phrase, label). textblob trains lazily,
+        so it is forced here to keep the cost at startup and inside any stored model.
+        """
+        # Each engine is only imported when used, textblob and nltk take a while to import
+        with METRICS.timer('train'):
+            if self.engine == 'numpy':
+                from .classifier import VectorizedNaiveBayes
+                return VectorizedNaiveBayes(training_data)
+            from textblob.classifiers import NaiveBayesClassifier
+            classifier = NaiveBayesClassifier(training_data)
+            classifier.classifier  # accessing this is what trains the classifier
+            return classifier
+
+    def reload_training(self):
+        """
+        Applies whatever changed in the training file since it was loaded, returning whether
+        anything did. The numpy engine only adds and removes the changed entries from its
+        counts, textblob has to retrain. Either way the new classifier is swapped in with a
+        single assignment, so comments being classified meanwhile just use the old one.
+        """
+        model_key = self.model_key()  # before parsing, so a later edit can't be saved under it
+        try:
+            training_data = self.__parse_yaml_data()
+        except (yaml.YAMLError, KeyError, TypeError) as e:
+            print(f'could not reload {self.training_file}, keeping the current model: {e}')
+            return False
+        new, old = Counter(training_data), Counter(self.training_data)
+        added, removed = list((new - old).elements()), list((old - new).elements())
+        if not added and not removed:
+            return False
+
+        with METRICS.timer('retrain'):
+            if self.engine == 'numpy':
+                classifier = self.classifier.updated(added, removed)
+            else:
+                classifier = self.train(training_data)
+        self.classifier = classifier
+        self.training_data = training_data
+        if self.prefilter is not None:
+            self.prefilter.update_keywords(RelevancePrefilter.training_keywords(training_data))
+        self.save_model(model_key)
+        print(f'reloaded {self.training_file}: {len(added)} entries added, {len(removed)} removed')
+        return True
+
+    def watch_training(self, interval=5):
+        """Reloads the training file every `interval` seconds if it changed, on a background thread
+        """
+        def run():
+            while not self.stopped.wait(interval):
+                try:
+                    modified = os.stat(self.training_file).st_mtime_ns
+                    if modified != self.training_modified:
+                        self.reload_training()
+                        self.training_modified = modified
+                except Exception as e:
+                    # the file can vanish while an editor swaps it, keep watching and retry
+                    print(f'could not reload {self.training_file}: {e!r}')
+        self.watcher = Thread(target=run, daemon=True)
+        self.watcher.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.watcher is not None:
+            self.watcher.join()
+
+    def model_key(self):
+        """Identifies the trained model by a hash of the training file it was built from
+        """
+        with open(self.training_file, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        return f'{self.MODEL_FORMAT_VERSION}:{self.engine}:{digest}'
+
+    def load_model(self, model_key):
+        """Returns the stored classifier if it was trained on the same data, otherwise None
+        """
+        if not self.model_path or not os.path.exists(self.model_path):
+            return None
+        try:
+            with open(self.model_path, 'rb') as f:
+                data = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return None
+        if data.get('key') != model_key:
+            return None
+        return data['classifier']
 
-        # Training data ultimately needs to be a list of tuples of (phrase, label)
-        training_data = training_data if training_data else self.__parse_yaml_data()
-        self.classifier = NaiveBayesClassifier(training_data)
+    def save_model(self, model_key):
+        """Atomically stores the trained classifier so the next start can skip training
+        """
+        if not self.model_path:
+            return
+        # one per process, as every shard's watcher saves the same retrained model at once
+        tmp_path = f'{self.model_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'key': model_key, 'classifier': self.classifier}, f)
+        os.replace(tmp_path, self.model_path)
 
     def respond_to_request(self, text):
         """
         Respond to a targeted request to the bot, meaning the person directly wanted a reply
         """
-        return 'Hi there! Im not configured yet!'
+        return self.answer(text) or 'Hi there! Im not configured yet!'
+
+    def answer(self, text):
+        """
+        The sporting code quote answering the text, reused from a rephrasing through the
+        answer cache if there is one, or None if nothing in the sporting code matches
+        """
+        changes = self.describe_changes(text)
+        if changes:
+            return changes
+        if self.answer_cache is None or self.sporting_code is None:
+            return self.quote_sporting_code(text)
+        term_share = self.sporting_code.term_share
+        with METRICS.timer('answer_cache'):
+            cached = self.answer_cache.get(text, term_share)
+        if cached is not None:
+            return cached
+        quote = self.quote_sporting_code(text)
+        if quote:
+            self.answer_cache.put(text, quote, term_share)
+        return quote
+
+    def describe_changes(self, text):
+        """
+        Answers questions about how the rules changed from the sporting code library, between
+        the versions named in the text, from the one named to the latest, or else between the
+        two latest. Only texts that name a stored version, or ask about versions outright
+        ("what changed since the last version"), are taken to be asking. Returns None if the
+        text isn't asking that or there's nothing to compare.
+        """
+        if self.library is None or not self.CHANGE_PATTERN.search(text):
+            return None
+        versions = self.library.versions()
+        named = sorted(
+            {version for version in self.VERSION_PATTERN.findall(text) if version in versions},
+            key=versions.index
+        )
+        if not named and not self.VERSION_CHANGE_PATTERN.search(text):
+            return None
+        if len(named) >= 2:
+            old, new = named[0], named[-1]
+        elif len(named) == 1 and named[0] != versions[-1]:
+            old, new = named[0], versions[-1]
+        elif not named and len(versions) >= 2:
+            old, new = versions[-2], versions[-1]
+        else:
+            return None
+        idx = self.referenced_idx(
+            self.VERSION_PATTERN.sub(' ', text),
+            lambda idx: any(self.library.get(version).get_section(idx) for version in (old, new))
+        )
+        return self.library.describe_changes(old, new, idx)
+
+    def classify_batch(self, texts):
+        """
+        Classifies each of the texts, returning a (label, probability) tuple for each. With a
+        prefilter, texts it rejects come back as (None, 0.0) without being classified.
+        """
+        if self.prefilter is None:
+            return self.classify_texts(texts)
+        relevant = [index for index, text in enumerate(texts) if self.prefilter.is_relevant(text)]
+        results = [(None, 0.0)] * len(texts)
+        started = time.perf_counter()
+        for index, result in zip(relevant, self.classify_texts([texts[i] for i in relevant])):
+            results[index] = result
+        self.prefilter.record_classification(len(relevant), time.perf_counter() - started)
+        return results
+
+    def classify_texts(self, texts):
+        with METRICS.timer('classify_batch'):
+            if self.engine == 'numpy':
+                return self.classifier.classify_batch(texts)
+            results = []
+            for text in texts:
+                distribution = self.classifier.prob_classify(text)
+                label = distribution.max()
+                results.append((label, distribution.prob(label)))
+            return results
+
+    def quote_sporting_code(self, text):
+        """
+        Finds the sporting code section that best matches the text and quotes it, or returns
+        None if there is no sporting code or nothing in it matches
+        """
+        if self.sporting_code is None:
+            return None
+        section = self.referenced_section(text)
+        if section is None:
+            with METRICS.timer('search'):
+                sections = self.sporting_code.search(text, k=1)
+            if not sections:
+                return None
+            section = sections[0]
+        with METRICS.timer('render'):
+            pages = section.page if isinstance(section.page, list) else [section.page]
+            pages = ', '.join(str(page) for page in pages)
+            return f'From the sporting code (page {pages}):\n\n{section.formatted()}'
+
+    def referenced_section(self, text):
+        """
+        The section the text names by its IDx, or the closest one above it when that section
+        doesn't exist (rule 3.5.9 gives 3.5.), or None if the text doesn't name a section
+        """
+        idx = self.referenced_idx(
+            text, lambda idx: self.sporting_code.get_section(idx) is not None
+        )
+        if idx is None:
+            return None
+        section = self.sporting_code.get_section(idx)
+        if section is None:
+            section = self.sporting_code.get_closest_ancestor(idx)
+        return section
+
+    def referenced_idx(self, text, exists):
+        """
+        The IDx, with its trailing period, of the first section the text names, or None. A
+        bare dotted number only names one if `exists` says there is such a section, since
+        "pit within 1.5 seconds" isn't about a rule, while "rule 1.5" or "1.5." (written the
+        way the sporting code writes them) always do.
+        """
+        for match in self.SECTION_REFERENCE_PATTERN.finditer(text):
+            idx = match.group('named') or match.group('dotted')
+            if match.group('named') or match.group('trailing') or exists(idx):
+                return idx + '.'
+        return None
 
     def __parse_yaml_data(self):
         """Parse out the dataset from the given YAML file
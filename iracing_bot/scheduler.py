@@ -0,0 +1,218 @@
+import json
+import random
+import re
+from threading import Event, Lock, Thread
+import time
+import uuid
+
+from .cache import cache_key
+
+
+class TokenBucket:
+    """
+    Classic token bucket: `rate` tokens are added every second, up to `capacity`, and every
+    reply takes one. Thread safe, since reply workers share a single bucket.
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+        self.lock = Lock()
+
+    def reserve(self):
+        """Takes a token, returning how many seconds to wait before it may be used
+        """
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class DiskRetryQueue:
+    """
+    Failed replies kept in a diskcache Cache, so they survive a restart. Keys start with the
+    zero padded time the entry may be retried at, and diskcache iterates keys in sorted order,
+    so the entry that is due first is always the first key.
+    """
+
+    def __init__(self, directory):
+        from diskcache import Cache  # only imported when the disk cache is used
+
+        # never evicted, a retry that is dropped is a reply that is never made
+        self.cache = Cache(directory=directory, eviction_policy='none')
+
+    def push(self, entry):
+        self.cache[f'{entry["not_before"]:020.6f}:{uuid.uuid4().hex}'] = entry
+
+    def pop_due(self, now):
+        """Returns the entry that has been due the longest, otherwise None
+        """
+        # in a transaction, so another bot process can't take the same entry meanwhile
+        with self.cache.transact():
+            for key in self.cache.iterkeys():
+                entry = self.cache[key]
+                if entry['not_before'] > now:
+                    return None
+                del self.cache[key]
+                return entry
+        return None
+
+    def __len__(self):
+        return len(self.cache)
+
+
+class RedisRetryQueue:
+    """Failed replies kept in a Redis sorted set, scored by when they may be retried
+    """
+
+    def __init__(self, conn, key='iracing_bot:reply_retries'):
+        self.conn = conn
+        self.key = key
+
+    def push(self, entry):
+        self.conn.zadd(self.key, {json.dumps(entry, sort_keys=True): entry['not_before']})
+
+    def pop_due(self, now):
+        for member in self.conn.zrangebyscore(self.key, '-inf', now, start=0, num=1):
+            # Whoever removes the member owns the retry, so two bots can't both send it
+            if self.conn.zrem(self.key, member):
+                return json.loads(member)
+        return None
+
+    def __len__(self):
+        return self.conn.zcard(self.key)
+
+
+class ReplyScheduler:
+    """
+    Paces replies to stay under Reddit's rate limits and retries the ones that fail.
+
+    Before every reply we wait for the token bucket and, if Reddit's rate limit headers say
+    the current window is used up, for the window to reset. A reply that fails is pushed to
+    a durable retry queue and retried from a background thread with exponential backoff and
+    full jitter, or after the delay Reddit asked for if that is longer.
+    """
+
+    # "you are doing that too much. try again in 9 minutes."
+    RATELIMIT_PATTERN = re.compile(r'(\d+) (millisecond|second|minute|hour)s?')
+    SECONDS_PER_UNIT = {'millisecond': 0.001, 'second': 1, 'minute': 60, 'hour': 3600}
+
+    def __init__(self, reddit, response_cache, retry_queue, rate=1.0, burst=5, max_attempts=5,
+                 base_delay=30, max_delay=3600, clock=time.time, sleep=time.sleep):
+        self.reddit = reddit
+        self.response_cache = response_cache
+        self.retry_queue = retry_queue
+        self.bucket = TokenBucket(rate, burst)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.clock = clock
+        self.sleep = sleep
+        self.current_delay = 0      # Seconds the last reply was held back by
+        self.stopped = Event()
+
+    @property
+    def queue_depth(self):
+        return len(self.retry_queue)
+
+    def reply(self, comment, body):
+        """
+        Replies to the comment once it is allowed to, marking it in the response cache.
+        Returns whether the reply was sent; if it wasn't it will be retried later.
+        """
+        entry = {'comment_id': cache_key(comment), 'body': body, 'attempts': 0}
+        return self.attempt(entry, comment)
+
+    def attempt(self, entry, comment=None):
+        # praw is only imported once a reply is made, it is slow to import
+        from praw.exceptions import PRAWException
+        from prawcore.exceptions import PrawcoreException
+
+        self.current_delay = max(self.bucket.reserve(), self.rate_limit_delay())
+        if self.current_delay:
+            self.sleep(self.current_delay)
+        try:
+            comment = comment if comment is not None else self.replied_to(entry['comment_id'])
+            comment.reply(entry['body'])
+        except (PRAWException, PrawcoreException) as e:
+            self.retry_later(entry, e)
+            return False
+        self.response_cache.cache_comment_id(entry['comment_id'])
+        return True
+
+    def replied_to(self, key):
+        """The comment or submission a retry entry replies to, see `cache_key`
+        """
+        if key.startswith('t3_'):
+            return self.reddit.submission(key[3:])
+        return self.reddit.comment(key)
+
+    def rate_limit_delay(self):
+        """Seconds until Reddit's rate limit window resets, if we have used it up
+        """
+        limits = self.reddit.auth.limits
+        remaining, reset_timestamp = limits.get('remaining'), limits.get('reset_timestamp')
+        if remaining is None or reset_timestamp is None or remaining >= 1:
+            return 0
+        return max(0, reset_timestamp - self.clock())
+
+    def retry_later(self, entry, error):
+        attempts = entry['attempts'] + 1
+        if attempts >= self.max_attempts:
+            print(f'giving up on replying to comment {entry["comment_id"]}: {error}')
+            self.response_cache.release(entry['comment_id'])
+            return
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempts))
+        delay = max(backoff, self.server_delay(error))
+        print(f'reply to comment {entry["comment_id"]} failed ({error}), retrying in {delay:.0f}s')
+        self.retry_queue.push(dict(entry, attempts=attempts, not_before=self.clock() + delay))
+
+    def server_delay(self, error):
+        """The backoff Reddit asked for in the error, if any
+        """
+        from praw.exceptions import RedditAPIException
+        from prawcore.exceptions import ResponseException
+
+        if isinstance(error, ResponseException):
+            retry_after = error.response.headers.get('retry-after', '')
+            return float(retry_after) if retry_after.isdigit() else 0
+        if isinstance(error, RedditAPIException):
+            for item in error.items:
+                match = self.RATELIMIT_PATTERN.search(item.message or '')
+                if item.error_type == 'RATELIMIT' and match:
+                    return int(match.group(1)) * self.SECONDS_PER_UNIT[match.group(2)]
+        return 0
+
+    def process_retries(self):
+        """Retries every reply that is due, returning how many were sent
+        """
+        sent = 0
+        entry = self.retry_queue.pop_due(self.clock())
+        while entry is not None:
+            try:
+                sent += self.attempt(entry)
+            except Exception as e:
+                # the entry is already off the queue, so put it back rather than lose it
+                print(f'retrying the reply to comment {entry["comment_id"]} failed: {e!r}')
+                self.retry_later(entry, e)
+            entry = self.retry_queue.pop_due(self.clock())
+        return sent
+
+    def start(self, interval=5):
+        """Processes the retry queue every `interval` seconds on a background thread
+        """
+        def run():
+            while not self.stopped.wait(interval):
+                try:
+                    self.process_retries()
+                except Exception as e:
+                    print(f'could not process the reply retry queue: {e!r}')
+        Thread(target=run, daemon=True).start()
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,103 @@
+from collections import Counter
+import heapq
+import math
+import re
+
+
+class SearchIndex:
+    """
+    Inverted index over documents (sporting code sections) ranked with Okapi BM25, so
+    people can ask about "incident points" without knowing that it lives under 3.5.
+
+    The BM25 weight of every (term, document) pair is worked out when the index is built,
+    which leaves nothing for a query to do except add up a handful of posting lists.
+    """
+
+    # Dotted numbers like section references ("3.5") and versions stay a single term
+    TOKEN_PATTERN = re.compile(r'[0-9]+(?:\.[0-9]+)+|[a-z0-9]+')
+    # Kept inline rather than pulling in the nltk stopwords corpus, which needs a download
+    STOP_WORDS = frozenset((
+        'a', 'about', 'an', 'and', 'any', 'are', 'as', 'at', 'be', 'by', 'can', 'do', 'does',
+        'for', 'from', 'has', 'have', 'how', 'i', 'if', 'in', 'is', 'it', 'its', 'me', 'my',
+        'of', 'on', 'or', 'so', 'that', 'the', 'their', 'there', 'this', 'to', 'was', 'what',
+        'whats', 'when', 'where', 'which', 'who', 'why', 'will', 'with', 'you', 'your',
+    ))
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.keys = []          # Document position -> key (the section IDx)
+        self.postings = {}      # Term -> list of [document position, BM25 weight]
+        from nltk.stem.porter import PorterStemmer  # nltk is slow to import, so only once needed
+
+        self.stemmer = PorterStemmer()
+        self.stems = {}         # Word -> stem, since stemming is the slow part of tokenising
+
+    def tokenize(self, text):
+        """Lowercases and splits the text into stemmed terms, leaving out stop words
+        """
+        terms = []
+        # Apostrophes are dropped so "what's" is one word rather than "what" and "s"
+        for word in self.TOKEN_PATTERN.findall(text.lower().replace("'", '')):
+            if word in self.STOP_WORDS:
+                continue
+            stem = self.stems.get(word)
+            if stem is None:
+                stem = self.stems[word] = self.stemmer.stem(word)
+            terms.append(stem)
+        return terms
+
+    def build(self, documents):
+        """Indexes the (key, text) pairs, replacing anything that was indexed before
+        """
+        self.keys = []
+        term_counts = []
+        for key, text in documents:
+            self.keys.append(key)
+            term_counts.append(Counter(self.tokenize(text)))
+
+        doc_count = len(term_counts)
+        lengths = [sum(counts.values()) for counts in term_counts]
+        avg_length = (sum(lengths) / doc_count) if doc_count else 0
+
+        postings = {}
+        for position, counts in enumerate(term_counts):
+            for term, count in counts.items():
+                postings.setdefault(term, []).append([position, count])
+
+        self.postings = {}
+        for term, entries in postings.items():
+            idf = math.log(1 + (doc_count - len(entries) + 0.5) / (len(entries) + 0.5))
+            for entry in entries:
+                position, count = entry
+                norm = 1 - self.b + self.b * lengths[position] / avg_length if avg_length else 1
+                entry[1] = idf * count * (self.k1 + 1) / (count + self.k1 * norm)
+            self.postings[term] = entries
+        return self
+
+    def search(self, query, k=5):
+        """Returns up to k (key, score) pairs for the query, best match first
+        """
+        scores = {}
+        for term in set(self.tokenize(query)):
+            for position, weight in self.postings.get(term, ()):
+                scores[position] = scores.get(position, 0) + weight
+        best = heapq.nlargest(k, scores.items(), key=lambda item: (item[1], -item[0]))
+        return [(self.keys[position], score) for position, score in best]
+
+    def term_share(self, term):
+        """The share of the documents the term appears in, 0 for terms that aren't indexed
+        """
+        return len(self.postings.get(term, ())) / len(self.keys) if self.keys else 0.0
+
+    def to_dict(self):
+        """Plain data version of the index so it can be stored alongside the sections
+        """
+        return {'k1': self.k1, 'b': self.b, 'keys': self.keys, 'postings': self.postings}
+
+    @classmethod
+    def from_dict(cls, data):
+        index = cls(k1=data['k1'], b=data['b'])
+        index.keys = data['keys']
+        index.postings = data['postings']
+        return index
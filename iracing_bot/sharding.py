@@ -0,0 +1,224 @@
+from bisect import bisect, insort
+import hashlib
+import multiprocessing
+import queue
+import time
+
+from .metrics import METRICS
+
+
+# Put on a worker's queue to tell it to finish up and exit
+STOP = None
+
+
+class HashRing:
+    """
+    Consistent hash ring mapping comment ids to workers. Every worker is placed on the ring
+    `replicas` times, so the ids spread evenly, and adding or removing a worker only moves
+    the ids of its own slice of the ring, which keeps every other worker's local cache warm.
+    """
+
+    def __init__(self, nodes=(), replicas=100):
+        self.replicas = replicas
+        self.ring = []      # sorted (hash, node) points
+        self.hashes = []    # just the hashes of the points, for bisecting
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def hash(key):
+        digest = hashlib.blake2b(str(key).encode('utf-8'), digest_size=8).digest()
+        return int.from_bytes(digest, 'big')
+
+    def add(self, node):
+        for replica in range(self.replicas):
+            insort(self.ring, (self.hash(f'{node}:{replica}'), node))
+        self.hashes = [point for point, _ in self.ring]
+
+    def remove(self, node):
+        self.ring = [(point, owner) for point, owner in self.ring if owner != node]
+        self.hashes = [point for point, _ in self.ring]
+
+    def node_for(self, key):
+        """The node owning the key, the first one clockwise of where the key hashes to
+        """
+        if not self.ring:
+            raise LookupError('the hash ring has no nodes')
+        return self.ring[bisect(self.hashes, self.hash(key)) % len(self.ring)][1]
+
+
+class QueuedComment:
+    """The parts of a comment the bot uses, as handed to a worker process
+    """
+
+    class Author:
+
+        def __init__(self, name):
+            self.name = name
+
+    def __init__(self, reddit, id, body, author, created_utc):
+        self.reddit = reddit
+        self.id = id
+        self.fullname = f't1_{id}'
+        self.body = body
+        self.author = self.Author(author)
+        self.created_utc = created_utc
+
+    @classmethod
+    def message(cls, comment):
+        """What gets sent to the worker, praw objects don't travel between processes well
+        """
+        return {
+            'id': comment.id,
+            'body': str(comment.body),
+            'author': comment.author.name if comment.author else '[deleted]',
+            'created_utc': comment.created_utc,
+        }
+
+    def reply(self, body):
+        # praw builds the comment lazily, so this doesn't fetch it again
+        return self.reddit.comment(self.id).reply(body)
+
+
+def run_worker(worker_factory, index, comments, handled):
+    """
+    Entry point of a worker process: builds its bot and handles comments until told to stop,
+    sending back the id of every comment it is done with
+    """
+    bot = worker_factory(index)
+    try:
+        while True:
+            message = comments.get()
+            if message is STOP:
+                return
+            bot.handle_comment(QueuedComment(bot.reddit, **message))
+            handled.put(message['id'])
+    finally:
+        if bot.reply_scheduler is not None:
+            bot.reply_scheduler.stop()
+        bot.response_cache.close()
+
+
+class ShardedBot:
+    """
+    Streams the comments of one or more subreddits (as a single multireddit stream) and
+    spreads them over `workers` processes by consistent hashing on the comment id, for when
+    a single process can't keep up.
+
+    Each worker builds its own bot with `worker_factory(index)`, which has to open its own
+    Reddit session and cache connection. The workers coordinate through that cache: a reply
+    is only sent once the comment has been claimed in it, so no comment is answered twice,
+    even when a worker dies part way through a comment and gets restarted. A worker that
+    died is restarted on the same queue, so the comments waiting for it aren't lost.
+
+    Workers are started through a fork server rather than forked from this process, which
+    by then runs threads (the metrics server, startup steps) that could be holding a lock the
+    child would wait on forever. So `worker_factory` has to be picklable, and each worker
+    loads what it needs itself, such as the memory mapped sporting code store, whose pages
+    the workers share anyway.
+    """
+
+    def __init__(self, subreddit, reddit, worker_factory, workers=2, checkpoint=None,
+                 queue_size=1000, start_method='forkserver'):
+        self.subreddit = subreddit if isinstance(subreddit, str) else '+'.join(subreddit)
+        self.reddit = reddit
+        self.worker_factory = worker_factory
+        self.checkpoint = checkpoint    # only the streaming process keeps track of the stream
+        self.context = multiprocessing.get_context(start_method)
+        self.ring = HashRing(range(workers))
+        self.queues = [self.context.Queue(queue_size) for _ in range(workers)]
+        self.handled = self.context.Queue()    # ids of the comments the workers are done with
+        self.processes = [None] * workers
+        self.restarts = 0
+
+    def begin_blocking_loop(self):
+        print(f'Starting to listen on r/{self.subreddit} with {len(self.queues)} worker processes')
+        for index in range(len(self.queues)):
+            self.start_worker(index)
+        subreddit = self.reddit.subreddit(self.subreddit)
+        try:
+            for comment in subreddit.stream.comments():
+                METRICS.increment('iracing_bot_comments_received_total')
+                if self.checkpoint is not None:
+                    if not self.checkpoint.is_new(comment):
+                        METRICS.increment('iracing_bot_comments_skipped_total', reason='checkpoint')
+                        continue
+                    self.checkpoint.begin(comment)
+                self.dispatch(comment)
+                self.collect_handled()
+        finally:
+            self.stop()
+            if self.checkpoint is not None:
+                self.checkpoint.save()
+
+    def collect_handled(self):
+        """
+        Lets the checkpoint move past the comments the workers have finished with. A comment
+        a worker died on never comes back, which keeps the checkpoint behind it so it is
+        replayed if the whole bot restarts soon.
+        """
+        while True:
+            try:
+                comment_id = self.handled.get_nowait()
+            except queue.Empty:
+                return
+            if self.checkpoint is not None:
+                self.checkpoint.complete(comment_id)
+
+    def dispatch(self, comment):
+        """Hands the comment to the worker that owns its id, restarting the worker if it died
+        """
+        index = self.ring.node_for(comment.id)
+        self.put(index, QueuedComment.message(comment))
+        return index
+
+    def put(self, index, message):
+        """Puts the message on the worker's queue, restarting the worker if it died
+        """
+        while True:
+            if not self.processes[index].is_alive():
+                self.restart_worker(index)
+            try:
+                # a timeout so a worker dying while its queue is full can't block us forever
+                self.queues[index].put(message, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def start_worker(self, index):
+        process = self.context.Process(
+            target=run_worker,
+            args=(self.worker_factory, index, self.queues[index], self.handled),
+            name=f'iracing-bot-worker-{index}', daemon=True
+        )
+        process.start()
+        self.processes[index] = process
+
+    def restart_worker(self, index):
+        print(f'worker {index} exited with {self.processes[index].exitcode}, restarting')
+        self.restarts += 1
+        self.start_worker(index)
+
+    def stop(self, timeout=30):
+        """Lets every worker finish the comments it was handed and waits for it to exit
+        """
+        for index, process in enumerate(self.processes):
+            if process is not None:
+                self.put(index, STOP)
+        for index, process in enumerate(self.processes):
+            if process is None:
+                continue
+            self.join(process, timeout)
+            if process.exitcode:
+                # it died before getting to STOP, so a new one finishes what was left for it
+                self.restart_worker(index)
+                self.join(self.processes[index], timeout)
+        self.collect_handled()
+
+    def join(self, process, timeout):
+        """Waits for the worker to exit, reading what it sends back so it can't block on it
+        """
+        deadline = time.monotonic() + timeout
+        while process.is_alive() and time.monotonic() < deadline:
+            self.collect_handled()
+            process.join(0.05)
@@ -0,0 +1,57 @@
+import gzip
+import json
+import os
+
+
+class SportingCodeSnapshot:
+    """
+    A compact on-disk copy of an already parsed sporting code. Parsing the PDF through
+    pdfminer is by far the slowest part of starting the bot, so once it has been done we
+    store the resulting sections and only redo it when the PDF (or the parser) changes.
+    """
+
+    FORMAT_VERSION = 4
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self, key):
+        """
+        Returns the stored data (section records, search index and version) if the snapshot
+        was built for the given key, otherwise None so the caller knows a full parse is required
+        """
+        if not self.path or not os.path.exists(self.path):
+            return None
+        try:
+            with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            # A corrupt or half-written snapshot is no worse than a missing one
+            return None
+        if data.get('format') != self.FORMAT_VERSION or data.get('key') != key:
+            return None
+        return data
+
+    def save(self, key, sections, search_index=None, version=None):
+        """
+        Atomically write the section records, search index and sporting code version to disk
+        under the given key
+        """
+        if not self.path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f'{self.path}.tmp'
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(
+                {
+                    'format': self.FORMAT_VERSION,
+                    'key': key,
+                    'sections': sections,
+                    'search_index': search_index,
+                    'version': version,
+                },
+                f,
+                separators=(',', ':')
+            )
+        os.replace(tmp_path, self.path)
@@ -1,9 +1,12 @@
-from io import StringIO, BytesIO
+from concurrent.futures import ProcessPoolExecutor
+from io import StringIO
+import os
 import re
-from urllib.request import urlopen
 
-from pdfminer.high_level import extract_text_to_fp
-from pdfminer.layout import LAParams
+from .fetch import DocumentFetcher
+from .metrics import METRICS
+from .search import SearchIndex
+from .snapshot import SportingCodeSnapshot
 
 
 class SportingCode:
@@ -13,35 +16,99 @@ class SportingCode:
     children's sections (if applicable).
     """
 
-    # Used to find the section indexes in the PDF
-    SECTION_IDX_REGEX = r'^[0-9](\.[0-9])?(\.[0-9])?(\.[0-9])?\.'
+    # Used to find the lines that start a new section, along with the section index
+    SECTION_LINE_PATTERN = re.compile(
+        r'^(?P<idx>[0-9](\.[0-9])?(\.[0-9])?(\.[0-9])?\.[^ ]*) (?P<text>.*)$'
+    )
+    # Every page ends in a footer with the sporting code version and the page number
+    PAGE_FOOTER_PATTERN = re.compile(r'\s*Version - (?P<version>[0-9.]+)\s*(\d+\s*)?\Z')
     SECTION_PART_SEPARATOR = '.'  # Separator that splits the indexes
-    # Used internally to make page breaks easier to parse
-    PAGE_BREAK_INDICATOR = '<!-- PAGE BREAK -->'
-
-    def __init__(self, remote_pdf_url, start_parsing_at=3, formatter=None, format_overrides=None):
-        self.url = remote_pdf_url                           # URL to the sporting code PDF
+    # Bump this whenever a change to the parser would produce different sections (or search
+    # index), so that any previously stored snapshots are thrown away
+    PARSER_VERSION = 4
+    # Pages handed to a worker process at a time during extraction
+    PAGES_PER_WORKER_TASK = 8
+
+    def __init__(self, remote_pdf_url, start_parsing_at=3, formatter=None, format_overrides=None,
+                 snapshot_path=None, cache_directory='.sporting_code_cache', workers=None):
+        self.url = remote_pdf_url                           # URL or path to the sporting code PDF
         self.start_page_parsing_at = start_parsing_at       # Skips pages 1...n-1 like cover & TOC
-        self.raw_content = BytesIO()                        # Raw PDF contents
-        self.raw_parsed_content = ''                        # Text contents of PDF minimally parsed
+        self.workers = workers or os.cpu_count() or 1       # Processes used to extract the PDF text
+        self.fetcher = DocumentFetcher(cache_directory)     # Keeps a revalidated copy of the PDF
+        self.document = None                                # Local copy of the PDF once fetched
+        self.section_index = {}                             # Section IDx -> section lookups
+        self.section_trie = SectionTrie()                   # Prefix tree over section IDx parts
         self.sections = []                                  # Sections (rules) in the sporting code
         self.top_level_sections = []                        # Top level sections (1., 2., 3.)
+        self.version = None                                 # From the page footers, '2018.09'
         self.parsed = False                                 # ensure this only gets parsed once
 
         # The default formatter for a section
         self.default_formatter = formatter if formatter is not None else Formatter()
         # Any markdown format overrides that are in the form of {'section IDx': <formatter>}
         self.format_overrides = format_overrides if format_overrides else dict()
+        # Parsed sections are stored here so we can skip pdfminer on a warm start
+        self.snapshot = SportingCodeSnapshot(snapshot_path) if snapshot_path else None
+
+    @property
+    def sections(self):
+        return self._sections
+
+    @sections.setter
+    def sections(self, sections):
+        """Replacing the sections also rebuilds the lookup structures over them
+        """
+        self._sections = sections
+        self.search_index = None  # built on demand, see `search`
+        self.section_index = {section.idx: section for section in sections}
+        self.section_trie = SectionTrie()
+        for section in sections:
+            self.section_trie.insert(self.split_idx(section.idx), section)
+
+    def split_idx(self, idx):
+        """Splits a section IDx into its parts, so '1.2.3.' becomes ('1', '2', '3')
+        """
+        return tuple(part for part in idx.split(self.SECTION_PART_SEPARATOR) if part)
 
     def get_section(self, idx):
-        """Linearly search for the section
+        """Looks up the section by its IDx, with or without the trailing period
         """
-        if not idx.endswith('.'):
-            idx = idx + '.'
-        for section in self.sections:
-            if section.idx == idx:
-                return section
-        return None
+        if not idx.endswith(self.SECTION_PART_SEPARATOR):
+            idx = idx + self.SECTION_PART_SEPARATOR
+        return self.section_index.get(idx)
+
+    def get_descendants(self, idx):
+        """Returns every section nested under the given IDx in document order
+        """
+        return self.section_trie.descendants(self.split_idx(idx))
+
+    def get_closest_ancestor(self, idx):
+        """
+        Returns the deepest existing section that contains the given IDx, which is
+        handy when someone asks for a section that does not exist, like 3.5.9.9.
+        """
+        return self.section_trie.closest_ancestor(self.split_idx(idx))
+
+    def search(self, query, k=5):
+        """Full text search over the section texts, returning up to k sections best match first
+        """
+        if self.search_index is None:
+            self.build_search_index()
+        return [self.section_index[idx] for idx, _ in self.search_index.search(query, k)]
+
+    def term_share(self, term):
+        """The share of the sections the (tokenized) search term appears in
+        """
+        if self.search_index is None:
+            self.build_search_index()
+        return self.search_index.term_share(term)
+
+    def build_search_index(self):
+        """Indexes the section texts for `search`
+        """
+        self.search_index = SearchIndex().build(
+            (section.idx, section.text) for section in self.sections
+        )
 
     def parse_pdf(self):
         """
@@ -52,142 +119,326 @@ class SportingCode:
         if self.parsed:
             return
 
-        self.raw_content.write(urlopen(self.url).read())
-        out_io = StringIO()
-        extract_text_to_fp(
-            self.raw_content,
-            out_io,
-            laparams=LAParams(),
-            output_type='text',
-            strip_control=True,
-            codec=None
-        )
-        # Saved directly as it was parsed by pdfminer.six
-        self.raw_parsed_content = out_io.getvalue().strip().replace("", "")
-
-        # We then run the content through a bunch of custom filters that will
-        # massage the PDF contents into something more friendly to parse
-        page_splitter = '\n\n'+self.PAGE_BREAK_INDICATOR
-
-        # 1. Since each page has the same footer, we can use that to replace
-        #    the hard to read page breaks with something that says `<! -- PAGE BREAK -->`
-        self.parsed_content = re.sub(
-            r'[\n ]*Version - 2018.09[\n ]*\d+[\n ]*',
-            page_splitter,
-            self.raw_parsed_content
-        )
+        with METRICS.timer('pdf_fetch'):
+            self.document = self.fetcher.fetch(self.url)
+        content_key = self.content_key()
+        with METRICS.timer('snapshot_load'):
+            loaded = self.load_snapshot(content_key)
+        if loaded:
+            self.parsed = True
+            return
 
-        # 2. Remove the first couple pages (title and table of contents) since we
-        #    don't really care to parse these
-        self.parsed_content = self.parsed_content.split(
-            page_splitter,
-            self.start_page_parsing_at-1
-        )[self.start_page_parsing_at-1]
+        with METRICS.timer('pdf_parse'):
+            # 1. Extract the text of every page we care about (skipping the title and table
+            #    of contents), spread over multiple processes since pdfminer.six is slow
+            # 2. Iterate through the sporting code and if the line contains a section ID
+            #    then we will create a new section, or else we will keep appending to the current.
+            self.parse_content_into_sections(self.iter_content_lines(self.iter_page_texts()))
 
-        # 3. Iterate through the sporting code and if the line contains a section ID or index
-        #    then we will create a new section, or else we will keep appending to the current.
-        self.parse_content_into_sections()
+            # 3. Try to build a section hierarchy, meaning 1.1. is a child of 1.
+            #    This will allow us to easily grab all sections including children
+            self.build_section_hierarchy()
 
-        # 4. Try to build a section hierarchy, meaning 1.1. is a child of 1.
-        #    This will allow us to easily grab all sections including children
-        self.build_section_hierarchy()
+            # 4. Index the text of every section so they can be searched by what they say
+            self.build_search_index()
 
         # Uncomment this if you want to write the sporting code to a file to check it
         # with open('sporting_code.md', 'w') as f:
         #     f.write(self.markdown())
 
+        self.save_snapshot(content_key)
         self.parsed = True
 
-    def parse_content_into_sections(self):
-        """Parse the raw PDF output into defined, concrete sections that match section IDs
+    def content_key(self):
         """
-        page = 1  # index starting at 1 for the plebs
-        self.sections = []
-        for line in map(lambda x: x.strip(), self.parsed_content.split('\n')):
-            line = line.strip()
-            if not line:  # remove empty lines
-                continue
+        Identifies the parse output of the downloaded PDF. Anything that changes the
+        resulting sections (the PDF, the parser, where parsing starts) must be part of it.
+        """
+        return f'{self.PARSER_VERSION}:{self.start_page_parsing_at}:{self.document.sha256}'
+
+    def load_snapshot(self, content_key):
+        """
+        Restores the sections and their hierarchy from the snapshot if it matches the
+        content key. Returns whether or not the snapshot could be used.
+        """
+        if self.snapshot is None:
+            return False
+        data = self.snapshot.load(content_key)
+        if data is None:
+            return False
+        records = data['sections']
+        self.version = data['version']
+
+        # Format overrides aren't part of the content key, so they are applied afresh rather
+        # than stored, letting an override added since the snapshot was saved take effect
+        self.sections = [
+            Section(
+                idx=idx,
+                text=text,
+                page=page,
+                formatter=self.format_overrides.get(idx, self.default_formatter)
+            )
+            for idx, text, page, _ in records
+        ]
+        sections = {section.idx: section for section in self.sections}
+        for section, record in zip(self.sections, records):
+            parent_idx = record[3]
+            if parent_idx is not None:
+                sections[parent_idx].add_subsection(section)
+        self.top_level_sections = [sec for sec in self.sections if sec.parent is None]
+        if data['search_index'] is not None:
+            self.search_index = SearchIndex.from_dict(data['search_index'])
+        return True
+
+    def save_snapshot(self, content_key):
+        """Stores the parsed sections so the next start can skip parsing altogether
+        """
+        if self.snapshot is None:
+            return
+        if self.search_index is None:
+            self.build_search_index()
+        self.snapshot.save(content_key, [
+            [
+                section.idx,
+                section.text,
+                section.page,
+                section.parent.idx if section.parent else None,
+            ]
+            for section in self.sections
+        ], search_index=self.search_index.to_dict(), version=self.version)
+
+    def iter_page_texts(self):
+        """
+        Yields (page number, text) for every page from `start_page_parsing_at` onwards, in page
+        order. Page ranges are extracted by a pool of processes when more than one worker is set.
+        """
+        # pdfminer.six is only needed when there is no snapshot to load the sections from
+        from pdfminer.pdfpage import PDFPage
+
+        with open(self.document.path, 'rb') as pdf_file:
+            page_count = sum(1 for _ in PDFPage.get_pages(pdf_file))
+        first_page = self.start_page_parsing_at - 1  # pdfminer.six pages are zero indexed
+        page_ranges = [
+            range(start, min(start + self.PAGES_PER_WORKER_TASK, page_count))
+            for start in range(first_page, page_count, self.PAGES_PER_WORKER_TASK)
+        ]
+        paths = [self.document.path] * len(page_ranges)
+
+        if self.workers <= 1 or len(page_ranges) <= 1:
+            for page_texts in map(extract_page_texts, paths, page_ranges):
+                yield from page_texts
+            return
+
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(page_ranges))) as executor:
+            # map hands back the results in the order submitted, so pages stay in order
+            for page_texts in executor.map(extract_page_texts, paths, page_ranges):
+                yield from page_texts
+
+    def iter_content_lines(self, page_texts):
+        """
+        Takes the (page number, text) pairs and yields (page number, line) for every non-empty
+        line of content. Each page ends in a version footer, which is dropped once the version
+        has been taken from the first one.
+        """
+        for page, text in page_texts:
+            footer = self.PAGE_FOOTER_PATTERN.search(text)
+            if footer:
+                if self.version is None:
+                    self.version = footer.group('version')
+                text = text[:footer.start()]
+            for line in text.splitlines():
+                line = line.strip()
+                if line:  # remove empty lines
+                    yield page, line
+
+    def parse_content_into_sections(self, page_lines):
+        """Parse the (page, line) pairs into defined, concrete sections that match section IDs
+        """
+        self.sections = list(self.iter_sections(page_lines))
 
-            # Line starts a new section
-            if self.__line_starts_section(line):
-                section_idx = self.__get_section_idx(line)
-                if self.PAGE_BREAK_INDICATOR in line:
-                    page += 1
-                # Remove the section index and separator
-                text = line.replace(section_idx, '').replace(self.PAGE_BREAK_INDICATOR, '').strip()
-                self.sections.append(Section(
-                    idx=section_idx,
-                    page=page,
-                    text=text,
-                    formatter=self.format_overrides.get(section_idx, self.default_formatter)
-                ))
+    def iter_sections(self, page_lines):
+        """
+        Yields a new section for every line that starts with a section ID, with all of the
+        lines up until the next one making up its text.
+        """
+        idx = None
+        pages = []
+        text_parts = []  # joined once the section is complete
+        for page, line in page_lines:
+            match = self.SECTION_LINE_PATTERN.match(line)
+            if match:
+                if idx is not None:
+                    yield self.build_section(idx, ' '.join(text_parts), pages)
+                idx = match.group('idx')
+                pages = [page]
+                text_parts = [match.group('text').strip()]
                 continue
 
+            if idx is None:  # anything before the first section isn't a rule
+                continue
             # Determine if the section spans multiple pages or not
-            section = self.sections[-1]
-            if self.PAGE_BREAK_INDICATOR in line:
-                line = line.replace(self.PAGE_BREAK_INDICATOR, '').strip()
-                page += 1
-                section.continues_onto_page(page)
-
+            if page != pages[-1]:
+                pages.append(page)
             # Add the continuation line to the existing section
-            separator = ' '  # ensure that lines are space separates so words aren't bunched
-            if section.text.endswith(' ') or line.startswith(' '):
-                separator = ''
-            section.text += f'{separator}{line}'
+            text_parts.append(line)
+
+        if idx is not None:
+            yield self.build_section(idx, ' '.join(text_parts), pages)
+
+    def build_section(self, idx, text, pages):
+        """Creates the section with the formatter it should be rendered with
+        """
+        section = Section(
+            idx=idx,
+            page=pages[0],
+            text=text,
+            formatter=self.format_overrides.get(idx, self.default_formatter)
+        )
+        for page in pages[1:]:
+            section.continues_onto_page(page)
+        return section
 
     def build_section_hierarchy(self):
         """Iterates through self.sections and creates the section hierarchy from section IDs
         """
         sep = self.SECTION_PART_SEPARATOR
         for section in self.sections:
-            # Since the sections are already in order, checking is easy...only two
-            # conditions must be met...
-            idx_parts = [x for x in section.idx.split(sep) if x]
-            parent_idx = sep.join(idx_parts[:-1]) + sep
-            parent_section = self.get_section(parent_idx)
+            # Only the direct parent is linked, so 2.1. has no parent if there is no 2.
+            parent_idx = sep.join(self.split_idx(section.idx)[:-1]) + sep
+            parent_section = self.section_index.get(parent_idx)
             if parent_section:
                 parent_section.add_subsection(section)
 
         # List of top level sections (1.,2.,3....)
         self.top_level_sections = list(filter(lambda sec: sec.parent is None, self.sections))
 
-    def __line_starts_section(self, line):
-        """Returns whether or not the line represents a new section
-        """
-        parts = line.replace(self.PAGE_BREAK_INDICATOR, '').split(' ', 1)
-        if not parts or len(parts) == 1:
-            return False
-        return re.match(self.SECTION_IDX_REGEX, parts[0])
-
-    def __get_section_idx(self, line):
-        """Given a line that starts a new section, this parses out the section IDx
-        """
-        parts = line.replace(self.PAGE_BREAK_INDICATOR, '').split(' ', 1)
-        if not parts or len(parts) == 1:
-            raise ValueError('Line does not represent a section index line')
-        idx = parts[0]
-        if not self.__line_starts_section(line):
-            raise ValueError('Line does not represent a section index line')
-        return idx.strip()
-
     def markdown(self):
         """Convert the entire sporting code into a markdown string
         """
         return '\n'.join([sec.markdown() for sec in self.top_level_sections])
 
 
+def extract_page_texts(pdf_path, page_range):
+    """
+    Extracts the text of a range of (zero indexed) pages in the PDF, returning a list of
+    (page number, text) pairs with page numbers starting at 1. This lives at the module
+    level so it can be sent to worker processes.
+    """
+    from pdfminer.high_level import extract_text_to_fp
+    from pdfminer.layout import LAParams
+
+    out_io = StringIO()
+    with open(pdf_path, 'rb') as pdf_file:
+        extract_text_to_fp(
+            pdf_file,
+            out_io,
+            page_numbers=set(page_range),
+            laparams=LAParams(),
+            output_type='text',
+            strip_control=True,
+            codec=None
+        )
+    # pdfminer.six ends every page with a form feed
+    texts = out_io.getvalue().split('\f')
+    return [(page + 1, text) for page, text in zip(page_range, texts)]
+
+
+class SectionTrie:
+    """
+    Prefix tree over the parts of the section IDxs, so that questions like "what is
+    nested under 3.5." only touch the sections that are actually nested under it.
+    """
+
+    def __init__(self):
+        self.section = None     # Section that lives at this exact IDx, if any
+        self.children = {}      # Next IDx part -> SectionTrie
+
+    def insert(self, idx_parts, section):
+        node = self
+        for part in idx_parts:
+            node = node.children.setdefault(part, SectionTrie())
+        node.section = section
+
+    def find(self, idx_parts):
+        """Returns the node for the IDx parts, or None if nothing lives under it
+        """
+        node = self
+        for part in idx_parts:
+            node = node.children.get(part)
+            if node is None:
+                return None
+        return node
+
+    def descendants(self, idx_parts):
+        """All sections below the IDx parts (excluding the IDx itself) in document order
+        """
+        node = self.find(idx_parts)
+        if node is None:
+            return []
+        found = []
+        stack = list(reversed(list(node.children.values())))
+        while stack:
+            node = stack.pop()
+            if node.section is not None:
+                found.append(node.section)
+            stack.extend(reversed(list(node.children.values())))
+        return found
+
+    def closest_ancestor(self, idx_parts):
+        """The deepest section strictly above the IDx parts, or None if there isn't one
+        """
+        node = self
+        closest = None
+        for part in idx_parts[:-1]:
+            node = node.children.get(part)
+            if node is None:
+                break
+            if node.section is not None:
+                closest = node.section
+        return closest
+
+
 class Section:
     """Represents a section of the sporting code that can easily be indexed and retrieved
     """
 
+    # There are thousands of these, so skipping the per instance __dict__ saves a fair bit
+    __slots__ = (
+        'idx', 'children', 'page', 'parent', 'path', '_text', '_formatter', '_depth',
+        '_formatted', '_markdown',
+    )
+
     def __init__(self, idx, text, page, formatter, parent=None):
         self.idx = idx
         self.children = []    # Child sections (1.2.3. is a direct child of 1.2.)
-        self.text = text
         self.page = page      # Page number that the section is on OR a list of pages it spans
-        self.formatter = formatter
-        self.parent = parent    # Direct parent of the section (1.2. is a direct parent of 1.2.3)
+        self.parent = None    # Direct parent of the section (1.2. is a direct parent of 1.2.3)
+        self.path = (idx,)    # IDxs of the linked ancestors down to this section
+        self._text = text
+        self._formatter = formatter
+        self._depth = 0       # Number of linked ancestors, kept up to date by add_subsection
+        self._formatted = None  # Cached output of the formatter
+        self._markdown = None   # Cached markdown of this section and its children
+        if parent is not None:
+            parent.add_subsection(self)
+
+    @property
+    def text(self):
+        return self._text
+
+    @text.setter
+    def text(self, text):
+        self._text = text
+        self.invalidate()
+
+    @property
+    def formatter(self):
+        return self._formatter
+
+    @formatter.setter
+    def formatter(self, formatter):
+        self._formatter = formatter
+        self.invalidate()
 
     def continues_onto_page(self, additional_page):
         """Denotes that the section continues on to the given additional page
@@ -201,22 +452,53 @@ class Section:
         """
         self.children.append(section)
         section.parent = self
+        section.update_position()
+        self.invalidate()
+
+    def update_position(self):
+        """Recomputes the depth and path of this section and its descendants from its parent
+        """
+        stack = [self]
+        while stack:
+            section = stack.pop()
+            parent = section.parent
+            section._depth = parent._depth + 1 if parent is not None else 0
+            section.path = parent.path + (section.idx,) if parent is not None else (section.idx,)
+            # headings are sized by depth, so the rendered text is stale
+            section._formatted = section._markdown = None
+            stack.extend(section.children)
+
+    def invalidate(self):
+        """
+        Throws away the rendered text of this section, along with the markdown of its
+        ancestors since theirs includes it
+        """
+        self._formatted = None
+        section = self
+        while section is not None:
+            section._markdown = None
+            section = section.parent
 
     def depth(self):
         """Returns the depth of this section by returning how many parents it has
         """
-        count = 0
-        parent = self.parent
-        while parent:
-            parent = parent.parent
-            count += 1
-        return count
+        return self._depth
+
+    def formatted(self):
+        """The section on its own as rendered by its formatter
+        """
+        if self._formatted is None:
+            self._formatted = self.formatter.format(self)
+        return self._formatted
 
     def markdown(self):
         """Prettifies the section and its children for markdown consumption
         """
-        current_section = self.formatter.format(self)
-        return current_section + '\n\n' + '\n'.join([child.markdown() for child in self.children])
+        if self._markdown is None:
+            current_section = self.formatted()
+            self._markdown = current_section + '\n\n' + \
+                '\n'.join([child.markdown() for child in self.children])
+        return self._markdown
 
 
 class Formatter:
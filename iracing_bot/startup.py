@@ -0,0 +1,119 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+import signal
+from threading import Lock, Thread, main_thread
+import time
+
+from .metrics import METRICS
+
+
+class StagedStartup:
+    """
+    Runs the independent startup steps (logging in to Reddit, loading the sporting code,
+    training the classifier, ...) at the same time on a thread pool, recording when each
+    one started and finished so slow starts can be tracked down. Steps are named, and each
+    one's result is handed back as a future so later steps can wait on just what they need.
+
+    The bot starts streaming before every step is done, so a `critical` step that fails
+    calls `on_critical_failure`, which by default stops the main thread like a Ctrl-C would.
+    Otherwise the failure would only show up once the first request needed the step.
+    """
+
+    def __init__(self, max_workers=4, clock=time.perf_counter, on_critical_failure=None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='startup')
+        self.clock = clock
+        self.on_critical_failure = on_critical_failure or interrupt_main
+        self.stopping = False   # whether a critical step failed
+        self.started = clock()
+        self.lock = Lock()
+        self.futures = {}       # step name -> future of its result
+        self.timings = {}       # step name -> (started, finished) in seconds since startup
+        self.milestones = {}    # name -> seconds since startup, e.g. when streaming started
+
+    def run(self, name, function, *args, critical=False, **kwargs):
+        """
+        Starts the step on the pool and returns the future of its result. The bot can't run
+        without a `critical` step, so the whole startup is stopped if one fails.
+        """
+        def step():
+            started = self.clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                finished = self.clock()
+                METRICS.observe(METRICS.STAGE_METRIC, finished - started, stage=f'startup_{name}')
+                with self.lock:
+                    self.timings[name] = (started - self.started, finished - self.started)
+
+        future = self.futures[name] = self.executor.submit(step)
+        if critical:
+            future.add_done_callback(lambda future: self.check_critical(name, future))
+        return future
+
+    def check_critical(self, name, future):
+        if future.cancelled() or future.exception() is None:
+            return
+        print(f'startup step {name} failed, stopping: {future.exception()!r}')
+        with self.lock:
+            # steps waiting on the failed one fail too, the first is enough to stop for
+            stopping, self.stopping = self.stopping, True
+        if not stopping:
+            self.on_critical_failure()
+
+    def result(self, name):
+        """Waits for the step to finish, returning its result or raising its exception
+        """
+        return self.futures[name].result()
+
+    def mark(self, milestone):
+        self.milestones[milestone] = self.clock() - self.started
+
+    def report(self):
+        """A table of when every step ran, in the order they finished
+        """
+        with self.lock:
+            timings = sorted(self.timings.items(), key=lambda item: item[1][1])
+        lines = ['Startup timings:']
+        for name, (started, finished) in timings:
+            lines.append(
+                f'  {name:<20} {started:7.2f}s -> {finished:7.2f}s  ({finished - started:.2f}s)'
+            )
+        for milestone, at in sorted(self.milestones.items(), key=lambda item: item[1]):
+            lines.append(f'  {milestone:<20} {at:7.2f}s')
+        return '\n'.join(lines)
+
+    def report_when_done(self):
+        """Prints the report once every step has finished, without blocking the caller
+        """
+        futures = list(self.futures.values())
+
+        def print_report():
+            wait(futures)
+            print(self.report())
+
+        Thread(target=print_report, daemon=True).start()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+def interrupt_main():
+    """
+    Raises KeyboardInterrupt in the main thread, even while it is blocked reading the comment
+    stream, so the bot stops through its usual shutdown
+    """
+    # sent to the main thread itself, a signal handled on another thread wouldn't wake it
+    signal.pthread_kill(main_thread().ident, signal.SIGINT)
+
+
+class Deferred:
+    """
+    Stands in for the result of a startup step that is still running. Using any attribute
+    waits for the step to finish, so the bot can start streaming comments before everything
+    it needs to reply to them is ready.
+    """
+
+    def __init__(self, future):
+        self._future = future
+
+    def __getattr__(self, name):
+        return getattr(self._future.result(), name)
@@ -0,0 +1,535 @@
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+
+import numpy as np
+
+from .search import SearchIndex
+from .sporting_code import Formatter
+
+
+# Every store file starts with the magic bytes, the format version and the length of the JSON
+# metadata that follows; the metadata says where each region of the file is
+HEADER = struct.Struct('<4sII')
+MAGIC = b'IRSC'
+ALIGNMENT = 8
+# Diff replies stay well clear of Reddit's 10000 character comment limit, footer included
+REPLY_MAX_LENGTH = 8000
+QUOTE_MAX_LENGTH = 500
+
+SECTION_DTYPE = np.dtype([
+    ('idx_start', '<u4'), ('idx_end', '<u4'),       # byte range of the IDx in the strings
+    ('text_start', '<u4'), ('text_end', '<u4'),     # byte range of the text in the strings
+    ('parent', '<i4'),                              # position of the parent section, or -1
+    ('depth', '<u4'),
+    ('pages_start', '<u4'), ('pages_end', '<u4'),   # range of its page numbers in the pages
+    ('digest', '<u8'),                              # hash of the text, so diffs can skip it
+])
+TERM_DTYPE = np.dtype([
+    ('start', '<u4'), ('end', '<u4'),               # byte range of the term in the strings
+    ('postings_start', '<u4'), ('postings_end', '<u4'),
+])
+REGION_DTYPES = {
+    'sections': SECTION_DTYPE,          # in document order
+    'idx_order': np.dtype('<u4'),       # section positions sorted by IDx, for lookups
+    'pages': np.dtype('<u4'),
+    'terms': TERM_DTYPE,                # sorted by term
+    'posting_positions': np.dtype('<u4'),
+    'posting_weights': np.dtype('<f8'),
+    'strings': np.dtype('u1'),          # UTF-8 IDxs, texts and terms back to back
+}
+
+
+def text_digest(text):
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def write_store(path, version, key, sections, search_index):
+    """
+    Writes the parsed sections and their search index to `path` in the store format read by
+    `MappedSportingCode`, atomically so that processes that have the old file mapped keep it
+    """
+    strings = bytearray()
+
+    def add_string(value):
+        start = len(strings)
+        strings.extend(value.encode('utf-8'))
+        return start, len(strings)
+
+    positions = {section.idx: position for position, section in enumerate(sections)}
+    table = np.zeros(len(sections), SECTION_DTYPE)
+    pages = []
+    for position, section in enumerate(sections):
+        section_pages = section.page if isinstance(section.page, list) else [section.page]
+        table[position] = (
+            *add_string(section.idx), *add_string(section.text),
+            positions[section.parent.idx] if section.parent is not None else -1,
+            section.depth(), len(pages), len(pages) + len(section_pages),
+            text_digest(section.text),
+        )
+        pages.extend(section_pages)
+    idx_order = sorted(range(len(sections)), key=lambda p: sections[p].idx.encode('utf-8'))
+
+    terms = sorted(search_index.postings, key=lambda term: term.encode('utf-8'))
+    term_table = np.zeros(len(terms), TERM_DTYPE)
+    posting_positions, posting_weights = [], []
+    for number, term in enumerate(terms):
+        entries = search_index.postings[term]
+        term_table[number] = (
+            *add_string(term), len(posting_positions), len(posting_positions) + len(entries)
+        )
+        for document, weight in entries:
+            posting_positions.append(positions[search_index.keys[document]])
+            posting_weights.append(weight)
+
+    arrays = {
+        'sections': table,
+        'idx_order': np.array(idx_order, REGION_DTYPES['idx_order']),
+        'pages': np.array(pages, REGION_DTYPES['pages']),
+        'terms': term_table,
+        'posting_positions': np.array(posting_positions, REGION_DTYPES['posting_positions']),
+        'posting_weights': np.array(posting_weights, REGION_DTYPES['posting_weights']),
+        'strings': np.frombuffer(bytes(strings), REGION_DTYPES['strings']),
+    }
+    regions = {}
+    offset = 0
+    for name, array in arrays.items():
+        regions[name] = [offset, len(array)]
+        offset = align(offset + array.nbytes)
+    metadata = json.dumps({
+        'version': version, 'key': key, 'k1': search_index.k1, 'b': search_index.b,
+        'regions': regions,
+    }).encode('utf-8')
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, MappedSportingCode.FORMAT_VERSION, len(metadata)))
+        f.write(metadata)
+        base = align(HEADER.size + len(metadata))
+        for name, array in arrays.items():
+            f.write(b'\0' * (base + regions[name][0] - f.tell()))
+            f.write(array.tobytes())
+        f.write(b'\0' * (base + offset - f.tell()))   # so even an empty last region is mappable
+    os.replace(tmp_path, path)
+
+
+def shorten(text, length=QUOTE_MAX_LENGTH):
+    """Cuts the text down to `length` characters at a word boundary, for quoting in replies
+    """
+    if len(text) <= length:
+        return text
+    return text[:length].rsplit(' ', 1)[0] + '...'
+
+
+def align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class MappedSportingCode:
+    """
+    A parsed sporting code read straight out of a memory mapped store file (see
+    `write_store`) instead of being held as Section objects. The operating system keeps a
+    single copy of a mapped file in memory, so every bot process serving the same version
+    shares it, and opening one costs next to nothing however big the sporting code is.
+
+    It answers the lookups the response generator needs (`get_section`, `get_descendants`,
+    `get_closest_ancestor`, `search`) by binary searching the sorted tables in the file,
+    handing out `MappedSection` views that only decode what is asked of them. It is read only,
+    and has none of the parsing side of `SportingCode`.
+    """
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, path, formatter=None, format_overrides=None):
+        self.path = path
+        self.default_formatter = formatter if formatter is not None else Formatter()
+        self.format_overrides = format_overrides if format_overrides else dict()
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, format_version, metadata_length = HEADER.unpack_from(self.mmap)
+        if magic != MAGIC or format_version != self.FORMAT_VERSION:
+            self.mmap.close()
+            raise ValueError(f'{path} is not a version {self.FORMAT_VERSION} sporting code store')
+        metadata = json.loads(self.mmap[HEADER.size:HEADER.size + metadata_length])
+        self.version = metadata['version']
+        self.key = metadata['key']
+        self.k1 = metadata['k1']
+        self.b = metadata['b']
+        self.base = align(HEADER.size + metadata_length)
+        self.regions = metadata['regions']
+        self.sections = self.region('sections')
+        # field views, so the binary searches don't build a record per comparison
+        self.idx_starts = self.sections['idx_start']
+        self.idx_ends = self.sections['idx_end']
+        self.strings_offset = self.base + self.regions['strings'][0]
+        # section positions grouped by parent, in document order within each, with where the
+        # children of each position start, so listing them doesn't scan every section
+        parents = self.sections['parent']
+        self.child_order = np.argsort(parents, kind='stable')
+        self.child_starts = np.searchsorted(parents[self.child_order], np.arange(len(parents) + 1))
+        self.idx_order = self.region('idx_order')
+        self.pages = self.region('pages')
+        self.terms = self.region('terms')
+        self.posting_positions = self.region('posting_positions')
+        self.posting_weights = self.region('posting_weights')
+        self.tokenizer = None   # a SearchIndex, only for its tokenizer, see `search`
+        self.parsed = True
+
+    def region(self, name):
+        offset, count = self.regions[name]
+        return np.frombuffer(
+            self.mmap, dtype=REGION_DTYPES[name], count=count, offset=self.base + offset
+        )
+
+    def raw_string(self, start, end):
+        return self.mmap[self.strings_offset + start:self.strings_offset + end]
+
+    def string(self, start, end):
+        return self.raw_string(start, end).decode('utf-8')
+
+    def __len__(self):
+        return len(self.sections)
+
+    def close(self):
+        self.sections = self.idx_order = self.pages = self.terms = None
+        self.idx_starts = self.idx_ends = self.child_order = self.child_starts = None
+        self.posting_positions = self.posting_weights = None
+        self.mmap.close()
+
+    def section(self, position):
+        return MappedSection(self, int(position))
+
+    def idx_bytes(self, position):
+        return self.raw_string(int(self.idx_starts[position]), int(self.idx_ends[position]))
+
+    def lower_bound(self, key):
+        """Index into `idx_order` of the first section whose IDx isn't less than the key
+        """
+        low, high = 0, len(self.idx_order)
+        while low < high:
+            middle = (low + high) // 2
+            if self.idx_bytes(self.idx_order[middle]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def position_of(self, idx):
+        key = idx.encode('utf-8')
+        found = self.lower_bound(key)
+        if found < len(self.idx_order) and self.idx_bytes(self.idx_order[found]) == key:
+            return int(self.idx_order[found])
+        return None
+
+    def subtree(self, idx=None):
+        """Positions of the section and everything nested under it in IDx order, or of all
+        """
+        if idx is None:
+            return self.idx_order
+        key = idx.encode('utf-8')
+        # IDxs are ASCII, so every one starting with the key sorts before the key + 0xff
+        return self.idx_order[self.lower_bound(key):self.lower_bound(key + b'\xff')]
+
+    def get_section(self, idx):
+        """Looks up the section by its IDx, with or without the trailing period
+        """
+        if not idx.endswith('.'):
+            idx = idx + '.'
+        position = self.position_of(idx)
+        return self.section(position) if position is not None else None
+
+    def get_descendants(self, idx):
+        """Returns every section nested under the given IDx in document order
+        """
+        if not idx.endswith('.'):
+            idx = idx + '.'
+        itself = self.position_of(idx)
+        positions = sorted(int(position) for position in self.subtree(idx))
+        return [self.section(position) for position in positions if position != itself]
+
+    def get_closest_ancestor(self, idx):
+        """
+        Returns the deepest existing section that contains the given IDx, like
+        `SportingCode.get_closest_ancestor`
+        """
+        parts = [part for part in idx.split('.') if part]
+        closest = None
+        for end in range(1, len(parts)):
+            prefix = '.'.join(parts[:end]) + '.'
+            position = self.position_of(prefix)
+            if position is not None:
+                closest = position
+            elif not len(self.subtree(prefix)):
+                break
+        return self.section(closest) if closest is not None else None
+
+    def markdown(self):
+        """Convert the entire sporting code into a markdown string
+        """
+        top_level = self.child_order[:self.child_starts[0]]
+        return '\n'.join([self.section(position).markdown() for position in top_level])
+
+    def search(self, query, k=5):
+        """Full text search over the section texts, ranked the same as `SearchIndex.search`
+        """
+        if self.tokenizer is None:
+            self.tokenizer = SearchIndex(k1=self.k1, b=self.b)
+        scores = np.zeros(len(self.sections))
+        for term in set(self.tokenizer.tokenize(query)):
+            number = self.term_number(term)
+            if number is None:
+                continue
+            record = self.terms[number]
+            start, end = record['postings_start'], record['postings_end']
+            scores[self.posting_positions[start:end]] += self.posting_weights[start:end]
+        matched = np.flatnonzero(scores)
+        # best score first, ties going to the section that comes first
+        best = matched[np.lexsort((matched, -scores[matched]))[:k]]
+        return [self.section(position) for position in best]
+
+    def term_share(self, term):
+        """The share of the sections the (tokenized) search term appears in
+        """
+        number = self.term_number(term)
+        if number is None or not len(self.sections):
+            return 0.0
+        record = self.terms[number]
+        return int(record['postings_end'] - record['postings_start']) / len(self.sections)
+
+    def term_number(self, term):
+        key = term.encode('utf-8')
+        low, high = 0, len(self.terms)
+        while low < high:
+            middle = (low + high) // 2
+            record = self.terms[middle]
+            if self.raw_string(record['start'], record['end']) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.terms):
+            record = self.terms[low]
+            if self.raw_string(record['start'], record['end']) == key:
+                return low
+        return None
+
+
+class MappedSection:
+    """A view of one section of a `MappedSportingCode`, with the attributes of a `Section`
+    """
+
+    __slots__ = ('code', 'position')
+
+    def __init__(self, code, position):
+        self.code = code
+        self.position = position
+
+    def __eq__(self, other):
+        return isinstance(other, MappedSection) and \
+            (self.code, self.position) == (other.code, other.position)
+
+    def __hash__(self):
+        return hash((id(self.code), self.position))
+
+    @property
+    def record(self):
+        return self.code.sections[self.position]
+
+    @property
+    def idx(self):
+        record = self.record
+        return self.code.string(record['idx_start'], record['idx_end'])
+
+    @property
+    def text(self):
+        record = self.record
+        return self.code.string(record['text_start'], record['text_end'])
+
+    @property
+    def page(self):
+        record = self.record
+        pages = [int(page) for page in self.code.pages[record['pages_start']:record['pages_end']]]
+        return pages[0] if len(pages) == 1 else pages
+
+    @property
+    def parent(self):
+        parent = self.record['parent']
+        return self.code.section(parent) if parent >= 0 else None
+
+    @property
+    def children(self):
+        code = self.code
+        start, end = code.child_starts[self.position], code.child_starts[self.position + 1]
+        return [code.section(position) for position in code.child_order[start:end]]
+
+    @property
+    def digest(self):
+        return int(self.record['digest'])
+
+    def depth(self):
+        return int(self.record['depth'])
+
+    def formatted(self):
+        """The section on its own as rendered by its formatter
+        """
+        idx = self.idx
+        return self.code.format_overrides.get(idx, self.code.default_formatter).format(self)
+
+    def markdown(self):
+        """The section and its children, like `Section.markdown`
+        """
+        return self.formatted() + '\n\n' + \
+            '\n'.join([child.markdown() for child in self.children])
+
+
+class SectionChange:
+    """A section that was added, removed or changed between two sporting code versions
+    """
+
+    def __init__(self, kind, idx, old_text=None, new_text=None):
+        self.kind = kind            # 'added', 'removed' or 'changed'
+        self.idx = idx
+        self.old_text = old_text
+        self.new_text = new_text
+
+    def __repr__(self):
+        return f'SectionChange({self.kind!r}, {self.idx!r})'
+
+
+class SportingCodeLibrary:
+    """
+    A directory of sporting code store files, one per version, so several versions can be
+    served side by side and compared. Versions are mapped the first time they're asked for.
+    """
+
+    FILE_PATTERN = re.compile(r'^sporting_code_(?P<version>[0-9.]+)\.irsc$')
+
+    def __init__(self, directory, formatter=None, format_overrides=None):
+        self.directory = directory
+        self.formatter = formatter
+        self.format_overrides = format_overrides
+        self.loaded = {}    # version -> MappedSportingCode
+
+    def path_for(self, version):
+        return os.path.join(self.directory, f'sporting_code_{version}.irsc')
+
+    def versions(self):
+        """Stored versions, oldest first
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        found = [
+            match.group('version')
+            for match in map(self.FILE_PATTERN.match, os.listdir(self.directory)) if match
+        ]
+        return sorted(found, key=lambda version: [int(part) for part in version.split('.')])
+
+    def add(self, sporting_code):
+        """
+        Stores a parsed `SportingCode` under its version, unless that exact parse is stored
+        already, and returns the mapped copy of it
+        """
+        version = sporting_code.version
+        if version is None:
+            raise ValueError('the sporting code has no version, it was not parsed from a PDF')
+        key = sporting_code.content_key()
+        existing = self.get(version) if version in self.versions() else None
+        if existing is not None and existing.key == key:
+            return existing
+        os.makedirs(self.directory, exist_ok=True)
+        if sporting_code.search_index is None:
+            sporting_code.build_search_index()
+        write_store(
+            self.path_for(version), version, key, sporting_code.sections,
+            sporting_code.search_index
+        )
+        replaced = self.loaded.pop(version, None)
+        if replaced is not None:
+            replaced.close()
+        return self.get(version)
+
+    def get(self, version=None):
+        """The mapped sporting code of the version, the latest one if not given
+        """
+        if version is None:
+            versions = self.versions()
+            if not versions:
+                raise LookupError(f'no sporting code has been stored in {self.directory}')
+            version = versions[-1]
+        if version not in self.loaded:
+            self.loaded[version] = MappedSportingCode(
+                self.path_for(version), formatter=self.formatter,
+                format_overrides=self.format_overrides
+            )
+        return self.loaded[version]
+
+    def diff(self, old_version, new_version, idx=None):
+        """
+        The sections added, removed or changed going from one version to the other, in section
+        number order, limited to the given section and the ones nested under it. Sections are
+        matched up by walking both versions' sorted IDx tables and compared by the digests of
+        their text, so only the texts of the sections that changed are ever decoded.
+        """
+        old, new = self.get(old_version), self.get(new_version)
+        if idx is not None and not idx.endswith('.'):
+            idx = idx + '.'
+        old_positions, new_positions = old.subtree(idx), new.subtree(idx)
+        changes = []
+        i = j = 0
+        while i < len(old_positions) or j < len(new_positions):
+            old_idx = old.idx_bytes(old_positions[i]) if i < len(old_positions) else None
+            new_idx = new.idx_bytes(new_positions[j]) if j < len(new_positions) else None
+            if new_idx is None or (old_idx is not None and old_idx < new_idx):
+                section = old.section(old_positions[i])
+                changes.append(SectionChange('removed', section.idx, old_text=section.text))
+                i += 1
+            elif old_idx is None or new_idx < old_idx:
+                section = new.section(new_positions[j])
+                changes.append(SectionChange('added', section.idx, new_text=section.text))
+                j += 1
+            else:
+                old_section = old.section(old_positions[i])
+                new_section = new.section(new_positions[j])
+                if old_section.digest != new_section.digest:
+                    changes.append(SectionChange(
+                        'changed', old_section.idx, old_text=old_section.text,
+                        new_text=new_section.text
+                    ))
+                i += 1
+                j += 1
+        # the tables are in byte order, which puts 3.11. before 3.2.
+        return sorted(changes, key=lambda change: [
+            (int(part), part) if part.isdigit() else (0, part) for part in change.idx.split('.')
+        ])
+
+    def describe_changes(self, old_version, new_version, idx=None, limit=10,
+                         max_length=REPLY_MAX_LENGTH):
+        """
+        The diff as a markdown reply, listing at most `limit` of the changes and keeping to
+        `max_length` characters, well under the 10000 Reddit allows a comment
+        """
+        where = f'section {idx}' if idx else 'the sporting code'
+        changes = self.diff(old_version, new_version, idx)
+        if not changes:
+            return f'Nothing in {where} changed between versions {old_version} and {new_version}.'
+        reply = f'Changes to {where} between versions {old_version} and {new_version}:\n'
+        listed = 0
+        for change in changes[:limit]:
+            if change.kind == 'changed':
+                entry = (
+                    f'\n* **{change.idx}** changed from:\n  > {shorten(change.old_text)}\n'
+                    f'  to:\n  > {shorten(change.new_text)}'
+                )
+            else:
+                text = change.new_text if change.kind == 'added' else change.old_text
+                entry = f'\n* **{change.idx}** was {change.kind}: {shorten(text)}'
+            # leave room for the line saying how many more there are
+            if len(reply) + len(entry) > max_length - 30:
+                break
+            reply += entry
+            listed += 1
+        if len(changes) > listed:
+            reply += f'\n* ...and {len(changes) - listed} more'
+        return reply
@@ -0,0 +1,104 @@
+import time
+from types import SimpleNamespace
+from unittest import TestCase
+
+from ..answer_cache import AnswerCache
+from ..responder import ResponseGenerator
+
+# share of the sporting code sections each term is in, the rest aren't in it at all
+TERM_SHARES = {'rule': 0.5, 'incid': 0.05, 'point': 0.1, 'blue': 0.02, 'black': 0.02,
+               'flag': 0.05, 'penalti': 0.1, 'contact': 0.05}
+
+
+class AnswerCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.cache = AnswerCache(max_entries=3)
+
+    def term_share(self, term):
+        return TERM_SHARES.get(term, 0.0)
+
+    def test_get__rephrasings(self):
+        self.cache.put('what is the penalty for contact', 'contact reply')
+        self.cache.put('how do I raise my safety rating', 'safety rating reply')
+        self.assertEqual('contact reply', self.cache.get('Whats the penalty for contact?'))
+        self.assertEqual('safety rating reply', self.cache.get('how do i raise my safety rating'))
+        self.assertIsNone(self.cache.get('where can I find the sporting code'))
+        self.assertEqual({'entries': 2, 'hits': 2, 'misses': 1}, {
+            key: value for key, value in self.cache.report().items() if key != 'hit_rate'
+        })
+
+    def test_get__different_terms(self):
+        # "work" isn't in the sporting code and "rule" is in half of it, so neither picks it
+        self.cache.put("what's the rule on incident points", 'incident reply', self.term_share)
+        self.assertNotEqual(
+            self.cache.key('how do incident points work'),
+            self.cache.key("what's the rule on incident points")
+        )
+        self.assertEqual(
+            'incident reply', self.cache.get('how do incident points work', self.term_share)
+        )
+        self.assertEqual(1, len(self.cache))
+
+    def test_get__numbers_have_to_match(self):
+        self.cache.put('what does rule 3.5 say', 'rule 3.5 reply', self.term_share)
+        self.assertIsNone(self.cache.get('what does rule 3.6 say', self.term_share))
+        self.assertEqual('rule 3.5 reply', self.cache.get('what is 3.5?', self.term_share))
+
+    def test_get__near_misses(self):
+        self.cache.put('what is the rule about blue flags', 'blue flag reply', self.term_share)
+        self.cache.put('blue flag in a race', 'blue flag reply', self.term_share)
+        self.assertIsNone(self.cache.get('what is the rule about black flags', self.term_share))
+        self.assertIsNone(self.cache.get('black flag in a race', self.term_share))
+        self.assertEqual(
+            'blue flag reply', self.cache.get("what's the rule about blue flags?", self.term_share)
+        )
+
+    def test_get__without_terms_that_pick_a_reply(self):
+        self.cache.put('what is the rule', 'some reply', self.term_share)
+        self.assertEqual(0, len(self.cache))
+        self.assertIsNone(self.cache.get('any rule', self.term_share))
+
+    def test_put__evicts_the_oldest(self):
+        for number in range(5):
+            self.cache.put(f'question {"abcde"[number] * 8}', f'reply {number}')
+        self.assertEqual(3, len(self.cache))
+        self.assertIsNone(self.cache.get('question aaaaaaaa'))
+        self.assertEqual('reply 4', self.cache.get('question eeeeeeee'))
+
+    def test_ttl(self):
+        cache = AnswerCache(ttl=0.01)
+        cache.put('what is the penalty for contact', 'contact reply')
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('what is the penalty for contact'))
+        self.assertEqual(0, len(cache))
+
+
+class CountingSportingCode:
+
+    def __init__(self):
+        self.searches = 0
+        self.section = SimpleNamespace(page=3, formatted=lambda: 'rule text')
+
+    def search(self, text, k=1):
+        self.searches += 1
+        return [self.section]
+
+    def term_share(self, term):
+        return TERM_SHARES.get(term, 0.0)
+
+
+class ResponseGeneratorAnswerCacheTestCase(TestCase):
+
+    def test_respond_to_request__reuses_replies(self):
+        sporting_code = CountingSportingCode()
+        generator = ResponseGenerator(
+            training_data=[('what is my safety rating', 'safety-rating')], engine='numpy',
+            sporting_code=sporting_code, answer_cache=AnswerCache()
+        )
+        reply = generator.respond_to_request('what is the penalty for contact')
+        self.assertEqual(reply, generator.respond_to_request('whats the penalty for contact?'))
+        self.assertEqual(reply, generator.respond_to_request('contact penalty rules'))
+        self.assertEqual(1, sporting_code.searches)
+        generator.respond_to_request('where is the sporting code')
+        self.assertEqual(2, sporting_code.searches)
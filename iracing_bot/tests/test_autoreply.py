@@ -0,0 +1,135 @@
+from types import SimpleNamespace
+from unittest import TestCase
+
+from ..autoreply import SubmissionAutoReplier, micro_batches
+from ..bot import IRacingBot
+from ..cache import MemoryCache, cache_key
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class MicroBatchesTestCase(TestCase):
+
+    def test_batches_are_bounded_by_size(self):
+        batches = list(micro_batches(iter(range(7)), batch_size=3, max_wait=10))
+        self.assertEqual([[0, 1, 2], [3, 4, 5], [6]], [batch for batch, _ in batches])
+
+    def test_batches_are_bounded_by_wait(self):
+        clock = FakeClock()
+
+        def stream():
+            yield 'a'
+            clock.now = 0.5
+            yield None      # nothing new yet, but the batch can wait a little longer
+            yield 'b'
+            clock.now = 1.5
+            yield None
+            yield 'c'
+
+        batches = micro_batches(stream(), batch_size=10, max_wait=1.0, clock=clock)
+        self.assertEqual((['a', 'b'], 1.5), next(batches))
+        self.assertEqual([(['c'], 0.0)], list(batches))
+
+
+class FakeSubmission:
+
+    def __init__(self, submission_id, title, selftext='', author='someone'):
+        self.id = submission_id
+        self.fullname = f't3_{submission_id}'
+        self.title = title
+        self.selftext = selftext
+        self.author = SimpleNamespace(name=author)
+        self.replies = []
+
+    def reply(self, body):
+        self.replies.append(body)
+
+
+class FakeResponseGenerator:
+
+    def __init__(self):
+        self.batches = []
+
+    def classify_batch(self, texts):
+        self.batches.append(texts)
+        return [
+            ('safety-rating', 0.9) if 'rating' in text else
+            ('sporting-code', 0.5) if 'code' in text else (None, 0.0)
+            for text in texts
+        ]
+
+    def answer(self, text):
+        return None if 'nothing' in text else f'answer to {text}'
+
+
+class SubmissionAutoReplierTestCase(TestCase):
+
+    def test_handle_batch(self):
+        cache = MemoryCache()
+        cache.cache_comment_id('t3_old')
+        generator = FakeResponseGenerator()
+        bot = IRacingBot(
+            subreddit='iracing', sporting_code=None,
+            reddit=SimpleNamespace(config=SimpleNamespace(username='irbot')),
+            response_generator=generator, response_cache=cache
+        )
+        replier = SubmissionAutoReplier(bot, threshold=0.8)
+        submissions = [
+            FakeSubmission('a', 'How do I raise my safety rating?', 'It keeps dropping'),
+            FakeSubmission('b', 'Where is the sporting code'),       # not sure enough
+            FakeSubmission('c', 'Great race last night'),            # not relevant
+            FakeSubmission('old', 'safety rating question'),         # answered already
+            FakeSubmission('own', 'safety rating', author='irbot'),
+            FakeSubmission('none', 'safety rating but nothing to quote'),
+        ]
+        self.assertEqual(1, replier.handle_batch(submissions, waited=0.25))
+
+        self.assertEqual(1, len(generator.batches))    # classified in a single call
+        self.assertEqual(4, len(generator.batches[0]))
+        self.assertTrue(submissions[0].replies[0].startswith(
+            'answer to How do I raise my safety rating?\nIt keeps dropping'
+        ))
+        self.assertTrue(all(not submission.replies for submission in submissions[1:]))
+        self.assertTrue(cache.comment_response_exists('t3_a'))
+        self.assertFalse(cache.comment_response_exists('a'))   # can't clash with a comment id
+        report = replier.report()
+        self.assertEqual(1, report['batches'])
+        self.assertEqual(4, report['submissions'])
+        self.assertEqual(1, report['replied'])
+        self.assertGreaterEqual(report['batch_latency_seconds']['p50'], 0.25)
+
+    def test_begin_blocking_loop__restarts_the_stream(self):
+        submissions = [FakeSubmission('a', 'How do I raise my safety rating?')]
+        attempts = []
+
+        def stream(pause_after=None):
+            attempts.append(pause_after)
+            if len(attempts) < 3:
+                raise ConnectionError('reddit is down')
+            return iter(submissions)
+
+        reddit = SimpleNamespace(
+            config=SimpleNamespace(username='irbot'),
+            subreddit=lambda name: SimpleNamespace(stream=SimpleNamespace(submissions=stream)),
+        )
+        bot = IRacingBot(
+            subreddit='iracing', sporting_code=None, reddit=reddit,
+            response_generator=FakeResponseGenerator(), response_cache=MemoryCache()
+        )
+        replier = SubmissionAutoReplier(bot, threshold=0.8, base_delay=0)
+        replier.begin_blocking_loop()
+        self.assertEqual([0, 0, 0], attempts)
+        self.assertEqual(2, replier.report()['restarts'])
+        self.assertEqual(1, len(submissions[0].replies))
+        self.assertEqual(0, replier.failures)
+
+    def test_cache_key(self):
+        self.assertEqual('t3_a', cache_key(FakeSubmission('a', 'title')))
+        self.assertEqual('a', cache_key(SimpleNamespace(id='a', fullname='t1_a')))
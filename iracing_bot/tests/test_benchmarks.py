@@ -0,0 +1,183 @@
+"""
+Performance benchmarks, skipped unless IRBOT_BENCHMARKS=1 is set since they take a while:
+
+    IRBOT_BENCHMARKS=1 pytest iracing_bot/tests/test_benchmarks.py
+
+Results are written as JSON to IRBOT_BENCHMARK_OUTPUT (iracing_bot_benchmark_results.json in
+the temp directory by default) so that runs against different versions can be compared.
+"""
+import json
+import os
+import platform
+import sys
+from tempfile import TemporaryDirectory, gettempdir
+import time
+from unittest import TestCase, skipUnless
+
+from textblob.exceptions import MissingCorpusError
+
+from ..fake_reddit import FakeReddit, generate_comments
+from ..replay import run_replay
+from ..responder import ResponseGenerator
+from ..sporting_code import SportingCode, Section, Formatter
+from .test_bot import FakeResponseGenerator
+from .utils import section_ids, sporting_code_pages, write_pdf
+
+
+ENABLED = os.getenv('IRBOT_BENCHMARKS') == '1'
+OUTPUT = os.getenv(
+    'IRBOT_BENCHMARK_OUTPUT', os.path.join(gettempdir(), 'iracing_bot_benchmark_results.json')
+)
+TRAINING_FILE = os.path.join(os.path.dirname(__file__), '..', '..', 'training.yaml')
+RESULTS = {}
+
+
+def record(name, seconds, operations=1, **extra):
+    """Stores the timing of a benchmark under its name
+    """
+    RESULTS[name] = dict(
+        seconds=seconds,
+        operations=operations,
+        operations_per_second=operations / seconds if seconds else None,
+        **extra
+    )
+
+
+def best_of(function, repeat=3):
+    """Fastest of `repeat` runs, in seconds
+    """
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def tearDownModule():
+    if not RESULTS:
+        return
+    with open(OUTPUT, 'w') as f:
+        json.dump({
+            'timestamp': time.time(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'results': RESULTS,
+        }, f, indent=2, sort_keys=True)
+    print(f'benchmark results written to {OUTPUT}')
+
+
+@skipUnless(ENABLED, 'set IRBOT_BENCHMARKS=1 to run the benchmarks')
+class SportingCodeBenchmark(TestCase):
+
+    SECTIONS = 6000     # about 300 pages
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = TemporaryDirectory()
+        cls.pdf_path = os.path.join(cls.tmp_dir.name, 'sporting_code.pdf')
+        cls.pages = sporting_code_pages(cls.SECTIONS, sections_per_page=20)
+        write_pdf(cls.pdf_path, cls.pages)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def parse(self, workers, snapshot_path=None):
+        sporting_code = SportingCode(
+            self.pdf_path, cache_directory=self.tmp_dir.name, workers=workers,
+            snapshot_path=snapshot_path
+        )
+        sporting_code.parse_pdf()
+        return sporting_code
+
+    def test_parse_pdf(self):
+        for workers in (1, os.cpu_count() or 1):
+            started = time.perf_counter()
+            sporting_code = self.parse(workers)
+            record(
+                f'parse_pdf[workers={workers}]', time.perf_counter() - started,
+                pages=len(self.pages), sections=len(sporting_code.sections)
+            )
+            self.assertEqual(self.SECTIONS, len(sporting_code.sections))
+
+    def test_parse_pdf__snapshot(self):
+        snapshot_path = os.path.join(self.tmp_dir.name, 'snapshot.json.gz')
+        self.parse(os.cpu_count(), snapshot_path)
+        seconds = best_of(lambda: self.parse(1, snapshot_path))
+        record('parse_pdf[snapshot]', seconds, sections=self.SECTIONS)
+
+
+@skipUnless(ENABLED, 'set IRBOT_BENCHMARKS=1 to run the benchmarks')
+class SectionLookupBenchmark(TestCase):
+
+    SECTIONS = 20000
+
+    def setUp(self):
+        self.ids = section_ids(self.SECTIONS, branching=12)
+        self.sporting_code = SportingCode('')
+        self.sporting_code.sections = [
+            Section(idx, f'rule {idx} about incident points', 1, formatter=Formatter())
+            for idx in self.ids
+        ]
+
+    def test_build_section_hierarchy(self):
+        def build():
+            for section in self.sporting_code.sections:
+                section.children = []
+                section.parent = None
+            self.sporting_code.build_section_hierarchy()
+        record('build_section_hierarchy', best_of(build), sections=self.SECTIONS)
+
+    def test_get_section(self):
+        lookups = self.ids * 5
+        seconds = best_of(lambda: [self.sporting_code.get_section(idx) for idx in lookups])
+        record('get_section', seconds, operations=len(lookups), sections=self.SECTIONS)
+
+    def test_search(self):
+        self.sporting_code.build_search_index()
+        queries = ['incident points', 'what is rule 3.5', 'penalty for contact'] * 1000
+        seconds = best_of(lambda: [self.sporting_code.search(query) for query in queries])
+        record('search', seconds, operations=len(queries), sections=self.SECTIONS)
+
+
+@skipUnless(ENABLED, 'set IRBOT_BENCHMARKS=1 to run the benchmarks')
+class ResponseGeneratorBenchmark(TestCase):
+
+    def setUp(self):
+        self.texts = [comment['body'] for comment in generate_comments(5000, seed=1)]
+
+    def benchmark_engine(self, engine):
+        try:
+            train = best_of(lambda: ResponseGenerator(training_file=TRAINING_FILE, engine=engine))
+        except MissingCorpusError:
+            self.skipTest('the nltk punkt corpus is needed to run textblob')
+        record(f'train[{engine}]', train)
+        generator = ResponseGenerator(training_file=TRAINING_FILE, engine=engine)
+        classify = best_of(lambda: generator.classify_batch(self.texts), repeat=1)
+        record(f'classify_batch[{engine}]', classify, operations=len(self.texts))
+
+    def test_numpy(self):
+        self.benchmark_engine('numpy')
+
+    def test_textblob(self):
+        self.benchmark_engine('textblob')
+
+
+@skipUnless(ENABLED, 'set IRBOT_BENCHMARKS=1 to run the benchmarks')
+class BotLoopBenchmark(TestCase):
+
+    def setUp(self):
+        self.records = generate_comments(20000, seed=1)
+
+    def test_bot_loop(self):
+        for async_pipeline in (False, True):
+            reddit = FakeReddit(self.records, seed=1)
+            report = run_replay(reddit, FakeResponseGenerator(), async_pipeline=async_pipeline)
+            record(
+                f'bot_loop[async={async_pipeline}]', report['elapsed_seconds'],
+                operations=report['comments'],
+                reply_latency_seconds=report['reply_latency_seconds']
+            )
+            self.assertEqual(0, report['duplicate_replies'])
@@ -0,0 +1,165 @@
+import asyncio
+from threading import Lock
+import time
+from types import SimpleNamespace
+from unittest import TestCase
+
+from praw.exceptions import PRAWException
+
+from ..bot import IRacingBot
+from ..cache import MemoryCache
+from ..checkpoint import StreamCheckpoint
+from ..pipeline import CommentPipeline
+
+
+class FakeComment:
+
+    def __init__(self, comment_id, body, author='someone', fail=False, delay=0, created_utc=0):
+        self.id = comment_id
+        self.fullname = f't1_{comment_id}'
+        self.created_utc = created_utc
+        self.body = body
+        self.author = SimpleNamespace(name=author)
+        self.fail = fail
+        self.delay = delay
+        self.replies = []
+
+    def reply(self, body):
+        time.sleep(self.delay)
+        if self.fail:
+            raise PRAWException('reply failed')
+        self.replies.append(body)
+
+
+class OverlapCountingComment(FakeComment):
+    """Keeps track of the most replies that were being made at the same time
+    """
+    lock = Lock()
+    active = 0
+    most_active = 0
+
+    def reply(self, body):
+        cls = OverlapCountingComment
+        with cls.lock:
+            cls.active += 1
+            cls.most_active = max(cls.most_active, cls.active)
+        try:
+            super().reply(body)
+        finally:
+            with cls.lock:
+                cls.active -= 1
+
+
+class FakeResponseGenerator:
+
+    def respond_to_request(self, text):
+        return f'response to {text}'
+
+
+class FakeReddit:
+
+    def __init__(self, comments):
+        self.config = SimpleNamespace(username='irbot')
+        self.comments = comments
+
+    def subreddit(self, name):
+        return SimpleNamespace(stream=SimpleNamespace(comments=lambda: iter(self.comments)))
+
+
+def build_bot(comments, cache=None, **kwargs):
+    return IRacingBot(
+        subreddit='iracing',
+        sporting_code=SimpleNamespace(parsed=True),
+        reddit=FakeReddit(comments),
+        response_generator=FakeResponseGenerator(),
+        response_cache=cache if cache is not None else MemoryCache(),
+        **kwargs
+    )
+
+
+class IRacingBotTestCase(TestCase):
+
+    def test_extract_request(self):
+        bot = build_bot([])
+        self.assertEqual('what is sr', bot.extract_request(FakeComment('a', '!irbot what is sr')))
+        self.assertIsNone(bot.extract_request(FakeComment('b', 'what is sr')))
+        self.assertFalse(bot.is_candidate(FakeComment('c', '!irbot hi', author='irbot')))
+        self.assertFalse(bot.is_candidate(FakeComment('d', '   ')))
+
+    def test_begin_blocking_loop(self):
+        cache = MemoryCache()
+        cache.cache_comment_id('cached')
+        comments = [
+            FakeComment('a', '!irbot what is sr'),
+            FakeComment('b', 'not for the bot'),
+            FakeComment('cached', '!irbot already answered'),
+            FakeComment('own', '!irbot hi', author='irbot'),
+        ]
+        build_bot(comments, cache).begin_blocking_loop()
+        self.assertEqual(1, len(comments[0].replies))
+        self.assertTrue(comments[0].replies[0].startswith('response to what is sr'))
+        self.assertEqual([], comments[2].replies)
+        self.assertEqual([], comments[3].replies)
+        self.assertIn('a', cache.comment_ids)
+
+    def test_begin_async_loop__replies_at_most_once(self):
+        first = FakeComment('a', '!irbot what is sr', delay=0.05)
+        failing = FakeComment('f', '!irbot fails', fail=True)
+        comments = [first, failing, first, FakeComment('b', 'no prefix')] + [
+            OverlapCountingComment(str(number), f'!irbot question {number}', delay=0.01)
+            for number in range(20)
+        ]
+        cache = MemoryCache()
+        bot = build_bot(comments, cache)
+        bot.begin_async_loop(reply_workers=8, queue_size=4)
+        self.assertGreater(OverlapCountingComment.most_active, 1)  # replies overlapped
+        self.assertEqual(1, len(first.replies))
+        self.assertEqual([], failing.replies)
+        self.assertEqual({'a'} | {str(number) for number in range(20)}, cache.comment_ids)
+
+    def test_begin_async_loop__lets_go_of_finished_comments(self):
+        comments = [
+            FakeComment(str(number), f'!irbot question {number}') for number in range(10)
+        ] + [FakeComment('0', '!irbot question 0')]
+        pipeline = CommentPipeline(build_bot(comments), reply_workers=2)
+        asyncio.run(pipeline.run(comments))
+        self.assertEqual(set(), pipeline.claimed)
+        self.assertEqual(10, pipeline.replied)
+        self.assertEqual(1, len(comments[0].replies))
+
+    def test_begin_async_loop__duplicate_while_in_flight(self):
+        class CheckpointRecordingComment(FakeComment):
+            def reply(self, body):
+                super().reply(body)
+                checkpoints.append(checkpoint.checkpoint)
+
+        checkpoints = []
+        cache = MemoryCache()
+        checkpoint = StreamCheckpoint(cache, save_every=1)
+        first = CheckpointRecordingComment('a', '!irbot what is sr', delay=0.1, created_utc=1)
+        comments = [first, FakeComment('a', '!irbot what is sr', created_utc=1)]
+        bot = build_bot(comments, cache, checkpoint=checkpoint)
+        bot.begin_async_loop(reply_workers=2)
+        self.assertEqual(1, len(first.replies))
+        # the copy didn't let the checkpoint past the comment while it was being replied to
+        self.assertEqual([None], checkpoints)
+        self.assertEqual('t1_a', checkpoint.checkpoint['fullname'])
+        self.assertEqual({}, checkpoint.pending)
+
+    def test_send_reply__claimed_by_another_bot(self):
+        cache = MemoryCache()
+        bot = build_bot([], cache)
+        self.assertTrue(cache.claim('a'))   # another bot process got there first
+        comment = FakeComment('a', '!irbot what is sr')
+        self.assertFalse(bot.send_reply(comment, 'reply'))
+        self.assertEqual([], comment.replies)
+        failing = FakeComment('f', '!irbot fails', fail=True)
+        self.assertFalse(bot.send_reply(failing, 'reply'))
+        self.assertTrue(cache.claim('f'))   # released again so it can be answered later
+
+    def test_subreddits_are_streamed_as_a_multireddit(self):
+        bot = IRacingBot(
+            subreddit=['iracing', 'simracing'], sporting_code=None, reddit=FakeReddit([]),
+            response_generator=FakeResponseGenerator(), response_cache=MemoryCache()
+        )
+        self.assertEqual('iracing+simracing', bot.subreddit)
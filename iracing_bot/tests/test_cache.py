@@ -0,0 +1,283 @@
+from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
+from tempfile import TemporaryDirectory
+import time
+from unittest import TestCase
+
+from ..cache import Cache, FilesystemCache, MemoryCache, RedisCache, TieredCache
+
+
+class CountingCache(Cache):
+    """In memory backend that records how it was called
+    """
+
+    def __init__(self):
+        self.ids = set()
+        self.lookups = []
+        self.writes = []
+
+    def cache_comment_id(self, comment_id):
+        self.add_many([comment_id])
+
+    def comment_response_exists(self, comment_id):
+        return comment_id in self.exists_many([comment_id])
+
+    def exists_many(self, comment_ids):
+        self.lookups.append(list(comment_ids))
+        return {comment_id for comment_id in comment_ids if comment_id in self.ids}
+
+    def add_many(self, comment_ids):
+        self.writes.append(list(comment_ids))
+        self.ids.update(comment_ids)
+
+
+class FakeRedis:
+    """
+    The few Redis commands the cache and retry queue use, kept in memory. Records every round
+    trip to the server so batching can be checked; expiry times are kept but not enforced.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.expiries = {}
+        self.sorted_sets = {}
+        self.calls = []
+
+    def set(self, key, value, ex=None, nx=False):
+        self.calls.append('set')
+        return self.store(key, value, ex, nx)
+
+    def store(self, key, value, ex=None, nx=False):
+        if nx and key in self.values:
+            return None
+        self.values[key] = str(value).encode('utf-8')
+        self.expiries[key] = ex
+        return True
+
+    def get(self, key):
+        self.calls.append('get')
+        return self.values.get(key)
+
+    def mget(self, keys):
+        self.calls.append('mget')
+        return [self.values.get(key) for key in keys]
+
+    def delete(self, key):
+        self.calls.append('delete')
+        self.expiries.pop(key, None)
+        return int(self.values.pop(key, None) is not None)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def zadd(self, key, mapping):
+        self.calls.append('zadd')
+        self.sorted_sets.setdefault(key, {}).update(mapping)
+
+    def zrangebyscore(self, key, low, high, start=None, num=None):
+        self.calls.append('zrangebyscore')
+        members = sorted(self.sorted_sets.get(key, {}).items(), key=lambda item: item[1])
+        members = [
+            member.encode('utf-8') for member, score in members
+            if float(low) <= score <= float(high)
+        ]
+        return members[start:start + num] if start is not None else members
+
+    def zrem(self, key, member):
+        self.calls.append('zrem')
+        member = member.decode('utf-8') if isinstance(member, bytes) else member
+        return int(self.sorted_sets.get(key, {}).pop(member, None) is not None)
+
+    def zcard(self, key):
+        self.calls.append('zcard')
+        return len(self.sorted_sets.get(key, {}))
+
+
+class FakePipeline:
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.commands = []
+
+    def set(self, key, value, ex=None, nx=False):
+        self.commands.append((key, value, ex, nx))
+
+    def execute(self):
+        self.conn.calls.append('execute')
+        return [self.conn.store(*command) for command in self.commands]
+
+
+def build_redis_cache(ttl=None):
+    # redis-py only connects on the first command, which the fake client answers instead
+    cache = RedisCache('redis://localhost:6379/0', ttl=ttl)
+    cache.conn = FakeRedis()
+    return cache
+
+
+class TieredCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.backend = CountingCache()
+        self.backend.ids.add('old')
+        self.cache = TieredCache(self.backend, max_entries=3, write_batch_size=2)
+
+    def test_exists_many__answers_repeats_locally(self):
+        self.assertEqual({'old'}, self.cache.exists_many(['old', 'new']))
+        self.assertEqual({'old'}, self.cache.exists_many(['old', 'new']))
+        self.assertTrue(self.cache.comment_response_exists('old'))
+        self.assertEqual([['old', 'new']], self.backend.lookups)
+        self.assertEqual(3, self.cache.local_hits)
+
+    def test_exists_many__negative_entries_expire(self):
+        self.cache.negative_ttl = 0
+        self.cache.comment_response_exists('new')
+        self.backend.ids.add('new')
+        self.assertTrue(self.cache.comment_response_exists('new'))
+        self.assertEqual(2, len(self.backend.lookups))
+
+    def test_lru_eviction(self):
+        self.cache.exists_many(['a', 'b', 'c'])
+        self.cache.exists_many(['a'])
+        self.cache.exists_many(['d'])  # evicts b, the least recently used
+        self.assertEqual(['c', 'a', 'd'], list(self.cache.entries))
+
+    def test_add_many__batches_writes(self):
+        self.cache.last_flush = time.monotonic()
+        self.cache.cache_comment_id('a')
+        self.assertEqual([], self.backend.writes)
+        self.assertTrue(self.cache.comment_response_exists('a'))  # known before it's written
+        self.cache.cache_comment_id('b')
+        self.assertEqual([['a', 'b']], self.backend.writes)
+        self.cache.cache_comment_id('c')
+        self.cache.close()
+        self.assertEqual([['a', 'b'], ['c']], self.backend.writes)
+
+    def test_add_many__flushes_overdue_writes(self):
+        self.cache.flush_interval = 0
+        self.cache.cache_comment_id('a')
+        self.assertEqual([['a']], self.backend.writes)
+
+
+def claim_all(directory, comment_ids):
+    cache = FilesystemCache(directory)
+    return [comment_id for comment_id in comment_ids if cache.claim(comment_id)]
+
+
+class ClaimTestCase(TestCase):
+
+    def test_claim__memory(self):
+        cache = MemoryCache()
+        self.assertTrue(cache.claim('a'))
+        self.assertFalse(cache.claim('a'))
+        self.assertTrue(cache.comment_response_exists('a'))
+        cache.release('a')
+        self.assertTrue(cache.claim('a'))
+
+    def test_claim__tiered_goes_to_the_backend(self):
+        backend = MemoryCache()
+        cache = TieredCache(backend)
+        self.assertFalse(cache.comment_response_exists('a'))   # remembered as missing locally
+        backend.cache_comment_id('a')                          # replied to by another process
+        self.assertFalse(cache.claim('a'))
+        self.assertTrue(cache.claim('b'))
+        self.assertTrue(cache.comment_response_exists('b'))
+        cache.release('b')
+        self.assertFalse(backend.comment_response_exists('b'))
+        self.assertTrue(cache.claim('b'))
+
+    def test_claim__filesystem_across_processes(self):
+        with TemporaryDirectory() as directory:
+            comment_ids = [str(number) for number in range(200)]
+            context = multiprocessing.get_context('spawn')
+            with context.Pool(4) as pool:
+                claimed = pool.starmap(claim_all, [(directory, comment_ids)] * 4)
+            # every comment was claimed by exactly one of the processes
+            self.assertEqual(sorted(comment_ids), sorted(sum(claimed, [])))
+            cache = FilesystemCache(directory)
+            self.assertFalse(cache.claim('0'))
+            cache.release('0')
+            self.assertTrue(cache.claim('0'))
+
+
+class RedisCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.cache = build_redis_cache(ttl=60)
+        self.conn = self.cache.conn
+
+    def test_cache_comment_id(self):
+        self.cache.cache_comment_id('a')
+        self.assertTrue(self.cache.comment_response_exists('a'))
+        self.assertFalse(self.cache.comment_response_exists('b'))
+        self.assertEqual(60, self.conn.expiries['a'])
+
+    def test_exists_many__one_round_trip(self):
+        self.cache.add_many(['a', 'b'])
+        self.conn.calls.clear()
+        self.assertEqual({'a', 'b'}, self.cache.exists_many(['a', 'b', 'c']))
+        self.assertEqual(['mget'], self.conn.calls)
+        self.conn.calls.clear()
+        self.assertEqual(set(), self.cache.exists_many([]))
+        self.assertEqual([], self.conn.calls)
+
+    def test_add_many__one_round_trip(self):
+        self.cache.add_many(['a', 'b', 'c'])
+        self.assertEqual(['execute'], self.conn.calls)
+        self.assertEqual({'a': 60, 'b': 60, 'c': 60}, self.conn.expiries)
+
+    def test_claim(self):
+        self.assertTrue(self.cache.claim('a'))
+        self.assertFalse(self.cache.claim('a'))     # SET NX fails for whoever comes second
+        self.assertEqual(60, self.conn.expiries['a'])
+        self.cache.release('a')
+        self.assertTrue(self.cache.claim('a'))
+
+    def test_checkpoint(self):
+        self.assertIsNone(self.cache.load_checkpoint())
+        self.cache.save_checkpoint({'fullname': 't1_a', 'created_utc': 1})
+        self.assertEqual({'fullname': 't1_a', 'created_utc': 1}, self.cache.load_checkpoint())
+        self.assertIsNone(self.conn.expiries[Cache.CHECKPOINT_KEY])     # never expires
+
+
+class FilesystemCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_cache_comment_id(self):
+        cache = FilesystemCache(self.tmp_dir.name)
+        cache.cache_comment_id('a')
+        self.assertTrue(cache.comment_response_exists('a'))
+        self.assertFalse(cache.comment_response_exists('b'))
+        cache.add_many(['b', 'c'])
+        self.assertEqual({'a', 'c'}, cache.exists_many(['a', 'c', 'd']))
+        cache.close()
+        self.assertTrue(FilesystemCache(self.tmp_dir.name).comment_response_exists('c'))
+
+    def test_ttl(self):
+        cache = FilesystemCache(self.tmp_dir.name, ttl=0.01)
+        cache.cache_comment_id('a')
+        time.sleep(0.05)
+        self.assertFalse(cache.comment_response_exists('a'))
+
+    def test_checkpoint__not_evicted(self):
+        cache = FilesystemCache(self.tmp_dir.name, size_limit=64 * 1024)
+        cache.save_checkpoint({'fullname': 't1_a', 'created_utc': 1})
+        for number in range(100):
+            cache.cache_comment_id(f'{number}-' + 'x' * 4096)
+        self.assertFalse(cache.comment_response_exists('0-' + 'x' * 4096))   # evicted
+        self.assertEqual({'fullname': 't1_a', 'created_utc': 1}, cache.load_checkpoint())
+        cache.close()
+        self.assertEqual(
+            {'fullname': 't1_a', 'created_utc': 1},
+            FilesystemCache(self.tmp_dir.name).load_checkpoint()
+        )
+
+    def test_shared_between_threads(self):
+        cache = FilesystemCache(self.tmp_dir.name)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(cache.cache_comment_id, [str(number) for number in range(100)]))
+        self.assertEqual(100, len(cache.exists_many(str(number) for number in range(100))))
@@ -0,0 +1,110 @@
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from ..cache import FilesystemCache
+from ..checkpoint import StreamCheckpoint
+from .test_bot import FakeComment, build_bot
+
+
+class LookupCountingCache(FilesystemCache):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lookups = 0
+
+    def comment_response_exists(self, comment_id):
+        self.lookups += 1
+        return super().comment_response_exists(comment_id)
+
+
+class StreamCheckpointTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.cache = LookupCountingCache(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_is_new(self):
+        self.cache.save_checkpoint({'fullname': 't1_b', 'created_utc': 10})
+        checkpoint = StreamCheckpoint(self.cache)
+        self.assertFalse(checkpoint.is_new(FakeComment('a', '', created_utc=10)))
+        self.assertFalse(checkpoint.is_new(FakeComment('z', '', created_utc=9)))
+        self.assertTrue(checkpoint.is_new(FakeComment('c', '', created_utc=10)))
+        # past the replay, a comment that shows up late isn't dropped
+        self.assertTrue(checkpoint.is_new(FakeComment('y', '', created_utc=9)))
+        self.assertEqual(2, checkpoint.skipped)
+
+    def test_complete__saves_periodically(self):
+        checkpoint = StreamCheckpoint(self.cache, save_every=2, save_interval=3600)
+        for comment in (FakeComment('a', '', created_utc=1), FakeComment('b', '', created_utc=2)):
+            checkpoint.begin(comment)
+            checkpoint.complete(comment.id)
+            if comment.id == 'a':
+                self.assertIsNone(self.cache.load_checkpoint())
+        self.assertEqual({'fullname': 't1_b', 'created_utc': 2}, self.cache.load_checkpoint())
+
+    def test_complete__waits_for_earlier_comments(self):
+        checkpoint = StreamCheckpoint(self.cache, max_pending=3)
+        comments = [FakeComment(str(number), '', created_utc=number) for number in range(1, 6)]
+        for comment in comments[:3]:
+            checkpoint.begin(comment)
+        checkpoint.complete('2')
+        checkpoint.complete('3')
+        self.assertIsNone(checkpoint.checkpoint)
+        checkpoint.complete('1')
+        self.assertEqual('t1_3', checkpoint.checkpoint['fullname'])
+        # a comment that never completes only holds it back for max_pending comments
+        checkpoint.begin(comments[3])
+        checkpoint.begin(comments[4])
+        checkpoint.complete('5')
+        self.assertEqual('t1_3', checkpoint.checkpoint['fullname'])
+        for number in range(6, 9):
+            checkpoint.begin(FakeComment(str(number), '', created_utc=number))
+        self.assertEqual('t1_5', checkpoint.checkpoint['fullname'])
+
+    def test_restart__skips_replayed_comments(self):
+        def stream():
+            return [
+                FakeComment(str(number), f'!irbot question {number}', created_utc=number)
+                for number in range(10, 20)
+            ]
+
+        checkpoint = StreamCheckpoint(self.cache)
+        build_bot(stream(), self.cache, checkpoint=checkpoint).begin_blocking_loop()
+        self.assertEqual(10, self.cache.lookups)
+
+        restarted_checkpoint = StreamCheckpoint(self.cache)
+        replayed = stream()
+        build_bot(replayed, self.cache, checkpoint=restarted_checkpoint).begin_blocking_loop()
+        self.assertEqual(10, self.cache.lookups)
+        self.assertEqual(10, restarted_checkpoint.skipped)
+        self.assertTrue(all(not comment.replies for comment in replayed))
+
+    def test_restart__retries_the_comment_that_failed(self):
+        def stream():
+            return [
+                FakeComment(str(number), f'!irbot question {number}', created_utc=number)
+                for number in range(10, 15)
+            ]
+
+        class FailingResponseGenerator:
+
+            def respond_to_request(self, text):
+                if text == 'question 12':
+                    raise RuntimeError('classifier blew up')
+                return f'response to {text}'
+
+        bot = build_bot(stream(), self.cache, checkpoint=StreamCheckpoint(self.cache))
+        bot.response_generator = FailingResponseGenerator()
+        with self.assertRaises(RuntimeError):
+            bot.begin_blocking_loop()
+        self.assertEqual('t1_11', self.cache.load_checkpoint()['fullname'])
+
+        replayed = stream()
+        bot = build_bot(replayed, self.cache, checkpoint=StreamCheckpoint(self.cache))
+        bot.begin_blocking_loop()
+        self.assertEqual(
+            [False, False, True, True, True], [bool(comment.replies) for comment in replayed]
+        )
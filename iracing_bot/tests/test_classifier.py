@@ -0,0 +1,102 @@
+import os
+from unittest import TestCase
+
+from textblob.classifiers import NaiveBayesClassifier
+from textblob.exceptions import MissingCorpusError
+import yaml
+
+from ..classifier import VectorizedNaiveBayes
+
+
+TRAINING_FILE = os.path.join(os.path.dirname(__file__), '..', '..', 'training.yaml')
+TRAINING_DATA = [
+    ('what is my safety rating', 'safety-rating'),
+    ('how do I raise my sr', 'safety-rating'),
+    ('where is the sporting code', 'sporting-code'),
+    ("what's rule 3.5 of the sc?", 'sporting-code'),
+    ('how many incident points for contact', 'incidents'),
+]
+QUERIES = [
+    'safety rating', 'my sr dropped', 'sporting code please', 'incident points', 'contact',
+    'nothing we have seen before', '', "what's the sc say about contact?",
+]
+
+
+class VectorizedNaiveBayesTestCase(TestCase):
+
+    def setUp(self):
+        self.classifier = VectorizedNaiveBayes(TRAINING_DATA)
+
+    def test_tokenize(self):
+        self.assertEqual(
+            ['what', "'s", 'rule', '3.5', 'of', 'the', 'sc'],
+            VectorizedNaiveBayes.tokenize("what's rule 3.5 of the sc?")
+        )
+
+    def test_classify_batch(self):
+        results = self.classifier.classify_batch(['my safety rating', 'the sporting code'])
+        self.assertEqual(['safety-rating', 'sporting-code'], [label for label, _ in results])
+        for _, probability in results:
+            self.assertTrue(0 < probability <= 1)
+        self.assertEqual([], self.classifier.classify_batch([]))
+
+    def test_prob_classify(self):
+        probabilities = self.classifier.prob_classify('incident points')
+        self.assertAlmostEqual(1, sum(probabilities.values()))
+        self.assertEqual('incidents', max(probabilities, key=probabilities.get))
+        self.assertEqual('incidents', self.classifier.classify('incident points'))
+
+    def assert_same_model(self, expected, model):
+        self.assertEqual(expected.labels, model.labels)
+        for (label, probability), (expected_label, expected_probability) in zip(
+            model.classify_batch(QUERIES), expected.classify_batch(QUERIES)
+        ):
+            self.assertEqual(expected_label, label)
+            self.assertAlmostEqual(expected_probability, probability)
+
+    def test_updated__added(self):
+        added = [
+            ('what is an irating', 'irating'),
+            ('my sr went up after the race', 'safety-rating'),
+            ('what is my safety rating', 'safety-rating'),  # duplicates count twice
+        ]
+        model = self.classifier.updated(added=added)
+        self.assert_same_model(VectorizedNaiveBayes(TRAINING_DATA + added), model)
+        self.assertIn('irating', model.labels)
+
+    def test_updated__removed(self):
+        removed = [TRAINING_DATA[1], TRAINING_DATA[4]]  # the only incidents entry
+        model = self.classifier.updated(removed=removed)
+        remaining = [entry for entry in TRAINING_DATA if entry not in removed]
+        self.assert_same_model(VectorizedNaiveBayes(remaining), model)
+        self.assertNotIn('incidents', model.labels)
+
+    def test_updated__added_and_removed(self):
+        added = [('incident points for contact in a race', 'incidents'), ('sc', 'sporting-code')]
+        removed = [TRAINING_DATA[0], TRAINING_DATA[4]]
+        model = self.classifier.updated(added, removed)
+        remaining = [entry for entry in TRAINING_DATA if entry not in removed]
+        self.assert_same_model(VectorizedNaiveBayes(remaining + added), model)
+        # the original is left as it was, so it can keep classifying until the swap
+        self.assert_same_model(VectorizedNaiveBayes(TRAINING_DATA), self.classifier)
+
+    def test_matches_textblob(self):
+        with open(TRAINING_FILE) as f:
+            training_yaml = [
+                (entry, block['label'])
+                for block in yaml.safe_load(f)['training_data'] for entry in block['entries']
+            ]
+        for training_data in (TRAINING_DATA, training_yaml):
+            texts = QUERIES + [text for text, _ in training_data]
+            try:
+                textblob = NaiveBayesClassifier(training_data)
+                expected = [textblob.prob_classify(text) for text in texts]
+            except MissingCorpusError:
+                self.skipTest(
+                    'the nltk punkt corpus is needed to run textblob, '
+                    'see `python -m textblob.download_corpora lite`'
+                )
+            results = VectorizedNaiveBayes(training_data).classify_batch(texts)
+            for distribution, (label, probability) in zip(expected, results):
+                self.assertEqual(distribution.max(), label)
+                self.assertAlmostEqual(distribution.prob(label), probability)
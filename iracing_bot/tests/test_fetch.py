@@ -0,0 +1,120 @@
+import hashlib
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Thread
+from unittest import TestCase
+from unittest.mock import patch
+from urllib.error import HTTPError
+
+from ..fetch import DocumentFetcher
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Serves `server.content` with an ETag and honours If-None-Match, or fails with
+    `server.status` if it is set
+    """
+
+    def do_GET(self):
+        server = self.server
+        server.requests += 1
+        if server.status:
+            self.send_response(server.status)
+            self.end_headers()
+            return
+        etag = '"{}"'.format(hashlib.md5(server.content).hexdigest())
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        server.downloads += 1
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(server.content)))
+        self.end_headers()
+        self.wfile.write(server.content)
+
+    def log_message(self, *args):
+        pass
+
+
+class DocumentFetcherTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.server = HTTPServer(('127.0.0.1', 0), StandInHandler)
+        self.server.content = b'%PDF-1.4 first version' * 10000
+        self.server.requests = 0
+        self.server.downloads = 0
+        self.server.status = None
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}/sporting_code.pdf'
+        self.fetcher = DocumentFetcher(os.path.join(self.tmp_dir.name, 'cache'))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp_dir.cleanup()
+
+    def test_fetch__downloads_then_revalidates(self):
+        first = self.fetcher.fetch(self.url)
+        self.assertFalse(first.from_cache)
+        with open(first.path, 'rb') as f:
+            self.assertEqual(self.server.content, f.read())
+        self.assertEqual(hashlib.sha256(self.server.content).hexdigest(), first.sha256)
+
+        second = self.fetcher.fetch(self.url)
+        self.assertTrue(second.from_cache)
+        self.assertEqual(first.sha256, second.sha256)
+        self.assertEqual(2, self.server.requests)
+        self.assertEqual(1, self.server.downloads)
+
+    def test_fetch__content_changed(self):
+        first = self.fetcher.fetch(self.url)
+        self.server.content = b'%PDF-1.4 second version'
+        second = self.fetcher.fetch(self.url)
+        self.assertFalse(second.from_cache)
+        self.assertNotEqual(first.sha256, second.sha256)
+        self.assertEqual(2, self.server.downloads)
+
+    def test_fetch__server_errors(self):
+        self.server.status = 503
+        with self.assertRaises(HTTPError):
+            self.fetcher.fetch(self.url)    # nothing cached to fall back on
+
+        self.server.status = None
+        first = self.fetcher.fetch(self.url)
+        self.server.status = 503
+        second = self.fetcher.fetch(self.url)
+        self.assertTrue(second.from_cache)
+        self.assertEqual(first.sha256, second.sha256)
+        self.server.status = 404
+        with self.assertRaises(HTTPError):
+            self.fetcher.fetch(self.url)
+
+    def test_fetch__metadata_never_describes_another_download(self):
+        first = self.fetcher.fetch(self.url)
+        self.server.content = b'%PDF-1.4 second version'
+        # the process dies after the new document is in place, before its metadata is
+        with patch('iracing_bot.fetch.json.dump', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                self.fetcher.fetch(self.url)
+        self.assertEqual([os.path.basename(first.path)], os.listdir(self.fetcher.cache_directory))
+        # so the next start downloads it again rather than trusting the old ETag and hash
+        second = self.fetcher.fetch(self.url)
+        self.assertFalse(second.from_cache)
+        self.assertEqual(hashlib.sha256(self.server.content).hexdigest(), second.sha256)
+        with open(second.path + '.json') as f:
+            self.assertEqual(second.sha256, json.load(f)['sha256'])
+
+    def test_fetch__local_paths(self):
+        path = os.path.join(self.tmp_dir.name, 'local.pdf')
+        with open(path, 'wb') as f:
+            f.write(b'%PDF-1.4 local')
+        expected = hashlib.sha256(b'%PDF-1.4 local').hexdigest()
+        for url in (path, Path(path).as_uri()):
+            document = self.fetcher.fetch(url)
+            self.assertEqual(path, document.path)
+            self.assertEqual(expected, document.sha256)
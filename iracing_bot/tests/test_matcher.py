@@ -0,0 +1,77 @@
+from unittest import TestCase
+
+from ..matcher import RelevancePrefilter, TriggerMatcher
+from ..responder import ResponseGenerator
+
+
+TRAINING_DATA = [
+    ('what is my safety rating', 'safety-rating'),
+    ('how do I raise my sr', 'safety-rating'),
+    ('where is the sporting code', 'sporting-code'),
+    ('how many incident points for contact', 'incidents'),
+]
+
+
+class TriggerMatcherTestCase(TestCase):
+
+    def setUp(self):
+        self.matcher = TriggerMatcher(
+            triggers=['!irbot', '!iracingbot'], keywords=['safety rating', 'sr', 'incident']
+        )
+
+    def test_extract_request(self):
+        self.assertEqual('what is sr', self.matcher.extract_request('!irbot what is sr'))
+        self.assertEqual('help', self.matcher.extract_request('!iracingbot help'))
+        self.assertEqual('', self.matcher.extract_request('!irbot'))
+        self.assertIsNone(self.matcher.extract_request('what is !irbot'))
+        self.assertIsNone(self.matcher.extract_request('sr is a trigger word, not a trigger'))
+
+    def test_find_keywords(self):
+        self.assertEqual(
+            ['safety rating', 'incident'],
+            self.matcher.find_keywords('My Safety Rating dropped after an incident, SAFETY RATING')
+        )
+        # keywords only count as whole words
+        self.assertEqual([], self.matcher.find_keywords('the srs was incidentally fine'))
+        self.assertEqual(['sr'], self.matcher.find_keywords('sr and incident', limit=1))
+
+    def test_no_triggers_or_keywords(self):
+        matcher = TriggerMatcher()
+        self.assertIsNone(matcher.extract_request('!irbot hi'))
+        self.assertEqual([], matcher.find_keywords('safety rating'))
+
+
+class RelevancePrefilterTestCase(TestCase):
+
+    def test_training_keywords(self):
+        keywords = RelevancePrefilter.training_keywords(TRAINING_DATA)
+        self.assertIn('safety', keywords)
+        self.assertIn('sr', keywords)
+        self.assertNotIn('what', keywords)     # stop words are left out
+
+    def test_is_relevant(self):
+        prefilter = RelevancePrefilter(['safety', 'rating', 'sr'], min_keywords=2)
+        self.assertTrue(prefilter.is_relevant('what is a good safety rating'))
+        self.assertFalse(prefilter.is_relevant('what is a good rating rating'))
+        self.assertFalse(prefilter.is_relevant('nice pass into turn one'))
+        report = prefilter.report()
+        self.assertEqual(3, report['checked'])
+        self.assertEqual(2, report['rejected'])
+        self.assertGreater(report['prefilter_seconds'], 0)
+        self.assertIsNone(report['estimated_seconds_saved'])
+
+    def test_classify_batch(self):
+        generator = ResponseGenerator(
+            training_data=TRAINING_DATA, engine='numpy', prefilter_min_keywords=1
+        )
+        results = generator.classify_batch(
+            ['nice pass into turn one', 'my safety rating', 'great race everyone', 'the sr']
+        )
+        self.assertEqual((None, 0.0), results[0])
+        self.assertEqual('safety-rating', results[1][0])
+        self.assertEqual((None, 0.0), results[2])
+        self.assertEqual('safety-rating', results[3][0])
+        report = generator.prefilter.report()
+        self.assertEqual(4, report['checked'])
+        self.assertEqual(2, report['rejected'])
+        self.assertGreater(report['estimated_seconds_saved'], 0)
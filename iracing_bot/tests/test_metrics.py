@@ -0,0 +1,169 @@
+import os
+from tempfile import TemporaryDirectory
+import time
+from unittest import TestCase
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from ..cache import MemoryCache
+from ..metrics import METRICS, Histogram, Metrics, MetricsServer
+from ..profiler import SamplingProfiler
+from .test_bot import FakeComment, build_bot
+
+
+class MetricsTestCase(TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+
+    def test_histogram__buckets(self):
+        histogram = Histogram(buckets=(0.1, 1, float('inf')))
+        for value in (0.05, 0.1, 0.5, 5):
+            histogram.observe(value)
+        self.assertEqual(
+            [(0.1, 2), (1, 3), (float('inf'), 4)], list(histogram.cumulative_counts())
+        )
+        self.assertAlmostEqual(5.65, histogram.sum)
+
+    def test_timer(self):
+        with self.metrics.timer('classify'):
+            time.sleep(0.01)
+        histogram = self.metrics.histogram('classify')
+        self.assertEqual(1, histogram.count)
+        self.assertGreaterEqual(histogram.sum, 0.01)
+
+    def test_timer__records_failures(self):
+        with self.assertRaises(ValueError):
+            with self.metrics.timer('reply'):
+                raise ValueError()
+        self.assertEqual(1, self.metrics.histogram('reply').count)
+
+    def test_render(self):
+        self.metrics.increment('iracing_bot_replies_total', outcome='sent')
+        self.metrics.increment('iracing_bot_replies_total', 2, outcome='sent')
+        self.metrics.gauge('iracing_bot_reply_retry_queue_depth', lambda: 7)
+        self.metrics.observe(self.metrics.STAGE_METRIC, 0.003, stage='cache_check')
+        text = self.metrics.render()
+        self.assertIn('# TYPE iracing_bot_replies_total counter\n', text)
+        self.assertIn('iracing_bot_replies_total{outcome="sent"} 3\n', text)
+        self.assertIn('iracing_bot_reply_retry_queue_depth 7\n', text)
+        self.assertIn('# TYPE iracing_bot_stage_duration_seconds histogram\n', text)
+        self.assertIn(
+            'iracing_bot_stage_duration_seconds_bucket{stage="cache_check",le="0.0025"} 0\n', text
+        )
+        self.assertIn(
+            'iracing_bot_stage_duration_seconds_bucket{stage="cache_check",le="0.005"} 1\n', text
+        )
+        self.assertIn(
+            'iracing_bot_stage_duration_seconds_bucket{stage="cache_check",le="+Inf"} 1\n', text
+        )
+        self.assertIn('iracing_bot_stage_duration_seconds_count{stage="cache_check"} 1\n', text)
+
+    def test_render__escapes_labels(self):
+        self.metrics.increment('events_total', reason='say "hi"\n')
+        self.assertIn('events_total{reason="say \\"hi\\"\\n"} 1', self.metrics.render())
+
+    def test_server(self):
+        self.metrics.increment('iracing_bot_comments_received_total')
+        server = MetricsServer(self.metrics, port=0)
+        server.start()
+        try:
+            with urlopen(f'http://127.0.0.1:{server.port}/metrics') as response:
+                self.assertIn('text/plain', response.headers['Content-Type'])
+                self.assertIn(
+                    'iracing_bot_comments_received_total 1', response.read().decode('utf-8')
+                )
+            with self.assertRaises(HTTPError):
+                urlopen(f'http://127.0.0.1:{server.port}/other')
+        finally:
+            server.stop()
+
+
+class BotMetricsTestCase(TestCase):
+
+    def setUp(self):
+        METRICS.reset()
+
+    def tearDown(self):
+        METRICS.reset()
+
+    def assert_stage_counts(self):
+        self.assertEqual(4, METRICS.count('iracing_bot_comments_received_total'))
+        self.assertEqual(
+            2, METRICS.count('iracing_bot_comments_skipped_total', reason='not_a_request')
+        )
+        self.assertEqual(1, METRICS.count('iracing_bot_comments_skipped_total', reason='cached'))
+        self.assertEqual(1, METRICS.count('iracing_bot_replies_total', outcome='sent'))
+        self.assertEqual(4, METRICS.histogram('stream_receive').count)
+        self.assertEqual(2, METRICS.histogram('cache_check').count)
+        self.assertEqual(1, METRICS.histogram('respond').count)
+        self.assertEqual(1, METRICS.histogram('reply').count)
+
+    def build_comments(self):
+        return [
+            FakeComment('a', '!irbot what is sr'),
+            FakeComment('b', 'not for the bot'),
+            FakeComment('cached', '!irbot already answered'),
+            FakeComment('own', '!irbot hi', author='irbot'),
+        ]
+
+    def test_blocking_loop(self):
+        cache = MemoryCache()
+        cache.cache_comment_id('cached')
+        build_bot(self.build_comments(), cache).begin_blocking_loop()
+        self.assert_stage_counts()
+
+    def test_async_loop(self):
+        cache = MemoryCache()
+        cache.cache_comment_id('cached')
+        build_bot(self.build_comments(), cache).begin_async_loop(reply_workers=2)
+        self.assert_stage_counts()
+
+
+class SlowComment(FakeComment):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.body = '!irbot slow'
+
+    def reply(self, body):
+        busy_wait(0.05)
+
+
+def busy_wait(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+class SamplingProfilerTestCase(TestCase):
+
+    def test_profiles_the_loop(self):
+        with TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'profile.txt')
+            profiler = SamplingProfiler(path, interval=0.001)
+            build_bot([SlowComment('a', '')], profiler=profiler).begin_blocking_loop()
+            with open(path) as f:
+                lines = f.read().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(any('bot.py:begin_blocking_loop' in line for line in lines))
+        self.assertTrue(any(line.split(';')[-1].startswith('test_metrics.py:busy_wait')
+                            for line in lines))
+        stack, count = lines[0].rsplit(' ', 1)
+        self.assertGreater(int(count), 0)
+        report = profiler.report()
+        self.assertEqual(len(lines), report['stacks'])
+        self.assertEqual(sum(int(line.rsplit(' ', 1)[1]) for line in lines), report['samples'])
+
+    def test_writes_while_running(self):
+        with TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'profile.txt')
+            profiler = SamplingProfiler(path, interval=0.001, write_interval=0.01)
+            profiler.start()
+            deadline = time.monotonic() + 5
+            while not os.path.exists(path):
+                self.assertLess(time.monotonic(), deadline, 'the samples were never written')
+                busy_wait(0.01)
+            with open(path) as f:
+                self.assertTrue(f.read().strip())
+            profiler.stop()
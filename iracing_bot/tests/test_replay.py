@@ -0,0 +1,38 @@
+from unittest import TestCase
+
+from ..fake_reddit import FakeReddit, generate_comments
+from ..replay import percentile, run_replay
+from .test_bot import FakeResponseGenerator
+
+
+class ReplayTestCase(TestCase):
+
+    def setUp(self):
+        self.records = generate_comments(200, request_ratio=0.5, duplicate_ratio=0.2, seed=1)
+        self.requests = {
+            record['id'] for record in self.records if record['body'].startswith('!irbot')
+        }
+
+    def test_run_replay(self):
+        for async_pipeline in (False, True):
+            reddit = FakeReddit(self.records, reply_latency=0.001, seed=1)
+            report = run_replay(reddit, FakeResponseGenerator(), async_pipeline=async_pipeline)
+            self.assertEqual(200, report['comments'])
+            self.assertEqual(len(self.requests), report['replies'])
+            self.assertEqual(0, report['duplicate_replies'])
+            self.assertGreaterEqual(report['reply_latency_seconds']['p50'], 0.001)
+
+    def test_run_replay__injected_errors(self):
+        records = self.records + [
+            {'id': 'zz', 'body': '!irbot fails', 'author': 'someone', 'fail': True}
+        ]
+        reddit = FakeReddit(records, seed=1)
+        report = run_replay(reddit, FakeResponseGenerator(), async_pipeline=True)
+        self.assertEqual(1, report['reply_errors'])
+        self.assertNotIn('zz', [comment_id for comment_id, _, _ in reddit.replies])
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(51, percentile(values, 0.5))
+        self.assertEqual(100, percentile(values, 0.99))
+        self.assertIsNone(percentile([], 0.5))
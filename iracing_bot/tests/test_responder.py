@@ -0,0 +1,201 @@
+import os
+from tempfile import TemporaryDirectory
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+from ..responder import ResponseGenerator
+from ..sporting_code import Formatter, Section, SportingCode
+
+
+class CountingClassifier:
+    """Stands in for the textblob classifier so we can count how often training happens
+    """
+    trained = 0
+
+    def __init__(self, training_data):
+        self.training_data = training_data
+
+    @property
+    def classifier(self):
+        CountingClassifier.trained += 1
+        return self
+
+
+TRAINING_YAML = """
+training_data:
+  - label: sporting-code
+    entries:
+      - sporting code
+  - label: safety-rating
+    entries:
+      - safety rating
+"""
+
+
+@patch('textblob.classifiers.NaiveBayesClassifier', CountingClassifier)
+class ResponseGeneratorModelTestCase(TestCase):
+
+    def setUp(self):
+        CountingClassifier.trained = 0
+        self.tmp_dir = TemporaryDirectory()
+        self.training_file = os.path.join(self.tmp_dir.name, 'training.yaml')
+        self.model_path = os.path.join(self.tmp_dir.name, 'model.pickle')
+        with open(self.training_file, 'w') as f:
+            f.write(TRAINING_YAML)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def build(self):
+        return ResponseGenerator(training_file=self.training_file, model_path=self.model_path)
+
+    def test_model__reused_when_unchanged(self):
+        self.build()
+        generator = self.build()
+        self.assertEqual(1, CountingClassifier.trained)
+        self.assertEqual(
+            [('sporting code', 'sporting-code'), ('safety rating', 'safety-rating')],
+            generator.classifier.training_data
+        )
+
+    def test_model__retrained_when_training_changes(self):
+        self.build()
+        with open(self.training_file, 'a') as f:
+            f.write('      - sr\n')
+        generator = self.build()
+        self.assertEqual(2, CountingClassifier.trained)
+        self.assertIn(('sr', 'safety-rating'), generator.classifier.training_data)
+
+    def test_reload_training__textblob_retrains(self):
+        generator = self.build()
+        with open(self.training_file, 'a') as f:
+            f.write('      - sr\n')
+        self.assertTrue(generator.reload_training())
+        self.assertEqual(2, CountingClassifier.trained)
+        self.assertIn(('sr', 'safety-rating'), generator.classifier.training_data)
+
+
+class TrainingReloadTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.training_file = os.path.join(self.tmp_dir.name, 'training.yaml')
+        self.model_path = os.path.join(self.tmp_dir.name, 'model.pickle')
+        self.write_training(TRAINING_YAML)
+        self.generator = ResponseGenerator(
+            training_file=self.training_file, model_path=self.model_path, engine='numpy'
+        )
+
+    def tearDown(self):
+        self.generator.stop()
+        self.tmp_dir.cleanup()
+
+    def write_training(self, text):
+        with open(self.training_file, 'w') as f:
+            f.write(text)
+
+    def test_reload_training__unchanged(self):
+        self.assertFalse(self.generator.reload_training())
+
+    def test_reload_training__applies_the_changes(self):
+        old_classifier = self.generator.classifier
+        self.write_training(TRAINING_YAML.replace(
+            '  - label: sporting-code\n    entries:\n      - sporting code\n', ''
+        ) + (
+            '  - label: irating\n'
+            '    entries:\n'
+            '      - irating\n'
+        ))
+        self.assertTrue(self.generator.reload_training())
+        self.assertIsNot(old_classifier, self.generator.classifier)
+        self.assertEqual(['irating', 'safety-rating'], self.generator.classifier.labels)
+        self.assertEqual(['safety-rating', 'sporting-code'], old_classifier.labels)
+        self.assertEqual(
+            [('safety rating', 'safety-rating'), ('irating', 'irating')],
+            self.generator.training_data
+        )
+        # the updated model is stored for the next start
+        stored = self.generator.load_model(self.generator.model_key())
+        self.assertEqual(['irating', 'safety-rating'], stored.labels)
+
+    def test_reload_training__keeps_the_model_on_errors(self):
+        classifier = self.generator.classifier
+        self.write_training('training_data: [')
+        self.assertFalse(self.generator.reload_training())
+        self.assertIs(classifier, self.generator.classifier)
+
+    def test_watch_training(self):
+        self.generator.watch_training(interval=0.01)
+        with open(self.training_file, 'a') as f:
+            f.write('      - sr\n')
+        # make sure the change is visible even on filesystems with coarse timestamps
+        modified = os.stat(self.training_file).st_mtime + 1
+        os.utime(self.training_file, (modified, modified))
+        deadline = time.monotonic() + 5
+        while ('sr', 'safety-rating') not in self.generator.training_data:
+            self.assertLess(time.monotonic(), deadline, 'the training file was not reloaded')
+            time.sleep(0.01)
+
+    def test_watch_training__keeps_going_after_errors(self):
+        model_key = self.generator.model_key
+        failures = []
+
+        def failing_model_key():
+            if not failures:
+                failures.append(True)
+                raise FileNotFoundError(self.training_file)
+            return model_key()
+
+        self.generator.model_key = failing_model_key
+        self.test_watch_training()
+        self.assertEqual([True], failures)
+        self.generator.stop()
+        self.assertFalse(self.generator.watcher.is_alive())
+
+    def test_save_model__per_process_temp_file(self):
+        self.generator.save_model('key')
+        self.assertEqual(
+            ['model.pickle', 'training.yaml'], sorted(os.listdir(self.tmp_dir.name))
+        )
+
+
+class QuoteSportingCodeTestCase(TestCase):
+
+    def setUp(self):
+        sporting_code = SportingCode('')
+        sporting_code.sections = [
+            Section(idx, text, page, formatter=Formatter())
+            for idx, text, page in (
+                ('3.', 'Incidents', 1),
+                ('3.5.', 'Incident points are given for contact and going off track', 1),
+                ('3.5.1.', 'Contact with another car is worth 4 incident points', 2),
+                ('5.', 'Flags', 3),
+                ('5.3.', 'The black flag means serve a penalty in the pit lane', 3),
+            )
+        ]
+        sporting_code.build_section_hierarchy()
+        self.generator = ResponseGenerator(
+            training_data=[('sporting code', 'sporting-code')], engine='numpy',
+            sporting_code=sporting_code
+        )
+
+    def quoted(self, text):
+        return self.generator.quote_sporting_code(text).split('\n\n')[1].split('**')[1]
+
+    def test_quotes_the_section_named(self):
+        self.assertEqual('3.5.', self.quoted('what is 3.5'))
+        self.assertEqual('3.5.1.', self.quoted('!irbot what is rule 3.5.1?'))
+        self.assertEqual('5.3.', self.quoted('section 5.3. please'))
+
+    def test_quotes_the_closest_ancestor(self):
+        self.assertEqual('3.5.', self.quoted('what does rule 3.5.9 say'))
+        self.assertEqual('3.5.', self.quoted('what does 3.5.9. say'))
+
+    def test_bare_numbers_have_to_be_sections(self):
+        # 3.9 isn't a section, so this is searched rather than taken to mean section 3
+        self.assertEqual('5.3.', self.quoted('do I have to pit within 3.9 seconds of a black flag'))
+
+    def test_searches_when_no_section_is_named(self):
+        self.assertEqual('5.3.', self.quoted('what does the black flag mean'))
+        self.assertEqual('3.5.1.', self.quoted('contact with another car in 2018.09'))
@@ -0,0 +1,191 @@
+import random
+from tempfile import TemporaryDirectory
+from types import SimpleNamespace
+from unittest import TestCase
+
+from praw.exceptions import RedditAPIException
+
+from ..scheduler import DiskRetryQueue, RedisRetryQueue, ReplyScheduler, TokenBucket
+from .test_cache import CountingCache, FakeRedis
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class FlakyComment:
+
+    def __init__(self, comment_id, errors):
+        self.id = comment_id
+        self.errors = list(errors)
+        self.replies = []
+
+    def reply(self, body):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.replies.append(body)
+
+
+class TokenBucketTestCase(TestCase):
+
+    def test_reserve(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, capacity=2, clock=clock)
+        self.assertEqual([0, 0, 0.5, 1.0], [bucket.reserve() for _ in range(4)])
+        clock.now += 1  # pays back the two tokens that were borrowed
+        self.assertEqual(0.5, bucket.reserve())
+        clock.now += 10
+        self.assertEqual(0, bucket.reserve())
+
+
+class DiskRetryQueueTestCase(TestCase):
+
+    def test_pop_due__earliest_due_first(self):
+        with TemporaryDirectory() as directory:
+            retry_queue = DiskRetryQueue(directory)
+            retry_queue.push({'comment_id': 'late', 'not_before': 1000})
+            retry_queue.push({'comment_id': 'second', 'not_before': 15})
+            retry_queue.push({'comment_id': 'first', 'not_before': 10})
+            self.assertEqual('first', retry_queue.pop_due(20)['comment_id'])
+            self.assertEqual('second', retry_queue.pop_due(20)['comment_id'])
+            self.assertIsNone(retry_queue.pop_due(20))
+            self.assertEqual(1, len(retry_queue))
+            self.assertEqual('late', retry_queue.pop_due(1000)['comment_id'])
+
+    def test_pop_due__in_due_order(self):
+        rng = random.Random(1)
+        due = [rng.uniform(0, 10 ** 10) for _ in range(100)]
+        with TemporaryDirectory() as directory:
+            retry_queue = DiskRetryQueue(directory)
+            for not_before in due:
+                retry_queue.push({'comment_id': 'a', 'not_before': not_before})
+            popped = []
+            entry = retry_queue.pop_due(5 * 10 ** 9)
+            while entry is not None:
+                popped.append(entry['not_before'])
+                entry = retry_queue.pop_due(5 * 10 ** 9)
+            self.assertEqual(sorted(t for t in due if t <= 5 * 10 ** 9), popped)
+            self.assertEqual(len(due) - len(popped), len(retry_queue))
+
+
+class RedisRetryQueueTestCase(TestCase):
+
+    def test_pop_due__earliest_due_first(self):
+        retry_queue = RedisRetryQueue(FakeRedis())
+        retry_queue.push({'comment_id': 'late', 'not_before': 1000})
+        retry_queue.push({'comment_id': 'second', 'not_before': 15})
+        retry_queue.push({'comment_id': 'first', 'not_before': 10})
+        self.assertEqual(3, len(retry_queue))
+        self.assertEqual('first', retry_queue.pop_due(20)['comment_id'])
+        self.assertEqual('second', retry_queue.pop_due(20)['comment_id'])
+        self.assertIsNone(retry_queue.pop_due(20))
+        self.assertEqual('late', retry_queue.pop_due(1000)['comment_id'])
+        self.assertEqual(0, len(retry_queue))
+
+    def test_pop_due__taken_by_another_bot(self):
+        class RacingRedis(FakeRedis):
+            def zrangebyscore(self, *args, **kwargs):
+                members = super().zrangebyscore(*args, **kwargs)
+                for member in members:     # another bot takes them before this one can
+                    super().zrem(args[0], member)
+                return members
+
+        retry_queue = RedisRetryQueue(RacingRedis())
+        retry_queue.push({'comment_id': 'a', 'not_before': 10})
+        self.assertIsNone(retry_queue.pop_due(20))
+
+
+class ReplySchedulerTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.clock = FakeClock()
+        self.comments = {}
+        self.reddit = SimpleNamespace(
+            auth=SimpleNamespace(limits={'remaining': None, 'reset_timestamp': None}),
+            comment=lambda comment_id: self.comments[comment_id],
+        )
+        self.cache = CountingCache()
+        self.scheduler = ReplyScheduler(
+            self.reddit, self.cache, DiskRetryQueue(self.tmp_dir.name), rate=1, burst=1,
+            base_delay=1, clock=self.clock, sleep=self.clock.sleep
+        )
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_reply__paced_by_bucket(self):
+        self.scheduler.bucket.clock = self.clock
+        self.scheduler.bucket.updated = self.clock.now
+        for number in range(3):
+            self.assertTrue(self.scheduler.reply(FlakyComment(str(number), []), 'hi'))
+        self.assertEqual([1.0, 1.0], self.clock.slept)
+        self.assertEqual({'0', '1', '2'}, self.cache.ids)
+
+    def test_reply__waits_for_rate_limit_reset(self):
+        self.reddit.auth.limits = {'remaining': 0, 'reset_timestamp': self.clock.now + 30}
+        self.scheduler.reply(FlakyComment('a', []), 'hi')
+        self.assertEqual(30, self.scheduler.current_delay)
+
+    def test_reply__retried_after_server_delay(self):
+        ratelimit = RedditAPIException(
+            [['RATELIMIT', 'you are doing that too much. try again in 9 minutes.', 'ratelimit']]
+        )
+        comment = self.comments['a'] = FlakyComment('a', [ratelimit])
+        self.assertFalse(self.scheduler.reply(comment, 'hi'))
+        self.assertEqual(1, self.scheduler.queue_depth)
+
+        self.clock.now += 60
+        self.assertEqual(0, self.scheduler.process_retries())  # not due for 9 minutes
+        self.clock.now += 9 * 60
+        self.assertEqual(1, self.scheduler.process_retries())
+        self.assertEqual(['hi'], comment.replies)
+        self.assertEqual(0, self.scheduler.queue_depth)
+        self.assertEqual({'a'}, self.cache.ids)
+
+    def test_reply__gives_up_after_max_attempts(self):
+        self.scheduler.max_attempts = 2
+        error = RedditAPIException([['SOMETHING', 'went wrong', None]])
+        comment = self.comments['a'] = FlakyComment('a', [error, error, error])
+        self.scheduler.reply(comment, 'hi')
+        self.clock.now += 10
+        self.scheduler.process_retries()
+        self.assertEqual(0, self.scheduler.queue_depth)
+        self.assertEqual([], comment.replies)
+
+    def test_process_retries__requeues_after_unexpected_errors(self):
+        error = RedditAPIException([['SOMETHING', 'went wrong', None]])
+        comment = self.comments['a'] = FlakyComment('a', [error, ValueError('bad response')])
+        self.assertFalse(self.scheduler.reply(comment, 'hi'))
+        self.clock.now += 10
+        self.assertEqual(0, self.scheduler.process_retries())
+        self.assertEqual(1, self.scheduler.queue_depth)    # not lost, retried later instead
+        self.clock.now += 10
+        self.assertEqual(1, self.scheduler.process_retries())
+        self.assertEqual(['hi'], comment.replies)
+
+    def test_retry_queue__durable(self):
+        self.scheduler.retry_queue.push({'comment_id': 'a', 'not_before': 0})
+        self.assertEqual(1, len(DiskRetryQueue(self.tmp_dir.name)))
+
+    def test_reply__retries_submissions(self):
+        submission = FlakyComment('a', [RedditAPIException([['SOMETHING', 'went wrong', None]])])
+        submission.fullname = 't3_a'
+        self.reddit.submission = lambda submission_id: {'a': submission}[submission_id]
+        self.comments['a'] = FlakyComment('a', [])     # a comment with the same id
+        self.assertFalse(self.scheduler.reply(submission, 'hi'))
+        self.clock.now += 10
+        self.assertEqual(1, self.scheduler.process_retries())
+        self.assertEqual(['hi'], submission.replies)
+        self.assertEqual([], self.comments['a'].replies)
+        self.assertEqual({'t3_a'}, self.cache.ids)
@@ -0,0 +1,49 @@
+from unittest import TestCase
+
+from ..search import SearchIndex
+from ..sporting_code import SportingCode, Section, Formatter
+
+
+class SearchIndexTestCase(TestCase):
+
+    def setUp(self):
+        self.index = SearchIndex().build([
+            ('1.', 'General rules apply to every official session'),
+            ('3.5.', 'Incident points are given for going off track and contact with cars'),
+            ('3.6.', 'Safety rating is calculated from incidents per corner'),
+            ('4.', 'Protests must be filed within 48 hours of the race'),
+        ])
+
+    def test_tokenize(self):
+        self.assertEqual(['incid', 'point'], self.index.tokenize("What's the incident points?"))
+        self.assertEqual(
+            ['rule', '3.5.1', '2018.09'], self.index.tokenize('rule 3.5.1. in 2018.09')
+        )
+
+    def test_search__ranks_matches(self):
+        results = self.index.search("how do incident points work?", k=2)
+        self.assertEqual(['3.5.', '3.6.'], [key for key, _ in results])
+        self.assertGreater(results[0][1], results[1][1])
+
+    def test_search__no_matches(self):
+        self.assertEqual([], self.index.search('hello there'))
+
+    def test_term_share(self):
+        self.assertEqual(0.5, self.index.term_share('incid'))
+        self.assertEqual(0.0, self.index.term_share('flag'))
+        self.assertEqual(0.0, SearchIndex().term_share('incid'))
+
+    def test_to_dict__round_trip(self):
+        index = SearchIndex.from_dict(self.index.to_dict())
+        self.assertEqual(self.index.search('protest race'), index.search('protest race'))
+
+
+class SportingCodeSearchTestCase(TestCase):
+
+    def test_search(self):
+        sporting_code = SportingCode('')
+        sporting_code.sections = [
+            Section('3.5.', 'Incident points for contact', 1, formatter=Formatter()),
+            Section('4.', 'Filing a protest', 2, formatter=Formatter()),
+        ]
+        self.assertEqual([sporting_code.get_section('4.')], sporting_code.search('protests'))
@@ -0,0 +1,181 @@
+from collections import Counter
+from functools import partial
+import os
+from tempfile import TemporaryDirectory
+from types import SimpleNamespace
+from unittest import TestCase
+
+from ..bot import IRacingBot
+from ..cache import FilesystemCache, TieredCache
+from ..checkpoint import StreamCheckpoint
+from ..sharding import HashRing, QueuedComment, ShardedBot
+
+
+class HashRingTestCase(TestCase):
+
+    def test_node_for__spreads_keys_evenly(self):
+        ring = HashRing(range(4))
+        counts = Counter(ring.node_for(f'c{number}') for number in range(10000))
+        self.assertEqual({0, 1, 2, 3}, set(counts))
+        for count in counts.values():
+            self.assertTrue(1500 < count < 3500, counts)
+        self.assertEqual(ring.node_for('abc'), HashRing(range(4)).node_for('abc'))
+
+    def test_add__only_moves_keys_to_the_new_node(self):
+        ring = HashRing(range(4))
+        keys = [f'c{number}' for number in range(10000)]
+        before = {key: ring.node_for(key) for key in keys}
+        ring.add(4)
+        moved = [key for key in keys if ring.node_for(key) != before[key]]
+        self.assertTrue(all(ring.node_for(key) == 4 for key in moved))
+        self.assertLess(len(moved), len(keys) / 3)
+        ring.remove(4)
+        self.assertEqual(before, {key: ring.node_for(key) for key in keys})
+
+    def test_node_for__empty_ring(self):
+        with self.assertRaises(LookupError):
+            HashRing().node_for('abc')
+
+
+class RecordingReddit:
+    """Appends every reply to a file, so the replies of all the worker processes can be checked
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.config = SimpleNamespace(username='irbot')
+
+    def comment(self, comment_id):
+        return SimpleNamespace(reply=lambda body: self.record(comment_id))
+
+    def record(self, comment_id):
+        with open(self.path, 'a') as f:
+            f.write(f'{comment_id}\n')
+
+
+class CrashingResponseGenerator:
+    """Kills the worker process the first time it sees "crash", like an out of memory kill would
+    """
+
+    def __init__(self, marker):
+        self.marker = marker
+
+    def respond_to_request(self, text):
+        if text == 'crash' and not os.path.exists(self.marker):
+            open(self.marker, 'w').close()
+            os._exit(1)
+        return f'response to {text}'
+
+
+def build_worker(directory, index):
+    return IRacingBot(
+        subreddit=['iracing', 'simracing'],
+        sporting_code=None,
+        reddit=RecordingReddit(os.path.join(directory, 'replies')),
+        response_generator=CrashingResponseGenerator(os.path.join(directory, 'crashed')),
+        response_cache=TieredCache(FilesystemCache(os.path.join(directory, 'cache'))),
+        verbose=False,
+    )
+
+
+class ShardedBotTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.directory = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def comments(self, count):
+        comments = [
+            SimpleNamespace(
+                id=f'c{number}', body=f'!irbot question {number}' if number % 3 else 'hello',
+                author=SimpleNamespace(name='someone'), created_utc=number
+            )
+            for number in range(count)
+        ]
+        comments.insert(10, SimpleNamespace(
+            id='crasher', body='!irbot crash', author=SimpleNamespace(name='someone'),
+            created_utc=0
+        ))
+        # the stream replays comments, and one was answered by a bot that ran before
+        return comments + comments[:20] + [SimpleNamespace(
+            id='answered', body='!irbot old', author=SimpleNamespace(name='someone'),
+            created_utc=0
+        )]
+
+    def test_begin_blocking_loop(self):
+        cache = FilesystemCache(os.path.join(self.directory, 'cache'))
+        cache.cache_comment_id('answered')
+        comments = self.comments(300)
+        reddit = SimpleNamespace(subreddit=lambda name: SimpleNamespace(
+            display_name=name, stream=SimpleNamespace(comments=lambda: iter(comments))
+        ))
+        bot = ShardedBot(
+            ['iracing', 'simracing'], reddit,
+            partial(build_worker, self.directory), workers=3
+        )
+        self.assertEqual('iracing+simracing', bot.subreddit)
+        bot.begin_blocking_loop()
+
+        with open(os.path.join(self.directory, 'replies')) as f:
+            replies = Counter(f.read().split())
+        self.assertEqual([], [comment_id for comment_id, count in replies.items() if count > 1])
+        expected = {f'c{number}' for number in range(300) if number % 3}
+        # nothing queued behind the comment a worker died on was lost, and as the comment
+        # wasn't claimed yet, it was answered when the stream replayed it
+        self.assertEqual(expected | {'crasher'}, set(replies))
+        self.assertTrue(os.path.exists(os.path.join(self.directory, 'crashed')))
+        self.assertTrue(all(not process.is_alive() for process in bot.processes))
+
+    def test_begin_blocking_loop__checkpoint_follows_the_workers(self):
+        cache = FilesystemCache(os.path.join(self.directory, 'cache'))
+        comments = [
+            SimpleNamespace(
+                id=f'c{number}', fullname=f't1_c{number}', body=f'!irbot question {number}',
+                author=SimpleNamespace(name='someone'), created_utc=number
+            )
+            for number in range(1, 31)
+        ]
+        reddit = SimpleNamespace(subreddit=lambda name: SimpleNamespace(
+            stream=SimpleNamespace(comments=lambda: iter(comments))
+        ))
+        checkpoint = StreamCheckpoint(cache, save_every=1000, save_interval=3600)
+        bot = ShardedBot(
+            'iracing', reddit, partial(build_worker, self.directory), workers=2,
+            checkpoint=checkpoint
+        )
+        bot.begin_blocking_loop()
+        # only moved up once every comment was handled by a worker
+        self.assertEqual({}, dict(checkpoint.pending))
+        self.assertEqual('t1_c30', cache.load_checkpoint()['fullname'])
+
+    def test_stop__worker_died_with_a_full_queue(self):
+        bot = ShardedBot(
+            'iracing', None, partial(build_worker, self.directory), workers=1, queue_size=1
+        )
+        dead = bot.processes[0] = bot.context.Process(target=os._exit, args=(1,))
+        dead.start()
+        dead.join()
+        bot.queues[0].put({
+            'id': 'c1', 'body': 'hello', 'author': 'someone', 'created_utc': 1
+        })
+        bot.stop(timeout=10)     # restarts the worker to take the STOP rather than hanging
+        self.assertEqual(1, bot.restarts)
+        self.assertFalse(bot.processes[0].is_alive())
+        self.assertEqual(0, bot.processes[0].exitcode)
+
+
+class QueuedCommentTestCase(TestCase):
+
+    def test_message(self):
+        comment = SimpleNamespace(
+            id='abc', body='!irbot hi', author=SimpleNamespace(name='someone'), created_utc=5
+        )
+        queued = QueuedComment(None, **QueuedComment.message(comment))
+        self.assertEqual('t1_abc', queued.fullname)
+        self.assertEqual('someone', queued.author.name)
+        self.assertEqual('!irbot hi', queued.body)
+        deleted = SimpleNamespace(id='def', body='', author=None, created_utc=5)
+        self.assertEqual('[deleted]', QueuedComment.message(deleted)['author'])
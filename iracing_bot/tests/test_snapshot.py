@@ -0,0 +1,68 @@
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from ..sporting_code import SportingCode, Section, BulletFormatter
+
+
+class SportingCodeSnapshotTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.snapshot_path = os.path.join(self.tmp_dir.name, 'snapshot.json.gz')
+        self.bullet_formatter = BulletFormatter()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def build_sporting_code(self):
+        return SportingCode(
+            '',
+            format_overrides={'1.1.': self.bullet_formatter},
+            snapshot_path=self.snapshot_path
+        )
+
+    def test_load_snapshot__round_trip(self):
+        sporting_code = self.build_sporting_code()
+        sporting_code.sections = [
+            Section('1.', 'General', 1, formatter=sporting_code.default_formatter),
+            Section('1.1.', 'first rule', [1, 2], formatter=self.bullet_formatter),
+            Section('2.', 'Other', 2, formatter=sporting_code.default_formatter),
+        ]
+        sporting_code.build_section_hierarchy()
+        sporting_code.version = '2018.09'
+        sporting_code.save_snapshot('key')
+
+        loaded = self.build_sporting_code()
+        self.assertTrue(loaded.load_snapshot('key'))
+        self.assertEqual(['1.', '1.1.', '2.'], [sec.idx for sec in loaded.sections])
+        child = loaded.get_section('1.1.')
+        self.assertEqual(loaded.get_section('1.'), child.parent)
+        self.assertEqual([1, 2], child.page)
+        self.assertIs(self.bullet_formatter, child.formatter)
+        self.assertEqual(['1.', '2.'], [sec.idx for sec in loaded.top_level_sections])
+        self.assertEqual(sporting_code.markdown(), loaded.markdown())
+        self.assertEqual('2018.09', loaded.version)
+
+    def test_load_snapshot__override_added_since(self):
+        sporting_code = SportingCode('', snapshot_path=self.snapshot_path)
+        sporting_code.sections = [
+            Section('1.', 'General', 1, formatter=sporting_code.default_formatter),
+            Section('1.1.', 'first rule', 1, formatter=sporting_code.default_formatter),
+        ]
+        sporting_code.build_section_hierarchy()
+        sporting_code.save_snapshot('key')
+
+        loaded = self.build_sporting_code()
+        self.assertTrue(loaded.load_snapshot('key'))
+        self.assertIs(self.bullet_formatter, loaded.get_section('1.1.').formatter)
+        self.assertIs(loaded.default_formatter, loaded.get_section('1.').formatter)
+
+    def test_load_snapshot__key_mismatch(self):
+        sporting_code = self.build_sporting_code()
+        sporting_code.sections = [Section('1.', 'General', 1, formatter=object())]
+        sporting_code.save_snapshot('old-key')
+        self.assertFalse(self.build_sporting_code().load_snapshot('new-key'))
+
+    def test_load_snapshot__missing_file(self):
+        self.assertFalse(self.build_sporting_code().load_snapshot('key'))
@@ -1,6 +1,9 @@
+import os
+from tempfile import TemporaryDirectory
 from unittest import TestCase
 
-from ..sporting_code import SportingCode, Section
+from ..sporting_code import SportingCode, Section, Formatter, BulletFormatter
+from .utils import write_pdf
 
 
 class SectionHierarchyTestCase(TestCase):
@@ -52,3 +55,144 @@ class SectionHierarchyTestCase(TestCase):
         section_one = sporting_code.get_section('1.')
         self.assertTrue(section_two not in section_one.children)
         self.assertIsNone(section_two.parent)
+
+
+class CountingFormatter(Formatter):
+
+    def __init__(self):
+        self.calls = 0
+
+    def format(self, section):
+        self.calls += 1
+        return super().format(section)
+
+
+class SectionRenderingTestCase(TestCase):
+
+    def setUp(self):
+        self.formatter = CountingFormatter()
+        self.sporting_code = SportingCode('')
+        self.sporting_code.sections = [
+            Section(idx, 'Title', 0, formatter=self.formatter)
+            for idx in ['1.', '1.1.', '1.1.1.', '1.2.']
+        ]
+        self.sporting_code.build_section_hierarchy()
+
+    def test_depth_and_path(self):
+        section = self.sporting_code.get_section('1.1.1.')
+        self.assertEqual(2, section.depth())
+        self.assertEqual(('1.', '1.1.', '1.1.1.'), section.path)
+        self.assertEqual(0, self.sporting_code.get_section('1.').depth())
+
+    def test_depth__updated_when_a_subtree_is_linked(self):
+        root = Section('2.', 'Title', 0, formatter=self.formatter)
+        child = Section('2.1.', 'Title', 0, formatter=self.formatter)
+        grandchild = Section('2.1.1.', 'Title', 0, formatter=self.formatter, parent=child)
+        self.assertEqual(1, grandchild.depth())
+        root.add_subsection(child)
+        self.assertEqual(2, grandchild.depth())
+        self.assertEqual(('2.', '2.1.', '2.1.1.'), grandchild.path)
+        self.assertEqual('### 2.1.1. Title', grandchild.formatted())
+
+    def test_markdown__is_cached(self):
+        markdown = self.sporting_code.markdown()
+        self.assertEqual(4, self.formatter.calls)
+        self.assertEqual(markdown, self.sporting_code.markdown())
+        self.assertEqual(4, self.formatter.calls)
+        self.assertIn('### 1.1.1. Title', markdown)
+
+    def test_markdown__invalidated_by_text(self):
+        self.sporting_code.markdown()
+        self.sporting_code.get_section('1.1.1.').text = 'Renamed'
+        self.assertIn('### 1.1.1. Renamed', self.sporting_code.markdown())
+        # only the changed section is formatted again, its ancestors just re-join their children
+        self.assertEqual(5, self.formatter.calls)
+
+    def test_markdown__invalidated_by_formatter(self):
+        self.sporting_code.markdown()
+        self.sporting_code.get_section('1.2.').formatter = BulletFormatter()
+        self.assertIn('* **1.2.**: Title', self.sporting_code.markdown())
+
+    def test_slots(self):
+        with self.assertRaises(AttributeError):
+            self.sporting_code.get_section('1.').anything = True
+
+
+class SectionLookupTestCase(TestCase):
+
+    def setUp(self):
+        self.sporting_code = SportingCode('')
+        self.sporting_code.sections = [
+            Section(idx, 'no-text', 0, formatter=object())
+            for idx in ['1.', '3.', '3.5.', '3.5.1.', '3.5.1.1.', '3.5.2.', '3.6.', '4.']
+        ]
+        self.sporting_code.build_section_hierarchy()
+
+    def test_get_descendants(self):
+        descendants = self.sporting_code.get_descendants('3.5')
+        self.assertEqual(['3.5.1.', '3.5.1.1.', '3.5.2.'], [sec.idx for sec in descendants])
+        self.assertEqual([], self.sporting_code.get_descendants('9.'))
+
+    def test_get_closest_ancestor(self):
+        self.assertEqual('3.5.1.', self.sporting_code.get_closest_ancestor('3.5.1.9.9').idx)
+        self.assertEqual('3.', self.sporting_code.get_closest_ancestor('3.5.').idx)
+        self.assertEqual('3.', self.sporting_code.get_closest_ancestor('3.7.1').idx)
+        self.assertIsNone(self.sporting_code.get_closest_ancestor('2.1.'))
+
+    def test_build_section_hierarchy__top_level(self):
+        self.assertEqual(
+            ['1.', '3.', '4.'],
+            [sec.idx for sec in self.sporting_code.top_level_sections]
+        )
+
+
+class ParsePdfTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.pdf_path = os.path.join(self.tmp_dir.name, 'sporting_code.pdf')
+        write_pdf(self.pdf_path, [
+            ['Sporting Code', 'Version - 2018.09', '1'],
+            ['Table of Contents', '1. General ... 3', 'Version - 2018.09', '2'],
+            ['1. General', '1.1. The first rule', 'spans lines', 'Version - 2018.09', '3'],
+            ['and pages', '1.2. The second rule', 'Version - 2020.02', '4'],
+        ])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def parse(self, workers):
+        sporting_code = SportingCode(
+            self.pdf_path, cache_directory=os.path.join(self.tmp_dir.name, 'cache'), workers=workers
+        )
+        sporting_code.PAGES_PER_WORKER_TASK = 1
+        sporting_code.parse_pdf()
+        return sporting_code
+
+    def test_parse_pdf(self):
+        sporting_code = self.parse(workers=1)
+        self.assertEqual(['1.', '1.1.', '1.2.'], [sec.idx for sec in sporting_code.sections])
+        first_rule = sporting_code.get_section('1.1')
+        self.assertEqual('The first rule spans lines and pages', first_rule.text)
+        self.assertEqual([3, 4], first_rule.page)
+        self.assertEqual('The second rule', sporting_code.get_section('1.2').text)
+        self.assertEqual(4, sporting_code.get_section('1.2').page)
+        self.assertEqual(sporting_code.get_section('1.'), first_rule.parent)
+        self.assertEqual('2018.09', sporting_code.version)  # from the first footer
+
+    def test_parse_pdf__process_pool(self):
+        serial = self.parse(workers=1)
+        parallel = self.parse(workers=2)
+        self.assertEqual(
+            [(sec.idx, sec.text, sec.page) for sec in serial.sections],
+            [(sec.idx, sec.text, sec.page) for sec in parallel.sections]
+        )
+
+    def test_iter_sections__ignores_leading_text(self):
+        sporting_code = SportingCode('')
+        sections = list(sporting_code.iter_sections([
+            (1, 'preamble'), (1, '2. Title'), (1, '2.1. Body'), (2, 'more'),
+        ]))
+        self.assertEqual(['2.', '2.1.'], [sec.idx for sec in sections])
+        self.assertEqual('Body more', sections[1].text)
+        self.assertEqual([1, 2], sections[1].page)
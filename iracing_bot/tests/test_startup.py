@@ -0,0 +1,95 @@
+import os
+import subprocess
+import sys
+from threading import Event, Thread
+import time
+from unittest import TestCase
+
+from ..startup import Deferred, StagedStartup, interrupt_main
+
+
+class StagedStartupTestCase(TestCase):
+
+    def setUp(self):
+        self.startup = StagedStartup()
+
+    def tearDown(self):
+        self.startup.shutdown()
+
+    def test_run__steps_run_at_the_same_time(self):
+        started = time.perf_counter()
+        for name in ('reddit', 'sporting_code', 'cache'):
+            self.startup.run(name, time.sleep, 0.1)
+        for name in ('reddit', 'sporting_code', 'cache'):
+            self.startup.result(name)
+        self.assertLess(time.perf_counter() - started, 0.25)
+
+    def test_result__raises_the_step_exception(self):
+        def fail():
+            raise ValueError('no reddit')
+        self.startup.run('reddit', fail)
+        with self.assertRaises(ValueError):
+            self.startup.result('reddit')
+        self.assertIn('reddit', self.startup.timings)
+
+    def test_run__critical_failures_stop_the_startup(self):
+        stopped = []
+        startup = StagedStartup(on_critical_failure=lambda: stopped.append(True))
+
+        def fail():
+            raise ValueError('no sporting code')
+        startup.run('reddit', fail)
+        startup.run('training', lambda: 'model', critical=True)
+        startup.run('sporting_code', fail, critical=True)
+        startup.run('response_generator', fail, critical=True)
+        startup.executor.shutdown(wait=True)   # the callbacks have run once the pool is done
+        self.assertEqual([True], stopped)
+
+    def test_interrupt_main(self):
+        with self.assertRaises(KeyboardInterrupt):
+            Thread(target=interrupt_main).start()
+            time.sleep(5)
+
+    def test_report(self):
+        self.startup.run('sporting_code', time.sleep, 0.05)
+        self.startup.run('reddit', lambda: None)
+        self.startup.result('sporting_code')
+        self.startup.result('reddit')
+        self.startup.mark('streaming')
+        report = self.startup.report().splitlines()
+        self.assertEqual('Startup timings:', report[0])
+        self.assertTrue(report[1].strip().startswith('reddit'))
+        self.assertTrue(report[2].strip().startswith('sporting_code'))
+        self.assertTrue(report[3].strip().startswith('streaming'))
+        started, finished = self.startup.timings['sporting_code']
+        self.assertGreaterEqual(finished - started, 0.05)
+
+    def test_deferred__waits_for_the_step(self):
+        ready = Event()
+
+        def load():
+            ready.wait()
+            return 'sporting code'
+
+        deferred = Deferred(self.startup.run('sporting_code', load))
+        self.assertFalse(self.startup.futures['sporting_code'].done())
+        ready.set()
+        self.assertEqual('SPORTING CODE', deferred.upper())
+
+
+class LazyImportTestCase(TestCase):
+
+    def test_heavy_modules_are_only_imported_when_used(self):
+        code = (
+            'import sys\n'
+            'import iracing_bot.bot, iracing_bot.cache, iracing_bot.responder\n'
+            'import iracing_bot.answer_cache, iracing_bot.scheduler, iracing_bot.sharding\n'
+            'import iracing_bot.sporting_code\n'
+            'heavy = ("redis", "diskcache", "pdfminer", "textblob", "nltk", "praw", "numpy")\n'
+            'print(",".join(name for name in heavy if name in sys.modules))\n'
+        )
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        output = subprocess.run(
+            [sys.executable, '-c', code], cwd=root, capture_output=True, text=True, check=True
+        )
+        self.assertEqual('', output.stdout.strip())
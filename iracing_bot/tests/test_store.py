@@ -0,0 +1,281 @@
+import multiprocessing
+import os
+import random
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from ..responder import ResponseGenerator
+from ..sporting_code import BulletFormatter, Section, SportingCode
+from ..store import MappedSportingCode, SportingCodeLibrary, write_store
+from .utils import section_ids
+
+
+WORDS = (
+    'incident points contact penalty protest race driver license safety rating pit lane '
+    'qualifying session steward car track flag caution'
+).split()
+
+
+def build_sporting_code(version, sections, format_overrides=None):
+    """A sporting code as parse_pdf would leave it, from (idx, text, page) tuples
+    """
+    sporting_code = SportingCode('', format_overrides=format_overrides)
+    sporting_code.sections = [
+        Section(idx, text, page, formatter=sporting_code.format_overrides.get(
+            idx, sporting_code.default_formatter
+        ))
+        for idx, text, page in sections
+    ]
+    sporting_code.build_section_hierarchy()
+    sporting_code.build_search_index()
+    sporting_code.version = version
+    return sporting_code
+
+
+def random_sections(count, seed=1):
+    rng = random.Random(seed)
+    return [
+        (idx, ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 30))), number // 20 + 1)
+        for number, idx in enumerate(section_ids(count))
+    ]
+
+
+def search_in_child(path, query):
+    return [section.idx for section in MappedSportingCode(path).search(query, k=3)]
+
+
+OLD_SECTIONS = [
+    ('1.', 'General', 1),
+    ('1.1.', 'Drivers must be nice', 1),
+    ('3.', 'Incidents', 2),
+    ('3.1.', 'Contact is worth 4 incident points', [2, 3]),
+    ('3.2.', 'Off tracks are worth 1 incident point', 3),
+    ('3.10.', 'Loss of control is worth 2 incident points', 3),
+    ('4.', 'Protests', 4),
+]
+NEW_SECTIONS = [
+    ('1.', 'General', 1),
+    ('1.1.', 'Drivers must be nice', 1),
+    ('3.', 'Incidents', 2),
+    ('3.1.', 'Contact is worth 4x incident points', 2),
+    ('3.10.', 'Loss of control is worth 2 incident points', 3),
+    ('3.11.', 'Pit lane speeding is a drive through penalty', 3),
+    ('4.', 'Protests', 4),
+]
+
+
+class MappedSportingCodeTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'sporting_code.irsc')
+        self.bullet_formatter = BulletFormatter()
+        self.sporting_code = build_sporting_code(
+            '2018.09', OLD_SECTIONS, format_overrides={'3.1.': self.bullet_formatter}
+        )
+        write_store(
+            self.path, '2018.09', 'key', self.sporting_code.sections,
+            self.sporting_code.search_index
+        )
+        self.mapped = MappedSportingCode(
+            self.path, format_overrides={'3.1.': self.bullet_formatter}
+        )
+
+    def tearDown(self):
+        self.mapped.close()
+        self.tmp_dir.cleanup()
+
+    def test_sections(self):
+        self.assertEqual('2018.09', self.mapped.version)
+        self.assertEqual('key', self.mapped.key)
+        self.assertEqual(len(OLD_SECTIONS), len(self.mapped))
+        for section in self.sporting_code.sections:
+            mapped = self.mapped.get_section(section.idx)
+            self.assertEqual(section.idx, mapped.idx)
+            self.assertEqual(section.text, mapped.text)
+            self.assertEqual(section.page, mapped.page)
+            self.assertEqual(section.depth(), mapped.depth())
+            self.assertEqual(section.formatted(), mapped.formatted())
+            parent = mapped.parent.idx if mapped.parent is not None else None
+            self.assertEqual(section.parent.idx if section.parent else None, parent)
+
+    def test_get_section(self):
+        self.assertEqual('3.1.', self.mapped.get_section('3.1').idx)
+        self.assertIsNone(self.mapped.get_section('3.3'))
+        self.assertIsNone(self.mapped.get_section('0.'))
+        self.assertIsNone(self.mapped.get_section('9.'))
+
+    def test_get_descendants(self):
+        for idx in ('3', '3.1.', '1.', '4.', '7.'):
+            self.assertEqual(
+                [section.idx for section in self.sporting_code.get_descendants(idx)],
+                [section.idx for section in self.mapped.get_descendants(idx)]
+            )
+
+    def test_get_closest_ancestor(self):
+        for idx in ('3.2.9', '3.1.5.1', '1.', '7.1', '3.10.1'):
+            expected = self.sporting_code.get_closest_ancestor(idx)
+            found = self.mapped.get_closest_ancestor(idx)
+            self.assertEqual(
+                expected.idx if expected else None, found.idx if found else None
+            )
+
+    def test_markdown(self):
+        self.assertEqual(self.sporting_code.markdown(), self.mapped.markdown())
+
+    def test_children(self):
+        sporting_code = build_sporting_code('2020.03', random_sections(300))
+        path = os.path.join(self.tmp_dir.name, 'large.irsc')
+        write_store(path, '2020.03', 'key', sporting_code.sections, sporting_code.search_index)
+        mapped = MappedSportingCode(path)
+        for section in sporting_code.sections:
+            self.assertEqual(
+                [child.idx for child in section.children],
+                [child.idx for child in mapped.get_section(section.idx).children]
+            )
+        self.assertEqual(sporting_code.markdown(), mapped.markdown())
+        mapped.close()
+
+    def test_search__same_as_the_search_index(self):
+        sporting_code = build_sporting_code('2020.03', random_sections(500))
+        path = os.path.join(self.tmp_dir.name, 'large.irsc')
+        write_store(path, '2020.03', 'key', sporting_code.sections, sporting_code.search_index)
+        mapped = MappedSportingCode(path)
+        rng = random.Random(2)
+        for _ in range(50):
+            query = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4)))
+            self.assertEqual(
+                [section.idx for section in sporting_code.search(query, k=5)],
+                [section.idx for section in mapped.search(query, k=5)]
+            )
+        self.assertEqual([], mapped.search('nothing matches this'))
+        for term in ('incid', 'flag', 'nothing'):
+            self.assertEqual(sporting_code.term_share(term), mapped.term_share(term))
+        mapped.close()
+
+    def test_shared_between_processes(self):
+        with multiprocessing.get_context('spawn').Pool(2) as pool:
+            results = pool.starmap(search_in_child, [(self.path, 'incident points')] * 2)
+        expected = [section.idx for section in self.mapped.search('incident points', k=3)]
+        self.assertEqual([expected, expected], results)
+
+    def test_not_a_store(self):
+        path = os.path.join(self.tmp_dir.name, 'other.irsc')
+        with open(path, 'wb') as f:
+            f.write(b'not a sporting code store')
+        with self.assertRaises(ValueError):
+            MappedSportingCode(path)
+
+
+class SportingCodeLibraryTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.library = SportingCodeLibrary(self.tmp_dir.name)
+        self.old = build_sporting_code('2018.09', OLD_SECTIONS)
+        self.new = build_sporting_code('2020.03', NEW_SECTIONS)
+        for sporting_code in (self.old, self.new):
+            sporting_code.content_key = lambda version=sporting_code.version: f'key {version}'
+            self.library.add(sporting_code)
+
+    def tearDown(self):
+        for mapped in self.library.loaded.values():
+            mapped.close()
+        self.tmp_dir.cleanup()
+
+    def test_versions(self):
+        self.assertEqual(['2018.09', '2020.03'], self.library.versions())
+        self.assertEqual('2020.03', self.library.get().version)
+        self.assertEqual('2018.09', self.library.get('2018.09').version)
+        self.assertEqual([], SportingCodeLibrary(os.path.join(self.tmp_dir.name, 'no')).versions())
+
+    def test_add__only_writes_new_parses(self):
+        path = self.library.path_for('2018.09')
+        modified = os.stat(path).st_mtime_ns
+        self.assertIs(self.library.get('2018.09'), self.library.add(self.old))
+        self.assertEqual(modified, os.stat(path).st_mtime_ns)
+        replaced = self.library.get('2018.09')
+        self.old.content_key = lambda: 'reparsed'
+        self.assertEqual('reparsed', self.library.add(self.old).key)
+        self.assertTrue(replaced.mmap.closed)
+        unversioned = build_sporting_code(None, OLD_SECTIONS)
+        with self.assertRaises(ValueError):
+            self.library.add(unversioned)
+
+    def test_diff(self):
+        changes = self.library.diff('2018.09', '2020.03')
+        self.assertEqual(
+            [('changed', '3.1.'), ('removed', '3.2.'), ('added', '3.11.')],
+            [(change.kind, change.idx) for change in changes]
+        )
+        self.assertEqual('Contact is worth 4 incident points', changes[0].old_text)
+        self.assertEqual('Contact is worth 4x incident points', changes[0].new_text)
+        self.assertEqual(
+            ['3.1.'], [change.idx for change in self.library.diff('2018.09', '2020.03', '3.1')]
+        )
+        self.assertEqual([], self.library.diff('2018.09', '2020.03', '1.'))
+
+    def test_describe_changes(self):
+        reply = self.library.describe_changes('2018.09', '2020.03', '3', limit=2)
+        self.assertTrue(reply.startswith(
+            'Changes to section 3 between versions 2018.09 and 2020.03:'
+        ))
+        self.assertIn('**3.1.** changed from:', reply)
+        self.assertIn('**3.2.** was removed: Off tracks are worth 1 incident point', reply)
+        self.assertIn('...and 1 more', reply)
+        self.assertEqual(
+            'Nothing in section 1. changed between versions 2018.09 and 2020.03.',
+            self.library.describe_changes('2018.09', '2020.03', '1.')
+        )
+
+    def test_describe_changes__fits_in_a_comment(self):
+        sections = random_sections(300)
+        longer = [(idx, f'{text} ' * 40, page) for idx, text, page in sections]
+        old, new = build_sporting_code('2021.01', sections), build_sporting_code('2021.02', longer)
+        for sporting_code in (old, new):
+            sporting_code.content_key = lambda: 'key'
+            self.library.add(sporting_code)
+        reply = self.library.describe_changes('2021.01', '2021.02', limit=300)
+        self.assertLessEqual(len(reply), 8000)
+        self.assertRegex(reply, r'\* \.\.\.and \d+ more$')
+
+    def test_response_generator__answers_change_questions(self):
+        generator = ResponseGenerator(
+            training_data=[('what is my safety rating', 'safety-rating')], engine='numpy',
+            sporting_code=self.library.get(), library=self.library
+        )
+        self.assertEqual(
+            self.library.describe_changes('2018.09', '2020.03', '3.1.'),
+            generator.respond_to_request('what changed in 3.1 since 2018.09?')
+        )
+        self.assertEqual(
+            self.library.describe_changes('2018.09', '2020.03', '3.'),
+            generator.respond_to_request('what changed in section 3 since 2018.09?')
+        )
+        # a count isn't a section, and neither is a number no version has as a section
+        self.assertEqual(
+            self.library.describe_changes('2018.09', '2020.03'),
+            generator.respond_to_request('what are the 3 biggest changes in the new version')
+        )
+        self.assertEqual(
+            self.library.describe_changes('2018.09', '2020.03'),
+            generator.respond_to_request('what changed in the last 2.5 versions since 2018.09')
+        )
+        self.assertEqual(
+            self.library.describe_changes('2018.09', '2020.03'),
+            generator.respond_to_request('what are the differences in the new version')
+        )
+        self.assertEqual(
+            self.library.describe_changes('2018.09', '2020.03'),
+            generator.respond_to_request('what changed since the last version?')
+        )
+        # questions that just happen to use the words are answered from the sporting code
+        for text in ('can I change tires in the pit lane?',
+                     'what is the difference between a drive through and a pit lane penalty',
+                     'pit lane speeding changes my safety rating'):
+            self.assertIsNone(generator.describe_changes(text), text)
+        # the mapped sporting code is quoted like the parsed one
+        self.assertEqual(
+            'From the sporting code (page 3):\n\n**3.11.**: Pit lane speeding is a drive through '
+            'penalty', generator.respond_to_request('pit lane speeding')
+        )
@@ -0,0 +1,84 @@
+def _escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def write_pdf(path, pages, font_size=10):
+    """
+    Writes a bare-bones PDF where every page is a list of text lines, which is all we
+    need to stand in for the sporting code without shipping the real (large) PDF.
+    """
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        None,  # page tree, filled in once the page object numbers are known
+        b'<< /Type /Font /Subtype /Type1 /Name /F1 /BaseFont /Helvetica >>',
+    ]
+    page_numbers = []
+    for lines in pages:
+        commands = [f'BT /F1 {font_size} Tf {font_size + 4} TL 50 750 Td']
+        commands.extend(f'({_escape(line)}) Tj T*' for line in lines)
+        commands.append('ET')
+        stream = '\n'.join(commands).encode('latin-1')
+        objects.append(
+            b'<< /Length %d >>\nstream\n' % len(stream) + stream + b'\nendstream'
+        )
+        objects.append(
+            b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+            b'/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>' % (len(objects))
+        )
+        page_numbers.append(len(objects))
+    kids = ' '.join(f'{number} 0 R' for number in page_numbers).encode('latin-1')
+    objects[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, len(page_numbers))
+
+    output = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b'%d 0 obj\n' % number + body + b'\nendobj\n'
+    xref_offset = len(output)
+    output += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    for offset in offsets:
+        output += b'%010d 00000 n \n' % offset
+    output += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (
+        len(objects) + 1, xref_offset
+    )
+    with open(path, 'wb') as f:
+        f.write(output)
+
+
+def section_ids(count, branching=9, depth=4):
+    """The first `count` section IDxs of a tree of sections, in document order
+    """
+    ids = []
+
+    def walk(prefix):
+        for part in range(1, branching + 1):
+            if len(ids) >= count:
+                return
+            idx = prefix + (part,)
+            ids.append('.'.join(str(number) for number in idx) + '.')
+            if len(idx) < depth:
+                walk(idx)
+
+    walk(())
+    return ids
+
+
+def sporting_code_pages(section_count, sections_per_page=20, version='2018.09'):
+    """
+    Generates the pages of a fake sporting code with a cover, a table of contents and
+    `section_count` nested sections, each page ending in the usual footer
+    """
+    pages = [['Sporting Code'], ['Table of Contents']]
+    current = []
+    for number, idx in enumerate(section_ids(section_count)):
+        current.append(f'{idx} Rule number {number} covers the incident and penalty points')
+        current.append(f'that apply to racing section {number}.')
+        if len(current) >= sections_per_page * 2:
+            pages.append(current)
+            current = []
+    if current:
+        pages.append(current)
+    return [
+        lines + [f'Version - {version}', str(page_number)]
+        for page_number, lines in enumerate(pages, start=1)
+    ]
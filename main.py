@@ -1,16 +1,36 @@
+from functools import partial
 import os
+import re
 
 import configargparse
-import praw
 
+from iracing_bot.answer_cache import AnswerCache
+from iracing_bot.autoreply import SubmissionAutoReplier
 from iracing_bot.bot import IRacingBot
-from iracing_bot.cache import FilesystemCache, RedisCache
+from iracing_bot.cache import FilesystemCache, RedisCache, TieredCache
+from iracing_bot.checkpoint import StreamCheckpoint
+from iracing_bot.metrics import METRICS, MetricsServer
+from iracing_bot.profiler import SamplingProfiler
 from iracing_bot.responder import ResponseGenerator
+from iracing_bot.scheduler import DiskRetryQueue, RedisRetryQueue, ReplyScheduler
+from iracing_bot.sharding import ShardedBot
 from iracing_bot.sporting_code import SportingCode, BulletFormatter, ImageFormatter
+from iracing_bot.startup import Deferred, StagedStartup
 
 
 CONFIG_FILE = ".bot.yaml"
 URL = 'https://d3bxz2vegbjddt.cloudfront.net/members/pdfs/FIRST_Sporting_Code_18_09_printable.pdf'
+# Format overrides are used to control how the final sporting code sections
+# are rendered. These are used if the PDF parser cannot correctly / easily
+# pick up the formatting in the PDF file.
+FORMAT_OVERRIDES = {
+    '3.2.2.1.': BulletFormatter(),
+    '3.2.2.2.': BulletFormatter(),
+    '3.5.1.1.': ImageFormatter('https://imgur.com/a/M21QoWv', cut_at='Incident Type'),
+    '3.5.1.2.': ImageFormatter('https://imgur.com/a/yFJQSV2', cut_at='Incident Type'),
+    '3.6.1.1.': ImageFormatter('https://imgur.com/a/1ayfC8y', cut_at='Session Type'),
+    '5.5.4.5.': ImageFormatter('https://imgur.com/a/vdShzku', cut_at='Tier Name')
+}
 
 
 def parse_arguments():
@@ -32,18 +52,132 @@ def parse_arguments():
     p.add('-c', '--config', is_config_file=True, help='override the config file path')
     p.add('-v', '--verbose', help='enable verbose logging', action='store_true', env_var='VERBOSE')
     p.add(
-        '-s', '--subreddit', help='Subreddit to listen to',
-        env_var='REDDIT_SUB', default='iracingbottest'
+        '-s', '--subreddit', type=parse_subreddits, env_var='REDDIT_SUB', default='iracingbottest',
+        help='Subreddit to listen to, several can be given separated by commas or "+"'
+    )
+    p.add(
+        '--shards', type=int, default=1, env_var='SHARDS',
+        help='worker processes the comments are spread over, for when one process can\'t keep up'
     )
     p.add('--sporting-code', help='URL to the PDF of the sporting code', default=URL)
+    p.add(
+        '--pdf-cache-dir', type=str, default='.sporting_code_cache', env_var='PDF_CACHE_DIR',
+        help='Directory to keep the downloaded sporting code PDF in between restarts'
+    )
+    p.add(
+        '--parse-workers', type=int, default=None, env_var='PARSE_WORKERS',
+        help='Processes used to extract the sporting code PDF text (defaults to the CPU count)'
+    )
+    p.add(
+        '--snapshot', type=str, default='.sporting_code_snapshot.json.gz', env_var='SNAPSHOT_PATH',
+        help='File to store the parsed sporting code in so restarts can skip parsing the PDF'
+    )
+    p.add(
+        '--store-dir', type=str, default=None, env_var='STORE_DIR',
+        help='directory to keep memory mapped sporting code versions in, shared by every bot '
+             'process, which lets people ask what changed between them; off by default'
+    )
     p.add(
         '-d', '--training', type=str, default='training.yaml',
         env_var='TRAINING_PATH', help='Training YAML file to load from'
     )
+    p.add(
+        '--model', type=str, default='.iracing_bot_model.pickle', env_var='MODEL_PATH',
+        help='File the trained classifier is stored in (see `python -m iracing_bot build-model`)'
+    )
+    p.add(
+        '--classifier', type=str, choices=['textblob', 'numpy'], default='textblob',
+        env_var='CLASSIFIER_ENGINE', help='Naive Bayes implementation used to classify comments'
+    )
+    p.add(
+        '--training-reload-interval', type=float, default=5, env_var='TRAINING_RELOAD_INTERVAL',
+        help='seconds between checks for changes to the training file, 0 to never reload it'
+    )
+    p.add(
+        '--answer-cache-size', type=int, default=1000, env_var='ANSWER_CACHE_SIZE',
+        help='replies remembered so rephrasings of a request get the same one, 0 to disable'
+    )
+    p.add(
+        '--answer-cache-ttl', type=float, default=6 * 60 * 60, env_var='ANSWER_CACHE_TTL',
+        help='seconds a remembered reply can be reused for'
+    )
+    p.add(
+        '--answer-cache-common-share', type=float, default=0.2,
+        env_var='ANSWER_CACHE_COMMON_SHARE',
+        help='share (0 to 1) of sporting code sections a word has to be in for rephrasings of a '
+             'request to be able to leave it out and still reuse its reply'
+    )
+    p.add(
+        '--prefilter-min-keywords', type=int, default=None, env_var='PREFILTER_MIN_KEYWORDS',
+        help='only classify texts mentioning at least this many words of the training data'
+    )
+    p.add(
+        '--auto-reply', action='store_true', env_var='AUTO_REPLY',
+        help='also reply to new submissions the classifier is at least --auto-reply-threshold '
+             'sure about, without being summoned'
+    )
+    p.add(
+        '--auto-reply-threshold', type=float, default=0.8, env_var='AUTO_REPLY_THRESHOLD',
+        help='probability a submission\'s topic needs before it is auto-replied to'
+    )
+    p.add(
+        '--batch-size', type=int, default=16, env_var='BATCH_SIZE',
+        help='most submissions --auto-reply classifies at once'
+    )
+    p.add(
+        '--batch-wait', type=float, default=1.0, env_var='BATCH_WAIT',
+        help='seconds --auto-reply waits for a batch to fill up before classifying it anyway'
+    )
+    p.add(
+        '--async-pipeline', action='store_true', env_var='ASYNC_PIPELINE',
+        help='process comments with concurrent asyncio stages instead of one at a time'
+    )
+    p.add(
+        '--reply-workers', type=int, default=4, env_var='REPLY_WORKERS',
+        help='number of concurrent reply workers used by --async-pipeline'
+    )
     p.add(
         '--cache', type=str, choices=['redis', 'disk'], default='disk',
         env_var='BOT_CACHE_TYPE', help='Type of cache to use for responses'
     )
+    p.add(
+        '--cache-ttl', type=int, default=30 * 24 * 60 * 60, env_var='BOT_CACHE_TTL',
+        help='seconds before a responded to comment is forgotten by the cache'
+    )
+    p.add(
+        '--cache-dir', type=str, default='.iracing_bot_cache', env_var='BOT_CACHE_DIR',
+        help='directory used by the disk cache'
+    )
+    p.add(
+        '--cache-size-limit', type=int, default=64 * 1024 * 1024, env_var='BOT_CACHE_SIZE_LIMIT',
+        help='bytes the disk cache may use before the oldest comments are evicted'
+    )
+    p.add(
+        '--reply-rate', type=float, default=0.5, env_var='REPLY_RATE',
+        help='replies per second allowed on average, bursts of up to --reply-burst are allowed'
+    )
+    p.add('--reply-burst', type=int, default=5, env_var='REPLY_BURST', help='see --reply-rate')
+    p.add(
+        '--local-cache-size', type=int, default=10000, env_var='LOCAL_CACHE_SIZE',
+        help='comment ids kept in memory in front of the response cache'
+    )
+    p.add(
+        '--metrics-port', type=int, default=None, env_var='METRICS_PORT',
+        help='serve Prometheus metrics at http://<--metrics-host>:<port>/metrics'
+    )
+    p.add(
+        '--metrics-host', type=str, default='127.0.0.1', env_var='METRICS_HOST',
+        help='interface the metrics endpoint listens on, see --metrics-port'
+    )
+    p.add(
+        '--profile', type=str, default=None, env_var='PROFILE_PATH',
+        help='sample the bot loop and write collapsed stacks (for flame graphs) to this file, '
+             'rewritten every minute while the bot runs'
+    )
+    p.add(
+        '--profile-interval', type=float, default=0.01, env_var='PROFILE_INTERVAL',
+        help='seconds between --profile samples'
+    )
 
     # Authentication Flags
     # --------------------
@@ -63,64 +197,235 @@ def parse_arguments():
         '--client-secret', required=True, env_var='REDDIT_CLIENT_SECRET',
         help='reddit client secret of the associated app for auth', type=str
     )
-    return p.parse_args()
+    options = p.parse_args()
+    if options.shards > 1:
+        for flag, value in (('--auto-reply', options.auto_reply),
+                            ('--async-pipeline', options.async_pipeline),
+                            ('--profile', options.profile)):
+            if value:
+                p.error(f'{flag} can only be used with a single shard for now')
+    return options
 
 
-def main():
-    """Entrypoint for the entire application"""
-    options = parse_arguments()
+def parse_subreddits(value):
+    """"iracing, simracing" or "iracing+simracing" to ['iracing', 'simracing']"""
+    return [name for name in re.split(r'[\s,+]+', value) if name]
 
-    # 1. Sporting code is used to link to specific sections in the sporting code
+
+def load_sporting_code(options, library=None):
+    """
+    Sporting code is used to link to specific sections in the sporting code. With a library
+    it is stored there and served from the memory mapped copy, which all processes share.
+    """
     sporting_code = SportingCode(
         options.sporting_code,
-        # Format overrides are used to control how the final sporting code sections
-        # are rendered. These are used if the PDF parser cannot correctly / easily
-        # pick up the formatting in the PDF file.
-        format_overrides={
-            '3.2.2.1.': BulletFormatter(),
-            '3.2.2.2.': BulletFormatter(),
-            '3.5.1.1.': ImageFormatter('https://imgur.com/a/M21QoWv', cut_at='Incident Type'),
-            '3.5.1.2.': ImageFormatter('https://imgur.com/a/yFJQSV2', cut_at='Incident Type'),
-            '3.6.1.1.': ImageFormatter('https://imgur.com/a/1ayfC8y', cut_at='Session Type'),
-            '5.5.4.5.': ImageFormatter('https://imgur.com/a/vdShzku', cut_at='Tier Name')
-        }
+        format_overrides=FORMAT_OVERRIDES,
+        snapshot_path=options.snapshot,
+        cache_directory=options.pdf_cache_dir,
+        workers=options.parse_workers
     )
     print(f"⌚️Attempting to parse Sporting Code PDF...")
     sporting_code.parse_pdf()
     print("🎉Parsed Successfully!")
+    if library is None:
+        return sporting_code
+    try:
+        mapped = library.add(sporting_code)
+    except ValueError as e:
+        print(f'could not store the sporting code in {library.directory}: {e}')
+        return sporting_code
+    print(f'Serving sporting code version {mapped.version} from {mapped.path}')
+    return mapped
 
-    # 2. Reddit authentication instance
+
+def connect_reddit(options):
+    """Reddit authentication instance"""
     print(f"⌚️Attempting connection to Reddit as {options.username}...")
+    import praw  # slow to import, so it's done on the startup thread pool
+
     reddit = praw.Reddit(
         user_agent=f"iRacing Bot (by {options.username})",
         client_id=options.client_id, client_secret=options.client_secret,
         username=options.username, password=options.password
     )
     print("🎉Connected Successfully!")
+    return reddit
+
 
-    # 3. Response Generator
+def load_response_generator(options, sporting_code_loaded, library=None, watch=True):
+    """
+    Trains (or loads) the classifier while the sporting code is still being parsed, but
+    only hands the generator over once the sporting code it quotes from is ready
+    """
     print(f"⌚️Training Response Generator from file {options.training}...")
-    response_generator = ResponseGenerator(training_file=options.training)
+    response_generator = create_response_generator(
+        options, Deferred(sporting_code_loaded), library
+    )
     print(f"🎉Training Successfully!")
+    if watch and options.training_reload_interval:
+        response_generator.watch_training(interval=options.training_reload_interval)
+    sporting_code_loaded.result()
+    return response_generator
+
+
+def create_response_generator(options, sporting_code, library=None):
+    """The response generator, with an answer cache if one is configured"""
+    answer_cache = None
+    if options.answer_cache_size:
+        answer_cache = AnswerCache(
+            max_entries=options.answer_cache_size, ttl=options.answer_cache_ttl,
+            common_share=options.answer_cache_common_share
+        )
+        METRICS.gauge('iracing_bot_answer_cache_entries', lambda: len(answer_cache))
+    return ResponseGenerator(
+        training_file=options.training, sporting_code=sporting_code,
+        model_path=options.model, engine=options.classifier, answer_cache=answer_cache,
+        prefilter_min_keywords=options.prefilter_min_keywords, library=library
+    )
+
+
+def open_library(options):
+    """The sporting code store, if there is a --store-dir"""
+    if not options.store_dir:
+        return None
+    from iracing_bot.store import SportingCodeLibrary  # numpy is slow to import
+    return SportingCodeLibrary(options.store_dir, format_overrides=FORMAT_OVERRIDES)
+
 
-    # 4. Response cache to prevent us from answering the same comment twice
+def create_cache(options):
+    """Response cache to prevent us from answering the same comment twice"""
     if options.cache == 'disk':
         print('Using the filesystem to cache comments')
-        cache = FilesystemCache('.iracing_bot_cache')  # TODO: make this arg an option
+        cache = FilesystemCache(
+            options.cache_dir, size_limit=options.cache_size_limit, ttl=options.cache_ttl
+        )
+        retry_queue = DiskRetryQueue(os.path.join(options.cache_dir, 'reply_retries'))
     elif options.cache == 'redis':
         print('Using Redis to cache comments')
-        cache = RedisCache(os.getenv('REDISCLOUD_URL'))
+        cache = RedisCache(os.getenv('REDISCLOUD_URL'), ttl=options.cache_ttl)
+        retry_queue = RedisRetryQueue(cache.conn)
+    return TieredCache(cache, max_entries=options.local_cache_size), retry_queue
+
+
+def build_worker_bot(options, version, index):
+    """
+    Builds the bot of one `ShardedBot` worker process. Nothing is inherited from the parent
+    process, so every worker logs in, opens the cache and loads the response generator
+    itself: the model from the file the parent stored it in, and the sporting code `version`
+    the parent loaded from the shared store (or the snapshot, without one). Each worker gets
+    its share of the reply rate so that all of them together stay within Reddit's limits.
+    """
+    reddit = connect_reddit(options)
+    cache, retry_queue = create_cache(options)
+    library = open_library(options)
+    if library is not None and version in library.versions():
+        sporting_code = library.get(version)
+    else:
+        sporting_code = load_sporting_code(options)
+    response_generator = create_response_generator(options, sporting_code, library)
+    reply_scheduler = ReplyScheduler(
+        reddit, cache, retry_queue,
+        rate=options.reply_rate / options.shards,
+        burst=max(1, options.reply_burst // options.shards)
+    )
+    reply_scheduler.start()
+    if options.training_reload_interval:
+        response_generator.watch_training(interval=options.training_reload_interval)
+    return IRacingBot(
+        subreddit=options.subreddit,
+        sporting_code=None,
+        reddit=reddit,
+        response_generator=response_generator,
+        response_cache=cache,
+        verbose=options.verbose,
+        reply_scheduler=reply_scheduler,
+    )
+
+
+def main():
+    """Entrypoint for the entire application"""
+    options = parse_arguments()
+
+    # 0. Metrics are served from the start so slow startups can be seen too
+    if options.metrics_port is not None:
+        metrics_server = MetricsServer(
+            METRICS, host=options.metrics_host, port=options.metrics_port
+        )
+        metrics_server.start()
+        print(f'Serving metrics on http://{options.metrics_host}:{metrics_server.port}/metrics')
+
+    # 1. Parsing, logging in, training and opening the cache don't depend on each other,
+    #    so they all start at once
+    startup = StagedStartup()
+    library = open_library(options)
+    #    The bot can't reply without the sporting code and response generator, so if either
+    #    fails the bot stops then and there rather than on the first request
+    sporting_code_loaded = startup.run(
+        'sporting_code', load_sporting_code, options, library, critical=True
+    )
+    startup.run('reddit', connect_reddit, options)
+    startup.run('cache', create_cache, options)
+    response_generator = Deferred(startup.run(
+        'response_generator', load_response_generator, options, sporting_code_loaded, library,
+        options.shards <= 1, critical=True
+    ))
+
+    # 2. Streaming only needs Reddit and the cache; replying waits on the response generator
+    reddit = startup.result('reddit')
+    cache, retry_queue = startup.result('cache')
+
+    if options.shards > 1:
+        # Workers are only started once the sporting code is stored and the model is saved,
+        # so they can load both instead of parsing and training all over again
+        startup.result('response_generator')
+        bot = ShardedBot(
+            options.subreddit, reddit,
+            partial(build_worker_bot, options, sporting_code_loaded.result().version),
+            workers=options.shards, checkpoint=StreamCheckpoint(cache)
+        )
+        startup.mark('streaming')
+        print(startup.report())
+        bot.begin_blocking_loop()
+        return
+
+    # Replies are paced against Reddit's rate limits and failed ones are retried
+    reply_scheduler = ReplyScheduler(
+        reddit, cache, retry_queue, rate=options.reply_rate, burst=options.reply_burst
+    )
+    reply_scheduler.start()
+    METRICS.gauge('iracing_bot_reply_retry_queue_depth', lambda: reply_scheduler.queue_depth)
 
     # Core iRacing bot that orchestrates everything
     bot = IRacingBot(
         subreddit=options.subreddit,
-        sporting_code=sporting_code,
+        sporting_code=None,     # parsed by the startup step above
         reddit=reddit,
         response_generator=response_generator,
         response_cache=cache,
         verbose=options.verbose,
+        reply_scheduler=reply_scheduler,
+        # Resume the stream where the last run left off instead of re-scanning the backlog
+        checkpoint=StreamCheckpoint(cache),
+        profiler=SamplingProfiler(
+            options.profile, interval=options.profile_interval
+        ) if options.profile else None,
     )
-    bot.begin_blocking_loop()
+    if options.auto_reply:
+        SubmissionAutoReplier(
+            bot, threshold=options.auto_reply_threshold, batch_size=options.batch_size,
+            max_wait=options.batch_wait
+        ).start()
+    startup.mark('streaming')
+    startup.report_when_done()
+    try:
+        if options.async_pipeline:
+            bot.begin_async_loop(reply_workers=options.reply_workers)
+        else:
+            bot.begin_blocking_loop()
+    finally:
+        if bot.profiler is not None:
+            report = bot.profiler.report()
+            print(f'wrote {report["samples"]} profile samples to {report["output_path"]}')
 
 
 if __name__ == '__main__':